@@ -1,88 +1,366 @@
+import csv
+import io
 import sqlite3
 import os
-from flask import Flask, render_template, request, jsonify
-from datetime import datetime
+import threading
+import time
+import click
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, g, render_template, request, jsonify
+from flask.cli import AppGroup
+from datetime import date, datetime
+
+from db_pool import ConnectionPool
+import index_advisor
+import ingestion
+import live_prices
+from instrumentation import PROGRESS_STEPS, Metrics, QueryTimer, RequestProfiler, gauge_lines
+import price_store
+import response_encoding
+from migrations import apply_migrations, ensure_schema
+from pnl import METHODS as PNL_METHODS, rebuild_realized_gains, sync_realized_gains
+from positions import positions_need_rebuild, rebuild_positions, verify_positions
+from query_cache import ResultCache, table_versions
+from query_jobs import QueryRunner, QueueFull, deadline_handler
+from query_params import Param, date_range, depot_filter, investor_filter, isin_filter
+import query_params
+from replica import MemoryReplica
+from result_stream import (decode_cursor, encode_cursor, fetch_keyset_page, fetch_page,
+                           keyset_cursor, keyset_page, sort_keys, stream_json, stream_ndjson)
+import sharding
+import snapshots
+import startup
+from schema_info import (STATISTICS_SQL, SchemaCache, approximate_row_counts,
+                         database_statistics, exact_row_counts, row_count_sql)
 
 app = Flask(__name__)
+app.json = response_encoding.JSONProvider(app)
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'database', 'aktienportfolio.db')
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'database', 'schema.sql')
 DATA_PATH = os.path.join(os.path.dirname(__file__), 'database', 'sample_data.sql')
 
+# Connection pool settings (can be tuned via environment variables)
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', 16))
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 268435456)),
+    'temp_store': 'MEMORY',
+}
+# Prepared statements cached per connection (one per distinct parameterized SQL text)
+STATEMENT_CACHE_SIZE = int(os.environ.get('SQLITE_STATEMENT_CACHE', 256))
+
+# Result cache for predefined queries
+RESULT_CACHE = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 128)),
+    ttl=int(os.environ.get('RESULT_CACHE_TTL', 300)),
+)
+
+# Table metadata for /schema, re-read only when PRAGMA schema_version changes
+SCHEMA_CACHE = SchemaCache()
+
+# Hard caps per request (rows for regular responses, rows/bytes for streams)
+MAX_RESULT_ROWS = int(os.environ.get('MAX_RESULT_ROWS', 10000))
+MAX_STREAM_ROWS = int(os.environ.get('MAX_STREAM_ROWS', 1000000))
+MAX_STREAM_BYTES = int(os.environ.get('MAX_STREAM_BYTES', 256 * 1024 * 1024))
+
+# Custom queries run on a bounded worker pool with a deadline and a row cap
+CUSTOM_QUERY_WORKERS = int(os.environ.get('CUSTOM_QUERY_WORKERS', 4))
+CUSTOM_QUERY_MAX_QUEUED = int(os.environ.get('CUSTOM_QUERY_MAX_QUEUED', 32))
+CUSTOM_QUERY_TIMEOUT = float(os.environ.get('CUSTOM_QUERY_TIMEOUT', 30))
+JOB_TIMEOUT = float(os.environ.get('JOB_TIMEOUT', 600))
+# Asynchronous jobs run on their own threads, next to the CUSTOM_QUERY_WORKERS
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_ROWS = int(os.environ.get('JOB_MAX_ROWS', 100000))
+JOB_HISTORY = int(os.environ.get('JOB_HISTORY', 100))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 600))
+
+# Dashboard batches: queries of one /batch request run concurrently on this many
+# threads (SQLite releases the GIL while it executes, so one per core pays off)
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', min(8, os.cpu_count() or 1)))
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', 32))
+
+# JSON and text responses larger than this are gzip/brotli compressed if the client accepts it
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+
+# Instrumentation: queries slower than SLOW_QUERY_MS land in the slow-query log;
+# REQUEST_PROFILING=1 allows ?profile=1 to return a cProfile report for one request
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 500))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 100))
+REQUEST_PROFILING = os.environ.get('REQUEST_PROFILING', '0') == '1'
+
+# Optional columnar Kursverlauf store (requires NumPy; PRICE_STORE=0 disables it)
+PRICE_STORE_PATH = os.path.join(os.path.dirname(__file__), 'database', 'kursverlauf_store')
+PRICE_STORE = (price_store.PriceStore(PRICE_STORE_PATH)
+               if price_store.available() and os.environ.get('PRICE_STORE', '1') != '0'
+               else None)
+
+# Live prices: POST /prices/ticks revalues the holders of the ticked ISINs and
+# pushes the result to GET /events (Server-Sent Events); investors whose largest
+# sector exceeds RISK_ALERT_THRESHOLD of their portfolio get 'risk' events
+RISK_ALERT_THRESHOLD = float(os.environ.get('RISK_ALERT_THRESHOLD', 0.5))
+SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', 100))
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+
+# Archive file for the old years of HistorischerDepotwert (`flask snapshots archive`)
+HISTORY_ARCHIVE_DIR = os.environ.get(
+    'HISTORY_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'database', 'archive'))
+
+# Optional sharded deployment built by `flask shards build`: with SHARD_DIR set,
+# predefined queries read the shard files (one per InvestorID % N) instead of
+# DATABASE_PATH; SHARD_WORKERS processes run the scatter-gather reports. The
+# shards are a copy of DATABASE_PATH, so the write endpoints (/ingest,
+# /prices/ticks) are refused while they are in use; the other endpoints keep
+# reading DATABASE_PATH, which stays identical to the shards
+SHARD_DIR = os.environ.get('SHARD_DIR')
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', 0)) or None
+SHARDS = (sharding.ShardSet(SHARD_DIR, SHARD_WORKERS, pragmas=SQLITE_PRAGMAS)
+          if SHARD_DIR and os.path.exists(os.path.join(SHARD_DIR, sharding.MANIFEST)) else None)
+
+# Startup: an empty DATABASE_PATH is restored from BOOTSTRAP_SNAPSHOT (written by
+# `flask startup snapshot`) instead of replaying schema.sql and sample_data.sql;
+# the warm-up checks every predefined query, preloads up to WARMUP_PRELOAD_BYTES
+# of the database file and runs each query once (STARTUP_WARMUP=full; 'prepare'
+# only checks the queries, '0' turns the warm-up off)
+SNAPSHOT_PATH = os.environ.get(
+    'BOOTSTRAP_SNAPSHOT', os.path.join(os.path.dirname(__file__), 'database', 'snapshot.db'))
+STARTUP_WARMUP = os.environ.get('STARTUP_WARMUP', 'full')
+WARMUP_PRELOAD_BYTES = int(os.environ.get('WARMUP_PRELOAD_BYTES', SQLITE_PRAGMAS['mmap_size']))
+
+# Optional in-memory read replica (READ_REPLICA=1): predefined queries and
+# /custom_query read from :memory: copies of the database in each worker, at
+# most REPLICA_MAX_STALENESS seconds behind the file; writes still go to disk
+READ_REPLICA = os.environ.get('READ_REPLICA', '0') == '1'
+REPLICA_CONNECTIONS = int(os.environ.get('REPLICA_CONNECTIONS', 2))
+REPLICA_MAX_STALENESS = float(os.environ.get('REPLICA_MAX_STALENESS', 1.0))
+REPLICA_MAX_BYTES = int(os.environ.get('REPLICA_MAX_BYTES', 512 * 1024 * 1024))
+
+_pools = {}
+_pools_lock = threading.Lock()
+_replica = None
+
+
+def get_pool(readonly=False):
+    """Return the (lazily created) write or read-only connection pool."""
+    key = 'read' if readonly else 'write'
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    DATABASE_PATH,
+                    max_connections=READ_POOL_SIZE if readonly else POOL_SIZE,
+                    readonly=readonly,
+                    pragmas=SQLITE_PRAGMAS,
+                    cached_statements=STATEMENT_CACHE_SIZE,
+                )
+                pool.on_connect.append(attach_history_archives)
+                _pools[key] = pool
+    return pool
+
+
+def attach_history_archives(conn):
+    """Make the archived HistorischerDepotwert rows visible to a new connection."""
+    snapshots.attach_archives(conn, HISTORY_ARCHIVE_DIR)
+
+
+def refresh_depot_summary(conn):
+    # Archived partitions belong to the unsharded database
+    snapshots.refresh_summary(conn, HISTORY_ARCHIVE_DIR if SHARDS is None else None)
+
+
+def get_replica():
+    """Return the (lazily created) in-memory replica, or None if it is not enabled."""
+    global _replica
+    # Sharded deployments read from the shard files
+    if not READ_REPLICA or SHARDS is not None:
+        return None
+    if _replica is None:
+        with _pools_lock:
+            if _replica is None:
+                _replica = MemoryReplica(
+                    DATABASE_PATH,
+                    max_connections=REPLICA_CONNECTIONS,
+                    max_staleness=REPLICA_MAX_STALENESS,
+                    max_bytes=REPLICA_MAX_BYTES,
+                    cached_statements=STATEMENT_CACHE_SIZE,
+                )
+                _replica.on_connect.append(attach_history_archives)
+    return _replica
+
+
+def close_pools():
+    """Close all pooled connections (e.g. before replacing the database file)."""
+    global _replica
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+        if _replica is not None:
+            _replica.close()
+            _replica = None
+
+
+def get_db_connection(readonly=False):
+    """Get a pooled database connection with foreign keys enabled.
+
+    Calling close() on the returned connection hands it back to the pool.
+    Reporting endpoints should pass readonly=True to use the read-only pool.
+    """
+    return get_pool(readonly).acquire()
+
+
+def get_read_connection():
+    """Connection for report queries: a replica copy if one is free, else the read-only pool."""
+    replica = get_replica()
+    if replica is not None:
+        try:
+            conn = replica.acquire()
+        except sqlite3.Error:
+            conn = None
+        if conn is not None:
+            return conn
+    return get_db_connection(readonly=True)
+
+
+def sharded_write_error():
+    """Error response for write endpoints in a sharded deployment, None otherwise."""
+    if SHARDS is None:
+        return None
+    return jsonify({'error': 'Schreibzugriffe sind mit SHARD_DIR deaktiviert: Daten in die '
+                             'Hauptdatenbank laden und `flask shards build` erneut ausführen'}), 409
+
+
+def explain_plan(sql, params=()):
+    """EXPLAIN QUERY PLAN details for a statement (used by the slow-query log)."""
+    with get_db_connection(readonly=True) as conn:
+        return [detail for _, _, detail in index_advisor.explain(conn, sql, params)]
+
+
+METRICS = Metrics(slow_query_ms=SLOW_QUERY_MS, slow_log_size=SLOW_QUERY_LOG_SIZE,
+                  explain=explain_plan)
+PROFILER = RequestProfiler()
 
-def get_db_connection():
-    """Create a database connection with foreign keys enabled"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
+QUERY_RUNNER = QueryRunner(
+    get_read_connection,
+    workers=CUSTOM_QUERY_WORKERS,
+    job_workers=JOB_WORKERS,
+    max_queued=CUSTOM_QUERY_MAX_QUEUED,
+    timeout=CUSTOM_QUERY_TIMEOUT,
+    max_rows=MAX_RESULT_ROWS,
+    history=JOB_HISTORY,
+    result_ttl=JOB_RESULT_TTL,
+    metrics=METRICS,
+)
+
+
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch-query')
+
+HOLDERS_INDEX = live_prices.HoldersIndex(threshold=RISK_ALERT_THRESHOLD)
+EVENT_HUB = live_prices.EventHub(max_clients=SSE_MAX_CLIENTS)
+# Tick batches are applied one at a time, so the index sees prices in commit order
+_ticks_lock = threading.Lock()
+
+
+# Durations and outcome of init_database and warm_up (shown in /pool_stats and /metrics)
+STARTUP_STATS = {}
 
 
 def init_database():
-    """Initialize the database with schema and sample data"""
+    """Initialize the database with schema and sample data.
+
+    An empty database is restored from SNAPSHOT_PATH if a snapshot exists.
+    Schema, sample data and migrations only run if the database is not at
+    the current schema version (see migrations.ensure_schema), so starting
+    against an existing database does no work. Returns the steps that ran.
+    """
+    started = time.perf_counter()
     # Ensure database directory exists
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
     
-    conn = get_db_connection()
-    
-    # Read and execute schema
-    with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
-        conn.executescript(f.read())
+    steps = []
+    if os.path.exists(SNAPSHOT_PATH) and startup.is_empty(DATABASE_PATH):
+        close_pools()
+        startup.restore_snapshot(SNAPSHOT_PATH, DATABASE_PATH)
+        steps.append('snapshot')
     
-    # Check if data already exists
-    cursor = conn.execute("SELECT COUNT(*) FROM Unternehmen")
-    if cursor.fetchone()[0] == 0:
-        # Read and execute sample data
-        with open(DATA_PATH, 'r', encoding='utf-8') as f:
-            conn.executescript(f.read())
+    conn = get_db_connection()
+    try:
+        schema_steps = ensure_schema(conn, SCHEMA_PATH, DATA_PATH)
+        # Databases created before the Position table existed need a one-off rebuild
+        if schema_steps and positions_need_rebuild(conn):
+            rebuild_positions(conn)
+            schema_steps.append('positions')
+        conn.commit()
+        # Per-year archive files of earlier versions go into the one archive file
+        if snapshots.merge_partitions(conn, HISTORY_ARCHIVE_DIR):
+            schema_steps.append('archive')
+    finally:
+        conn.close()
+    steps += schema_steps
     
-    conn.commit()
-    conn.close()
+    STARTUP_STATS['init_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    STARTUP_STATS['init_steps'] = steps
+    return steps
 
 PREDEFINED_QUERIES = {
     "portfolio_overview": {
         "name": "Portfolio-Übersicht: Aktuelle Positionen und Gewinne/Verluste",
         "description": "Zeigt für jeden Investor den aktuellen Wert seiner Positionen und den unrealisierten Gewinn/Verlust - wichtig für die Vermögensübersicht.",
+        # Sort columns of paginated results ('-' = descending); the pages are
+        # cut by keyset, see result_stream.fetch_keyset_page
+        "order": ('Nachname', 'Depot', '-AktuellerWert'),
         "query": """
             SELECT 
                 i.Vorname || ' ' || i.Nachname AS Investor,
+                i.Nachname,
                 d.Bezeichnung AS Depot,
                 u.Name AS Unternehmen,
                 a.Ticker,
-                SUM(CASE WHEN t.Typ = 'Kauf' THEN t.Menge ELSE -t.Menge END) AS AktuelleAnzahl,
-                ROUND(AVG(CASE WHEN t.Typ = 'Kauf' THEN t.Stueckpreis END), 2) AS DurchschnittlicherKaufpreis,
+                p.Menge AS AktuelleAnzahl,
+                ROUND(p.SummeKaufpreise * 1.0 / NULLIF(p.AnzahlKaeufe, 0), 2) AS DurchschnittlicherKaufpreis,
                 a.AktuellerKurs,
-                ROUND(SUM(CASE WHEN t.Typ = 'Kauf' THEN t.Menge ELSE -t.Menge END) * a.AktuellerKurs, 2) AS AktuellerWert,
-                ROUND(SUM(CASE WHEN t.Typ = 'Kauf' THEN t.Menge ELSE -t.Menge END) * 
-                    (a.AktuellerKurs - AVG(CASE WHEN t.Typ = 'Kauf' THEN t.Stueckpreis END)), 2) AS UnrealisierterGewinn
-            FROM Transaktionen t
-            JOIN Depot d ON t.DepotID = d.DepotID
+                ROUND(p.Menge * a.AktuellerKurs, 2) AS AktuellerWert,
+                ROUND(p.Menge * 
+                    (a.AktuellerKurs - p.SummeKaufpreise * 1.0 / NULLIF(p.AnzahlKaeufe, 0)), 2) AS UnrealisierterGewinn
+            FROM Position p
+            JOIN Depot d ON p.DepotID = d.DepotID
             JOIN Investor i ON d.InvestorID = i.InvestorID
-            JOIN Aktie a ON t.ISIN = a.ISIN
+            JOIN Aktie a ON p.ISIN = a.ISIN
             JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
-            WHERE d.Status = 'Aktiv'
-            GROUP BY i.InvestorID, d.DepotID, a.ISIN
-            HAVING AktuelleAnzahl > 0
+            WHERE d.Status = 'Aktiv' AND p.Menge > 0 {filters}
             ORDER BY i.Nachname, d.Bezeichnung, AktuellerWert DESC
-        """
+        """,
+        "params": {
+            "investor": investor_filter('d.InvestorID'),
+            "depot": depot_filter('p.DepotID'),
+            "isin": isin_filter('p.ISIN'),
+        },
+        # Sharded deployments: per-shard results are disjoint, only the order is restored
+        "shards": {"merge": "SELECT * FROM Teilergebnis ORDER BY Nachname, Depot, AktuellerWert DESC"}
     },
     
     "risk_concentration": {
         "name": "Risikoanalyse: Investoren mit hoher Branchenkonzentration",
         "description": "Identifiziert Investoren, die mehr als 50% ihres Portfolios in einer Branche haben - wichtig für Risikomanagement und Diversifikationsberatung.",
+        "order": ('-ProzentAnteil',),
         "query": """
             WITH PortfolioPerBranche AS (
                 SELECT 
                     i.InvestorID,
                     i.Vorname || ' ' || i.Nachname AS Investor,
                     u.Branche,
-                    SUM(CASE WHEN t.Typ = 'Kauf' THEN t.Menge ELSE -t.Menge END) * a.AktuellerKurs AS BranchenWert
-                FROM Transaktionen t
-                JOIN Depot d ON t.DepotID = d.DepotID
+                    SUM(p.Menge * a.AktuellerKurs) AS BranchenWert
+                FROM Position p
+                JOIN Depot d ON p.DepotID = d.DepotID
                 JOIN Investor i ON d.InvestorID = i.InvestorID
-                JOIN Aktie a ON t.ISIN = a.ISIN
+                JOIN Aktie a ON p.ISIN = a.ISIN
                 JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
-                WHERE d.Status = 'Aktiv'
+                WHERE d.Status = 'Aktiv' {filters}
                 GROUP BY i.InvestorID, u.Branche
                 HAVING BranchenWert > 0
             ),
@@ -99,14 +377,21 @@ PREDEFINED_QUERIES = {
                 ROUND(p.BranchenWert / g.GesamtWert * 100, 1) AS ProzentAnteil
             FROM PortfolioPerBranche p
             JOIN GesamtPortfolio g ON p.InvestorID = g.InvestorID
-            WHERE p.BranchenWert / g.GesamtWert > 0.5
+            WHERE p.BranchenWert / g.GesamtWert > :schwelle
             ORDER BY ProzentAnteil DESC
-        """
+        """,
+        "params": {
+            "investor": investor_filter('d.InvestorID'),
+            "schwelle": Param('float', 'Mindestanteil einer Branche am Portfolio (0-1)', default=0.5,
+                              minimum=0, maximum=1),
+        },
+        "shards": {"merge": "SELECT * FROM Teilergebnis ORDER BY ProzentAnteil DESC"}
     },
     
     "top_performers": {
         "name": "Top-Performer: Aktien mit höchstem Kursgewinn im Beobachtungszeitraum",
         "description": "Analysiert welche Aktien die beste Performance gezeigt haben - nützlich für die Identifikation erfolgreicher Investments.",
+        "order": ('-PerformanceInProzent',),
         "query": """
             SELECT 
                 u.Name AS Unternehmen,
@@ -121,15 +406,26 @@ PREDEFINED_QUERIES = {
             FROM Aktie a
             JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
             JOIN Kursverlauf k ON a.ISIN = k.ISIN
+            {where}
             GROUP BY a.ISIN
             ORDER BY PerformanceInProzent DESC
-            LIMIT 10
-        """
+            LIMIT :top
+        """,
+        "params": {
+            "isin": isin_filter('k.ISIN', 'where'),
+            **date_range('k.Datum', clause='where'),
+            "top": Param('int', 'Anzahl Aktien', default=10, minimum=1, maximum=1000),
+        },
+        "compute": price_store.top_performers,
+        # Parameters the vectorized version supports (else the SQL runs)
+        "compute_args": {"top": "limit"}
     },
     
     "inactive_depots": {
         "name": "Inaktive Depots: Keine Aktivität in den letzten 60 Tagen",
         "description": "Findet Depots ohne kürzliche Transaktionen - wichtig für Kundenreaktivierung und Beziehungsmanagement.",
+        # TageOhneAktivitaet drifts with the clock; pages are keyed on the date
+        "order": ('LetzteTransaktion', '~TageOhneAktivitaet'),
         "query": """
             SELECT 
                 i.Vorname || ' ' || i.Nachname AS Investor,
@@ -144,16 +440,22 @@ PREDEFINED_QUERIES = {
             JOIN Investor i ON d.InvestorID = i.InvestorID
             LEFT JOIN Transaktionen t ON d.DepotID = t.DepotID
             LEFT JOIN Telefonnummer tel ON i.InvestorID = tel.InvestorID
-            WHERE d.Status = 'Aktiv'
+            WHERE d.Status = 'Aktiv' {filters}
             GROUP BY d.DepotID
-            HAVING TageOhneAktivitaet > 60 OR LetzteTransaktion IS NULL
-            ORDER BY TageOhneAktivitaet DESC
-        """
+            HAVING TageOhneAktivitaet > :tage OR LetzteTransaktion IS NULL
+            ORDER BY LetzteTransaktion
+        """,
+        "params": {
+            "investor": investor_filter('d.InvestorID'),
+            "tage": Param('int', 'Mindestanzahl Tage ohne Transaktion', default=60, minimum=0),
+        },
+        "shards": {"merge": "SELECT * FROM Teilergebnis ORDER BY LetzteTransaktion"}
     },
     
     "volatility_alert": {
         "name": "Volatilitäts-Warnung: Aktien mit hohen Tagesschwankungen",
         "description": "Identifiziert Aktien mit überdurchschnittlicher Volatilität - wichtig für Risikowarnungen an Investoren.",
+        "order": ('-Tagesvolatilitaet',),
         "query": """
             SELECT 
                 u.Name AS Unternehmen,
@@ -168,15 +470,25 @@ PREDEFINED_QUERIES = {
             FROM Kursverlauf k
             JOIN Aktie a ON k.ISIN = a.ISIN
             JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
-            WHERE (k.Hoechstkurs - k.Tiefstkurs) / k.Oeffnungskurs > 0.05
+            WHERE (k.Hoechstkurs - k.Tiefstkurs) / k.Oeffnungskurs > :schwelle {filters}
             ORDER BY Tagesvolatilitaet DESC
-            LIMIT 15
-        """
+            LIMIT :top
+        """,
+        "params": {
+            "isin": isin_filter('k.ISIN'),
+            **date_range('k.Datum'),
+            "schwelle": Param('float', 'Mindestschwankung (Hoch - Tief) / Eröffnung', default=0.05,
+                              minimum=0),
+            "top": Param('int', 'Anzahl Tage', default=15, minimum=1, maximum=1000),
+        },
+        "compute": price_store.volatility_alert,
+        "compute_args": {"schwelle": "threshold", "top": "limit"}
     },
     
     "trading_activity": {
         "name": "Handelsaktivität: Transaktionsvolumen pro Monat und Investor",
         "description": "Zeigt das monatliche Handelsvolumen",
+        "order": ('-Monat', '-Gesamtvolumen'),
         "query": """
             SELECT 
                 i.Vorname || ' ' || i.Nachname AS Investor,
@@ -189,116 +501,214 @@ PREDEFINED_QUERIES = {
             FROM Transaktionen t
             JOIN Depot d ON t.DepotID = d.DepotID
             JOIN Investor i ON d.InvestorID = i.InvestorID
+            {where}
             GROUP BY i.InvestorID, strftime('%Y-%m', t.Datum)
             ORDER BY Monat DESC, Gesamtvolumen DESC
-        """
+        """,
+        "params": {
+            "investor": investor_filter('d.InvestorID', 'where'),
+            "depot": depot_filter('t.DepotID', 'where'),
+            "isin": isin_filter('t.ISIN', 'where'),
+            **date_range('t.Datum', timestamp=True, clause='where'),
+        },
+        "shards": {"merge": "SELECT * FROM Teilergebnis ORDER BY Monat DESC, Gesamtvolumen DESC"}
     },
     
     "dividend_portfolio": {
         "name": "Dividenden-Aktien: Beliebte Aktien bei langfristigen Investoren",
         "description": "Zeigt welche Aktien häufig von Investoren mit Dividenden-/Altersvorsorge-Depots gehalten werden.",
+        "order": ('-AnzahlDepots', '-GesamtInvestiert'),
         "query": """
             SELECT 
                 u.Name AS Unternehmen,
                 a.Ticker,
                 u.Branche,
                 COUNT(DISTINCT d.DepotID) AS AnzahlDepots,
-                SUM(CASE WHEN t.Typ = 'Kauf' THEN t.Menge ELSE -t.Menge END) AS GesamteAktien,
-                ROUND(SUM(CASE WHEN t.Typ = 'Kauf' THEN t.Menge ELSE -t.Menge END) * a.AktuellerKurs, 2) AS GesamtInvestiert,
+                SUM(p.Menge) AS GesamteAktien,
+                ROUND(SUM(p.Menge) * a.AktuellerKurs, 2) AS GesamtInvestiert,
                 GROUP_CONCAT(DISTINCT d.Bezeichnung) AS DepotTypen
-            FROM Transaktionen t
-            JOIN Depot d ON t.DepotID = d.DepotID
-            JOIN Aktie a ON t.ISIN = a.ISIN
+            FROM Position p
+            JOIN Depot d ON p.DepotID = d.DepotID
+            JOIN Aktie a ON p.ISIN = a.ISIN
             JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
-            WHERE d.Bezeichnung LIKE '%Dividenden%' 
-               OR d.Bezeichnung LIKE '%Altersvorsorge%'
-               OR d.Bezeichnung LIKE '%Konservativ%'
-               OR d.Bezeichnung LIKE '%Familienvorsorge%'
+            {where}
             GROUP BY a.ISIN
             HAVING GesamteAktien > 0
             ORDER BY AnzahlDepots DESC, GesamtInvestiert DESC
-        """
+        """,
+        "params": {
+            "stichworte": Param('list', 'Depots, deren Bezeichnung eines der Stichworte enthält',
+                                default=('Dividenden', 'Altersvorsorge', 'Konservativ', 'Familienvorsorge'),
+                                filter='d.Bezeichnung LIKE :stichworte', clause='where', pattern='%{}%'),
+            "investor": investor_filter('d.InvestorID', 'where'),
+        },
+        # Stocks are held in several shards: partial sums per ISIN, added up in the merge
+        "shards": {
+            "partial": """
+                SELECT a.ISIN, u.Name AS Unternehmen, a.Ticker, u.Branche, a.AktuellerKurs AS Kurs,
+                       COUNT(DISTINCT d.DepotID) AS Depots,
+                       SUM(p.Menge) AS Aktien,
+                       json_group_array(DISTINCT d.Bezeichnung) AS Bezeichnungen
+                FROM Position p
+                JOIN Depot d ON p.DepotID = d.DepotID
+                JOIN Aktie a ON p.ISIN = a.ISIN
+                JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
+                {where}
+                GROUP BY a.ISIN
+            """,
+            "merge": """
+                SELECT t.Unternehmen, t.Ticker, t.Branche,
+                       SUM(t.Depots) AS AnzahlDepots,
+                       SUM(t.Aktien) AS GesamteAktien,
+                       ROUND(SUM(t.Aktien) * t.Kurs, 2) AS GesamtInvestiert,
+                       (SELECT GROUP_CONCAT(DISTINCT j.value)
+                        FROM Teilergebnis s, json_each(s.Bezeichnungen) j
+                        WHERE s.ISIN = t.ISIN) AS DepotTypen
+                FROM Teilergebnis t
+                GROUP BY t.ISIN
+                HAVING SUM(t.Aktien) > 0
+                ORDER BY AnzahlDepots DESC, GesamtInvestiert DESC
+            """
+        }
     },
     
     "pnl_analysis": {
         "name": "Gewinn/Verlust-Analyse: Realisierte Gewinne durch Verkäufe",
-        "description": "Berechnet die realisierten Gewinne/Verluste aus abgeschlossenen Transaktionen",
+        "description": "Berechnet die realisierten Gewinne/Verluste aus abgeschlossenen Transaktionen (FIFO-Zuordnung der Kauf-Lots)",
+        "order": ('-RealisierterGewinn',),
+        "refresh": sync_realized_gains,
+        # Changed or new transactions are the only input of the engine
+        "refresh_tables": ('Transaktionen',),
         "query": """
             SELECT 
                 i.Vorname || ' ' || i.Nachname AS Investor,
                 d.Bezeichnung AS Depot,
                 u.Name AS Unternehmen,
-                t_sell.Datum AS Verkaufsdatum,
-                t_sell.Menge AS VerkaufteMenge,
-                t_sell.Stueckpreis AS Verkaufspreis,
-                t_sell.Gesamtwert AS Verkaufswert,
-                ROUND(AVG(t_buy.Stueckpreis), 2) AS DurchschnittlicherEinkaufspreis,
-                ROUND(t_sell.Gesamtwert - (t_sell.Menge * AVG(t_buy.Stueckpreis)), 2) AS RealisierterGewinn
-            FROM Transaktionen t_sell
-            JOIN Depot d ON t_sell.DepotID = d.DepotID
+                r.Datum AS Verkaufsdatum,
+                r.Menge AS VerkaufteMenge,
+                r.Verkaufspreis,
+                r.Verkaufswert,
+                ROUND(r.Einstandswert * 1.0 / r.GedeckteMenge, 2) AS DurchschnittlicherEinkaufspreis,
+                ROUND(r.Gewinn, 2) AS RealisierterGewinn
+            FROM RealisierterGewinn r
+            JOIN Depot d ON r.DepotID = d.DepotID
             JOIN Investor i ON d.InvestorID = i.InvestorID
-            JOIN Aktie a ON t_sell.ISIN = a.ISIN
+            JOIN Aktie a ON r.ISIN = a.ISIN
             JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
-            JOIN Transaktionen t_buy ON t_buy.DepotID = t_sell.DepotID 
-                AND t_buy.ISIN = t_sell.ISIN 
-                AND t_buy.Typ = 'Kauf'
-                AND t_buy.Datum < t_sell.Datum
-            WHERE t_sell.Typ = 'Verkauf'
-            GROUP BY t_sell.TransaktionsID
+            WHERE r.Methode = :methode AND r.GedeckteMenge > 0 {filters}
             ORDER BY RealisierterGewinn DESC
-        """
+        """,
+        "params": {
+            "methode": Param('choice', 'Zuordnung der Kauf-Lots', default='FIFO', choices=PNL_METHODS),
+            "investor": investor_filter('d.InvestorID'),
+            "depot": depot_filter('r.DepotID'),
+            "isin": isin_filter('r.ISIN'),
+            **date_range('r.Datum', timestamp=True),
+        },
+        "shards": {"merge": "SELECT * FROM Teilergebnis ORDER BY RealisierterGewinn DESC"}
     },
     
     "regional_distribution": {
         "name": "Regionale Verteilung: Investitionen nach Ländern",
         "description": "Analysiert wie die Investments geografisch verteilt sind",
+        "order": ('-GesamtwertAktuell',),
         "query": """
             SELECT 
                 u.Land,
                 COUNT(DISTINCT u.UnternehmenID) AS AnzahlUnternehmen,
-                COUNT(DISTINCT t.DepotID) AS AnzahlDepotsMitInvestments,
-                SUM(CASE WHEN t.Typ = 'Kauf' THEN t.Menge ELSE -t.Menge END) AS GesamteAktien,
-                ROUND(SUM((CASE WHEN t.Typ = 'Kauf' THEN t.Menge ELSE -t.Menge END) * a.AktuellerKurs), 2) AS GesamtwertAktuell,
+                COUNT(DISTINCT p.DepotID) AS AnzahlDepotsMitInvestments,
+                SUM(p.Menge) AS GesamteAktien,
+                ROUND(SUM(p.Menge * a.AktuellerKurs), 2) AS GesamtwertAktuell,
                 GROUP_CONCAT(DISTINCT u.Branche) AS Branchen
-            FROM Transaktionen t
-            JOIN Aktie a ON t.ISIN = a.ISIN
+            FROM Position p
+            JOIN Aktie a ON p.ISIN = a.ISIN
             JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
+            {where}
             GROUP BY u.Land
             HAVING GesamteAktien > 0
             ORDER BY GesamtwertAktuell DESC
-        """
+        """,
+        "params": {
+            "investor": Param('int', 'Nur Depots dieses Investors (InvestorID)', minimum=1, clause='where',
+                              filter='p.DepotID IN (SELECT DepotID FROM Depot WHERE InvestorID = :investor)'),
+            "depot": depot_filter('p.DepotID', 'where'),
+        },
+        # Depots are disjoint across shards, companies are not: their IDs are
+        # collected per shard and counted once in the merge
+        "shards": {
+            "partial": """
+                SELECT u.Land,
+                       json_group_array(DISTINCT u.UnternehmenID) AS Unternehmen,
+                       COUNT(DISTINCT p.DepotID) AS Depots,
+                       SUM(p.Menge) AS Aktien,
+                       SUM(p.Menge * a.AktuellerKurs) AS Wert,
+                       json_group_array(DISTINCT u.Branche) AS Branchen
+                FROM Position p
+                JOIN Aktie a ON p.ISIN = a.ISIN
+                JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
+                {where}
+                GROUP BY u.Land
+            """,
+            "merge": """
+                SELECT t.Land,
+                       (SELECT COUNT(DISTINCT j.value)
+                        FROM Teilergebnis s, json_each(s.Unternehmen) j
+                        WHERE s.Land = t.Land) AS AnzahlUnternehmen,
+                       SUM(t.Depots) AS AnzahlDepotsMitInvestments,
+                       SUM(t.Aktien) AS GesamteAktien,
+                       ROUND(SUM(t.Wert), 2) AS GesamtwertAktuell,
+                       (SELECT GROUP_CONCAT(DISTINCT j.value)
+                        FROM Teilergebnis s, json_each(s.Branchen) j
+                        WHERE s.Land = t.Land) AS Branchen
+                FROM Teilergebnis t
+                GROUP BY t.Land
+                HAVING SUM(t.Aktien) > 0
+                ORDER BY GesamtwertAktuell DESC
+            """
+        }
     },
     
     "depot_performance": {
         "name": "Depot-Performance: Wertentwicklung über Zeit",
         "description": "Zeigt die historische Wertentwicklung der Depots",
+        "order": ('-AbsolutePerformance',),
         "query": """
             SELECT 
                 i.Vorname || ' ' || i.Nachname AS Investor,
                 d.Bezeichnung AS Depot,
                 d.Status,
-                MIN(h.Datum) AS ErsterEintrag,
-                MAX(h.Datum) AS LetzterEintrag,
-                (SELECT Gesamtwert FROM HistorischerDepotwert WHERE DepotID = d.DepotID ORDER BY Datum ASC LIMIT 1) AS StartWert,
-                (SELECT Gesamtwert FROM HistorischerDepotwert WHERE DepotID = d.DepotID ORDER BY Datum DESC LIMIT 1) AS EndWert,
-                ROUND(((SELECT Gesamtwert FROM HistorischerDepotwert WHERE DepotID = d.DepotID ORDER BY Datum DESC LIMIT 1) - 
-                       (SELECT Gesamtwert FROM HistorischerDepotwert WHERE DepotID = d.DepotID ORDER BY Datum ASC LIMIT 1)), 2) AS AbsolutePerformance,
-                ROUND(SUM(h.DailyPnL), 2) AS GesamtPnL,
-                COUNT(h.Datum) AS AnzahlBewertungen
-            FROM HistorischerDepotwert h
-            JOIN Depot d ON h.DepotID = d.DepotID
+                s.ErsterTag AS ErsterEintrag,
+                s.LetzterTag AS LetzterEintrag,
+                s.ErsterWert AS StartWert,
+                s.LetzterWert AS EndWert,
+                ROUND(s.LetzterWert - s.ErsterWert, 2) AS AbsolutePerformance,
+                ROUND(s.SummePnL, 2) AS GesamtPnL,
+                s.AnzahlBewertungen
+            FROM DepotwertUebersicht s
+            JOIN Depot d ON s.DepotID = d.DepotID
             JOIN Investor i ON d.InvestorID = i.InvestorID
-            GROUP BY d.DepotID
+            {where}
             ORDER BY AbsolutePerformance DESC
-        """
+        """,
+        "params": {
+            "investor": investor_filter('d.InvestorID', 'where'),
+            "depot": depot_filter('s.DepotID', 'where'),
+        },
+        "shards": {"merge": "SELECT * FROM Teilergebnis ORDER BY AbsolutePerformance DESC"},
+        # First/last valuation and PnL totals per depot are kept up to date
+        # by triggers; rebuilt only after out-of-order changes
+        "refresh": refresh_depot_summary,
+        "refresh_tables": ('HistorischerDepotwert',),
     },
     
     "investor_contacts": {
         "name": "Investoren-Kontaktdaten: Vollständige Übersicht",
         "description": "Zeigt alle Kontaktinformationen der Investoren mit ihren Depots",
+        "order": ('Nachname', 'Name'),
         "query": """
             SELECT 
                 i.Vorname || ' ' || i.Nachname AS Name,
+                i.Nachname,
                 i.EMail,
                 i.Strasse || ', ' || i.PLZ || ' ' || i.Ort AS Adresse,
                 GROUP_CONCAT(tel.Typ || ': ' || tel.Nummer, ' | ') AS Telefonnummern,
@@ -307,14 +717,20 @@ PREDEFINED_QUERIES = {
             FROM Investor i
             LEFT JOIN Telefonnummer tel ON i.InvestorID = tel.InvestorID
             LEFT JOIN Depot d ON i.InvestorID = d.InvestorID
+            {where}
             GROUP BY i.InvestorID
             ORDER BY i.Nachname, i.Vorname
-        """
+        """,
+        "params": {
+            "investor": investor_filter('i.InvestorID', 'where'),
+        },
+        "shards": {"merge": "SELECT * FROM Teilergebnis ORDER BY Nachname, Name"}
     },
     
     "stock_popularity": {
         "name": "Aktien-Beliebtheit: Meistgehandelte Titel",
         "description": "Zeigt welche Aktien am häufigsten gehandelt werden",
+        "order": ('-AnzahlTransaktionen', '-GesamtHandelsvolumen'),
         "query": """
             SELECT 
                 u.Name AS Unternehmen,
@@ -328,10 +744,43 @@ PREDEFINED_QUERIES = {
                 a.AktuellerKurs AS AktuellerKurs
             FROM Aktie a
             JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
-            LEFT JOIN Transaktionen t ON a.ISIN = t.ISIN
+            LEFT JOIN Transaktionen t ON a.ISIN = t.ISIN {join}
+            {where}
             GROUP BY a.ISIN
             ORDER BY AnzahlTransaktionen DESC, GesamtHandelsvolumen DESC
-        """
+        """,
+        "params": {
+            "isin": isin_filter('a.ISIN', 'where'),
+            # Transaction filters go into the join, so stocks without trades still show up
+            "depot": depot_filter('t.DepotID', 'join'),
+            **date_range('t.Datum', timestamp=True, clause='join'),
+        },
+        "shards": {
+            "partial": """
+                SELECT a.ISIN, u.Name AS Unternehmen, a.Ticker, a.Waehrung, u.Branche,
+                       a.AktuellerKurs AS Kurs,
+                       COUNT(t.TransaktionsID) AS Anzahl,
+                       SUM(t.Menge) AS Menge,
+                       SUM(t.Gesamtwert) AS Volumen,
+                       COUNT(DISTINCT t.DepotID) AS Depots
+                FROM Aktie a
+                JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
+                LEFT JOIN Transaktionen t ON a.ISIN = t.ISIN {join}
+                {where}
+                GROUP BY a.ISIN
+            """,
+            "merge": """
+                SELECT Unternehmen, Ticker, Waehrung, Branche,
+                       SUM(Anzahl) AS AnzahlTransaktionen,
+                       SUM(Menge) AS GesamtGehandelteMenge,
+                       ROUND(SUM(Volumen), 2) AS GesamtHandelsvolumen,
+                       SUM(Depots) AS AnzahlVerschiedeneDepots,
+                       Kurs AS AktuellerKurs
+                FROM Teilergebnis
+                GROUP BY ISIN
+                ORDER BY AnzahlTransaktionen DESC, GesamtHandelsvolumen DESC
+            """
+        }
     }
 }
 
@@ -339,167 +788,1311 @@ PREDEFINED_QUERIES = {
 @app.route('/')
 def index():
     """Main page with query selection."""
-    return render_template('index.html', queries=PREDEFINED_QUERIES)
+    # The SQL text ships with the page instead of with every result
+    query_sql = {query_id: default_statement(info)[0].strip()
+                 for query_id, info in PREDEFINED_QUERIES.items()}
+    return render_template('index.html', queries=PREDEFINED_QUERIES, query_sql=query_sql)
+
+
+@app.route('/queries')
+def list_queries():
+    """The predefined queries with their parameters (types, defaults, limits)."""
+    return jsonify({
+        query_id: {
+            'name': info['name'],
+            'description': info['description'],
+            'params': {name: param.describe() for name, param in info.get('params', {}).items()},
+        }
+        for query_id, info in PREDEFINED_QUERIES.items()
+    })
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profiler = None
+    if REQUEST_PROFILING and request.args.get('profile') == '1':
+        g.profiler = PROFILER.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Record endpoint latency; with ?profile=1 replace the body by the profile report."""
+    started = g.get('request_started')
+    if started is not None:
+        METRICS.record_request(request.endpoint, request.method, response.status_code,
+                               time.perf_counter() - started)
+    profiler = g.get('profiler')
+    if profiler is not None:
+        g.profiler = None
+        response = app.response_class(PROFILER.stop(profiler), mimetype='text/plain')
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compress JSON/text bodies for clients that accept gzip or brotli."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in response_encoding.COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = response_encoding.negotiate(request.accept_encodings)
+    if encoding:
+        response.set_data(response_encoding.compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.teardown_request
+def stop_profiler(exc):
+    # after_request is skipped for unhandled exceptions; never leave the profiler running
+    profiler = g.get('profiler')
+    if profiler is not None:
+        PROFILER.stop(profiler)
+
+
+def pagination_args(source, keyset=False):
+    """Read limit/after/stream options from query args or a JSON body.
+
+    after is a keyset cursor for predefined queries (keyset=True; None
+    without a token) and an offset for custom queries and job results (0
+    without a token). Returns (limit, after, stream); raises ValueError
+    for invalid values.
+    """
+    limit = source.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError('limit muss eine Zahl sein')
+        if not 1 <= limit <= MAX_RESULT_ROWS:
+            raise ValueError(f'limit muss zwischen 1 und {MAX_RESULT_ROWS} liegen')
+    after = decode_cursor(source.get('after'))
+    if after is not None and limit is None:
+        raise ValueError('after kann nur zusammen mit limit verwendet werden')
+    if after is not None and isinstance(after, int) == keyset:
+        raise ValueError('Ungültiges Pagination-Token')
+    if after is None and not keyset:
+        after = 0
+    stream = source.get('stream')
+    if stream not in (None, 'json', 'ndjson'):
+        raise ValueError('stream muss "json" oder "ndjson" sein')
+    return limit, after, stream
+
+
+def result_format(source):
+    """Read the result layout (?format=columns|records) from query args or a JSON body."""
+    fmt = (source or {}).get('format') or 'columns'
+    if fmt not in response_encoding.FORMATS:
+        raise ValueError('format muss "columns" oder "records" sein')
+    return fmt
+
+
+def page_payload(columns, rows, after, limit, has_more, order=None):
+    """Build the common result fields for a (possibly paginated) result.
+
+    Rows are arrays in the order of `columns`; see response_encoding.as_format.
+    With an order (predefined queries) after is a keyset cursor and
+    next_after encodes the key of the last row, otherwise it is an offset.
+    """
+    payload = {
+        'columns': columns,
+        'rows': [tuple(row) for row in rows],
+        'row_count': len(rows),
+    }
+    if limit is not None and order is not None:
+        payload['limit'] = limit
+        payload['next_after'] = (encode_cursor(keyset_cursor(columns, rows, sort_keys(order, columns), after))
+                                 if has_more else None)
+    elif limit is not None:
+        payload['offset'] = after
+        payload['limit'] = limit
+        payload['next_after'] = encode_cursor(after + len(rows)) if has_more else None
+    else:
+        payload['truncated'] = has_more
+    return payload
+
+
+def query_arguments(query_id, source):
+    """Validated parameters of a predefined query from query args or a JSON body.
+
+    Raises ValueError for invalid values; see query_params.bind.
+    """
+    return query_params.bind(PREDEFINED_QUERIES[query_id].get('params', {}), source)
+
+
+def query_statement(query_info, values):
+    """(sql, named parameters) of a predefined query for validated parameter values."""
+    return query_params.render(query_info['query'], query_info.get('params', {}), values)
+
+
+def default_statement(query_info):
+    """(sql, named parameters) of a predefined query with all parameters at their defaults."""
+    return query_statement(query_info, query_params.bind(query_info.get('params', {}), {}))
+
+
+def json_response(payload, fmt='columns', status=200):
+    """JSON response for a result payload in the requested layout (compressed by compress_response)."""
+    body = response_encoding.dumps(response_encoding.as_format(payload, fmt))
+    return app.response_class(body, status=status, mimetype='application/json')
+
+
+def stream_response(sql, stream, header=None, timeout=None, fmt='columns', params=(), on_close=None):
+    """Stream a query result as NDJSON or as a chunked JSON document.
+
+    With a timeout the statement is interrupted once it has spent that
+    long inside SQLite; time the client needs to read the body does not
+    count. The connection is closed and on_close is called (e.g. to free
+    a slot) as soon as the last row is read, not only when the response
+    is finished. The body is compressed on the fly if the client accepts
+    gzip or brotli.
+    """
+    try:
+        conn = get_read_connection()
+    except Exception:
+        if on_close is not None:
+            on_close()
+        raise
+    released = []
+    
+    def release():
+        if released:
+            return
+        released.append(True)
+        conn.set_progress_handler(None, 0)
+        conn.close()
+        if on_close is not None:
+            on_close()
+    
+    fetch = None
+    if timeout is not None:
+        remaining = [timeout]
+        
+        def budgeted(step):
+            started = time.monotonic()
+            conn.set_progress_handler(deadline_handler(started + remaining[0]), PROGRESS_STEPS)
+            try:
+                return step()
+            finally:
+                conn.set_progress_handler(None, 0)
+                remaining[0] -= time.monotonic() - started
+        
+        def fetch(cursor, size):
+            return budgeted(lambda: cursor.fetchmany(size))
+    
+    try:
+        if fetch is not None:
+            cursor = budgeted(lambda: conn.execute(sql, params))
+        else:
+            cursor = conn.execute(sql, params)
+    except Exception:
+        release()
+        raise
+    if stream == 'ndjson':
+        body = stream_ndjson(cursor, MAX_STREAM_ROWS, MAX_STREAM_BYTES, fetch=fetch, done=release)
+        mimetype = 'application/x-ndjson'
+    else:
+        body = stream_json(cursor, header, MAX_STREAM_ROWS, MAX_STREAM_BYTES, fmt, fetch=fetch, done=release)
+        mimetype = 'application/json'
+    response = streaming_response(body, mimetype)
+    response.call_on_close(release)
+    return response
+
+
+def streaming_response(body, mimetype):
+    """Response for a generator body, compressed on the fly if the client accepts it."""
+    encoding = response_encoding.negotiate(request.accept_encodings)
+    if encoding:
+        body = response_encoding.compress_stream(body, encoding)
+    response = app.response_class(body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 @app.route('/execute_query/<query_id>')
 def execute_query(query_id):
-    """Execute a predefined query and return results."""
+    """Execute a predefined query and return results.
+
+    Results are cached until one of the tables the query reads changes.
+    Responses carry ETag/Last-Modified, so polling clients get a 304.
+    Supports ?limit=&after= pagination (keyset: after is the next_after
+    token of the previous page, ordered by the query's "order"),
+    ?stream=json|ndjson,
+    ?format=columns|records (rows as arrays, the default, or as objects)
+    and the query's own parameters (e.g. ?investor=3&von=2024-01-01, see /queries).
+    """
     if query_id not in PREDEFINED_QUERIES:
         return jsonify({'error': 'Query not found'}), 404
     
     query_info = PREDEFINED_QUERIES[query_id]
     
     try:
-        conn = get_db_connection()
-        cursor = conn.execute(query_info['query'])
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
-        conn.close()
+        limit, after, stream = pagination_args(request.args, keyset=True)
+        fmt = result_format(request.args)
+        values = query_arguments(query_id, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        refresh_query_data(query_info)
+        
+        if stream:
+            sql, params = query_statement(query_info, values)
+            return stream_response(sql, stream, {
+                'name': query_info['name'],
+                'description': query_info['description'],
+            }, fmt=fmt, params=params)
         
-        # Convert to list of dicts
-        results = [dict(zip(columns, row)) for row in rows]
+        entry, cache_status, timer = predefined_entry(query_id, values, after, limit, refresh=False)
         
-        return jsonify({
-            'name': query_info['name'],
-            'description': query_info['description'],
-            'query': query_info['query'].strip(),
-            'columns': columns,
-            'results': results,
-            'row_count': len(results)
-        })
+        response = cached_response(entry, cache_status, fmt)
+        if timer is not None:
+            timer.mark('serialize')
+            METRICS.record_query(timer)
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/custom_query', methods=['POST'])
-def custom_query():
-    """Execute a custom SQL query (SELECT only for safety)."""
-    data = request.get_json()
-    query = data.get('query', '').strip()
+def predefined_entry(query_id, values=None, after=None, limit=None, refresh=True):
+    """Return (cache entry, 'HIT'/'MISS', timer) for a page of a predefined query.
+
+    values are the validated query parameters (defaults if None); every
+    parameter combination (and page: keyset cursor and limit) is cached
+    separately.
+
+    On a miss the query runs on a read-only connection and the timer holds
+    its execute/fetch times; the caller books the serialize phase and
+    records it. On a hit the timer is None.
+    """
+    query_info = PREDEFINED_QUERIES[query_id]
+    if values is None:
+        values = query_arguments(query_id, {})
+    if refresh:
+        refresh_query_data(query_info)
+    arguments = query_params.cache_key(values)
+    cache_key = (query_id, arguments) if limit is None else (query_id, arguments, after, limit)
+    timer = None
+    with (get_read_connection() if SHARDS is None else SHARDS.connect(0)) as conn:
+        versions = table_versions(conn) if SHARDS is None else SHARDS.table_versions()
+        RESULT_CACHE.sync(versions)
+        entry = RESULT_CACHE.get(cache_key, versions)
+        cache_status = 'HIT'
+        if entry is None:
+            cache_status = 'MISS'
+            sql, params = query_statement(query_info, values)
+            # Filters can pull in further tables (e.g. Depot for ?investor=)
+            tables = RESULT_CACHE.dependencies((query_id, sql), conn, sql, params)
+            timer = QueryTimer('predefined', query_id, sql, params)
+            timer.attach(conn)
+            try:
+                columns, rows, has_more = run_predefined_query(
+                    conn, query_info, values, after=after, limit=limit, timer=timer)
+            except Exception as e:
+                timer.error = str(e)
+                METRICS.record_query(timer)
+                raise
+            finally:
+                timer.detach(conn)
+            
+            payload = {
+                'name': query_info['name'],
+                'description': query_info['description'],
+                'params': dict(values),
+            }
+            payload.update(page_payload(columns, rows, after, limit, has_more, query_info['order']))
+            entry = RESULT_CACHE.put(cache_key, payload, tables, versions)
+    return entry, cache_status, timer
+
+
+def run_predefined_query(conn, query_info, values, after=None, limit=None, timer=None):
+    """Run a predefined query, using its vectorized implementation when available.
+
+    The vectorized version is only used if it supports every parameter that
+    is set (see "compute_args"); filters always run as SQL.
+    Returns (columns, rows, has_more) like fetch_page.
+    """
+    if SHARDS is not None:
+        return run_sharded_query(conn, query_info, values, after, limit, timer)
+    compute = query_info.get('compute')
+    compute_args = query_info.get('compute_args', {})
+    spec = query_info.get('params', {})
+    supported = all(name in compute_args or values[name] == spec[name].default for name in values)
+    if compute is None or PRICE_STORE is None or not supported:
+        sql, params = query_statement(query_info, values)
+        return fetch_query_page(conn, sql, params, query_info, after, limit, timer)
+    columns, rows = compute(PRICE_STORE, conn,
+                            **{argument: values[name] for name, argument in compute_args.items()})
+    return page_of(columns, rows, query_info, after, limit, timer)
+
+
+def fetch_query_page(conn, sql, params, query_info, after, limit, timer=None):
+    """Fetch a predefined query: the whole result (capped) or one keyset page."""
+    if limit is None:
+        return fetch_page(conn, sql, params, max_rows=MAX_RESULT_ROWS, timer=timer)
+    return fetch_keyset_page(conn, sql, params, query_info['order'], after, limit, timer)
+
+
+def page_of(columns, rows, query_info, after, limit, timer=None):
+    """Cut one page out of a fully computed result; returns (columns, rows, has_more)."""
+    if limit is None:
+        page, has_more = rows[:MAX_RESULT_ROWS], len(rows) > MAX_RESULT_ROWS
+    else:
+        columns, page, has_more = keyset_page(columns, rows, query_info['order'], after, limit)
+    if timer is not None:
+        timer.mark('execute')
+        timer.rows = len(page)
+    return columns, page, has_more
+
+
+def run_sharded_query(conn, query_info, values, after=None, limit=None, timer=None):
+    """Run a predefined query on the shards; conn is a connection to shard 0.
+
+    Queries for one investor or depot run on that investor's shard, queries
+    over reference data only on shard 0. Everything else is scattered to
+    all shards ("partial" SQL, or the query itself) and the partial results
+    are combined with the query's "merge" SQL.
+    """
+    sql, params = query_statement(query_info, values)
+    investor, depot = values.get('investor'), values.get('depot')
+    if investor is not None or depot is not None:
+        index = SHARDS.route(investor, depot)
+        # An unknown depot has no rows anywhere; shard 0 returns the empty result
+        with SHARDS.connect(index or 0) as shard:
+            return fetch_query_page(shard, sql, params, query_info, after, limit, timer)
+    if RESULT_CACHE.dependencies(sql, conn, sql, params) <= set(sharding.REFERENCE_TABLES):
+        return fetch_query_page(conn, sql, params, query_info, after, limit, timer)
+    spec = query_info['shards']
+    if 'partial' in spec:
+        sql, params = query_params.render(spec['partial'], query_info.get('params', {}), values)
+    columns, parts = SHARDS.scatter(sql, params)
+    columns, rows = sharding.merge_partials(columns, parts, spec['merge'])
+    return page_of(columns, rows, query_info, after, limit, timer)
+
+
+def warm_up(execute=True):
+    """Check every predefined query and preload the database before the first requests.
+
+    Each query is compiled with its default parameters, so broken SQL is
+    reported at startup instead of on its first call, and the database
+    files are read into the OS page cache. With execute=True every query
+    also runs once, which fills the result cache (and the serialized
+    body) for the parameterless dashboard requests.
+    Returns the warm-up report, with an error message per failed query.
+    """
+    started = time.perf_counter()
+    paths = [DATABASE_PATH] if SHARDS is None else [SHARDS.reference] + SHARDS.paths
+    preloaded = sum(startup.prefetch(path, WARMUP_PRELOAD_BYTES) for path in paths)
+    
+    errors = {}
+    with (get_read_connection() if SHARDS is None else SHARDS.connect(0)) as conn:
+        for query_id, query_info in PREDEFINED_QUERIES.items():
+            sql, params = default_statement(query_info)
+            try:
+                startup.prepare(conn, sql, params)
+            except sqlite3.Error as e:
+                errors[query_id] = str(e)
     
+    executed = 0
+    if execute:
+        for query_id in PREDEFINED_QUERIES:
+            if query_id in errors:
+                continue
+            try:
+                entry, _, timer = predefined_entry(query_id)
+                encoded_body(entry)
+            except Exception as e:
+                errors[query_id] = str(e)
+                continue
+            if timer is not None:
+                timer.mark('serialize')
+                METRICS.record_query(timer)
+            executed += 1
+    
+    report = {
+        'warmup_ms': round((time.perf_counter() - started) * 1000, 2),
+        'preloaded_bytes': preloaded,
+        'prepared': len(PREDEFINED_QUERIES) - len(errors),
+        'executed': executed,
+        'errors': errors,
+    }
+    STARTUP_STATS.update(report)
+    return report
+
+
+# Versions of the "refresh_tables" at the last run of each refresh function
+_refreshed_versions = {}
+
+
+def refresh_query_data(query_info):
+    """Bring derived tables a query reads (e.g. realized gains) up to date.
+
+    The Tabellenversion counters of the query's "refresh_tables" are read
+    on a read connection first; a write connection is only taken when one
+    of them moved since the last refresh, so cache hits and 304s never
+    wait for the write lock. The versions are read before refreshing: a
+    write in between bumps them again and is picked up next time.
+    """
+    refresh = query_info.get('refresh')
+    if refresh is None:
+        return
+    tables = query_info.get('refresh_tables')
+    if tables is not None:
+        with (get_db_connection(readonly=True) if SHARDS is None else SHARDS.connect(0)) as conn:
+            versions = table_versions(conn) if SHARDS is None else SHARDS.table_versions()
+        current = tuple(versions.get(table) for table in tables)
+        if _refreshed_versions.get(refresh) == current:
+            return
+    if SHARDS is not None:
+        for index in range(SHARDS.count):
+            with SHARDS.connect(index, readonly=False) as conn:
+                refresh(conn)
+    else:
+        with get_db_connection() as conn:
+            refresh(conn)
+    if tables is not None:
+        _refreshed_versions[refresh] = current
+
+
+def encoded_body(entry, fmt=None, encoding=None):
+    """Serialized (and possibly compressed) value of a cache entry.
+
+    Kept on the entry per layout and content coding, so repeated hits
+    neither serialize nor compress again. fmt is the result layout for
+    query results, None for other payloads. Returns (body, content coding).
+    """
+    cached = entry.bodies.get((fmt, encoding))
+    if cached is None:
+        value = entry.value if fmt is None else response_encoding.as_format(entry.value, fmt)
+        body = response_encoding.dumps(value)
+        if encoding and len(body) >= COMPRESS_MIN_BYTES:
+            cached = (response_encoding.compress(body, encoding), encoding)
+        else:
+            cached = (body, None)
+        entry.bodies[(fmt, encoding)] = cached
+    return cached
+
+
+def cached_response(entry, cache_status, fmt=None):
+    """Build a JSON response for a cache entry, answering 304 if the client is up to date."""
+    encoding = response_encoding.negotiate(request.accept_encodings)
+    etag = '-'.join(part for part in (entry.etag, fmt, encoding) if part)
+    if request.if_none_match.contains(etag) or (
+            not request.if_none_match and entry.last_modified is not None
+            and request.if_modified_since is not None
+            and entry.last_modified <= request.if_modified_since):
+        response = app.response_class(status=304)
+    else:
+        body, content_encoding = encoded_body(entry, fmt, encoding)
+        response = app.response_class(body, mimetype='application/json')
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+    response.set_etag(etag)
+    if entry.last_modified is not None:
+        response.last_modified = entry.last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def custom_query_sql(data):
+    """Return the SELECT statement from a request body; raises ValueError otherwise."""
+    query = (data or {}).get('query', '').strip()
     # Safety check - only allow SELECT queries
     if not query.upper().startswith('SELECT'):
-        return jsonify({'error': 'Nur SELECT-Abfragen sind erlaubt'}), 400
+        raise ValueError('Nur SELECT-Abfragen sind erlaubt')
+    return query
+
+
+def job_error(job):
+    """Map a failed/timed out/cancelled job to an error response."""
+    status = {'timeout': 408, 'cancelled': 409}.get(job.status, 500)
+    return jsonify({'error': job.error or 'Abfrage abgebrochen', 'status': job.status}), status
+
+
+@app.route('/custom_query', methods=['POST'])
+def custom_query():
+    """Execute a custom SQL query (SELECT only for safety).
+
+    Accepts optional "limit"/"after" (pagination), "stream" and "format"
+    (columns or records) in the body.
+    The query runs on the custom query worker pool and is interrupted after
+    CUSTOM_QUERY_TIMEOUT seconds (counted from submission). Streamed
+    queries take one of the same worker slots while they run.
+    """
+    data = request.get_json()
+    try:
+        query = custom_query_sql(data)
+        limit, offset, stream = pagination_args(data)
+        fmt = result_format(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
-        conn = get_db_connection()
-        cursor = conn.execute(query)
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
-        conn.close()
-        
-        results = [dict(zip(columns, row)) for row in rows]
+        if stream:
+            release = QUERY_RUNNER.stream_slot(CUSTOM_QUERY_TIMEOUT)
+            return stream_response(query, stream, timeout=CUSTOM_QUERY_TIMEOUT, fmt=fmt,
+                                   on_close=release)
         
-        return jsonify({
-            'columns': columns,
-            'results': results,
-            'row_count': len(results)
-        })
+        job = QUERY_RUNNER.run(query, offset=offset, limit=limit)
+    except sqlite3.OperationalError as e:
+        if str(e) == 'interrupted':
+            return jsonify({'error': f'Zeitlimit von {CUSTOM_QUERY_TIMEOUT:g} s überschritten',
+                            'status': 'timeout'}), 408
+        return jsonify({'error': str(e)}), 500
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    if job.timer is not None:
+        job.timer.restart()
+    if job.status != 'done':
+        response = job_error(job)
+    else:
+        response = json_response(page_payload(job.columns, job.rows, offset, limit, job.has_more), fmt)
+    if job.timer is not None:
+        job.timer.mark('serialize')
+        job.timer.error = job.error
+        METRICS.record_query(job.timer)
+    return response
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Submit a custom query for asynchronous execution.
+
+    Body: {"query": "SELECT ...", "timeout": seconds (optional)}.
+    Returns 202 with the job id; poll /jobs/<id> and fetch /jobs/<id>/results.
+    """
+    data = request.get_json()
+    try:
+        query = custom_query_sql(data)
+        timeout = data.get('timeout', JOB_TIMEOUT)
+        try:
+            timeout = float(timeout)
+        except (TypeError, ValueError):
+            raise ValueError('timeout muss eine Zahl sein')
+        if not 0 < timeout <= JOB_TIMEOUT:
+            raise ValueError(f'timeout muss zwischen 0 und {JOB_TIMEOUT:g} Sekunden liegen')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        job = QUERY_RUNNER.submit(query, timeout=timeout, max_rows=JOB_MAX_ROWS)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    response = jsonify(job.info())
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job.id}'
+    return response
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Return the status of an asynchronous query."""
+    job = QUERY_RUNNER.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job nicht gefunden'}), 404
+    return jsonify(job.info())
+
+
+@app.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    """Return the result of a finished job (supports ?limit=&after= pagination and ?format=)."""
+    job = QUERY_RUNNER.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job nicht gefunden'}), 404
+    if not job.done:
+        return jsonify({'error': 'Job ist noch nicht abgeschlossen', 'status': job.status}), 409
+    if job.status != 'done':
+        return job_error(job)
+    try:
+        limit, offset, _ = pagination_args(request.args)
+        fmt = result_format(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rows = job.rows if limit is None else job.rows[offset:offset + limit]
+    has_more = job.has_more if limit is None else offset + limit < len(job.rows)
+    payload = page_payload(job.columns, rows, offset, limit, has_more)
+    payload['job_id'] = job.id
+    if limit is not None:
+        payload['truncated'] = job.has_more
+    return json_response(payload, fmt)
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job."""
+    job = QUERY_RUNNER.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job nicht gefunden'}), 404
+    return jsonify(job.info())
+
+
+def price_series(isin, compute):
+    """Run an analytics function on the columnar store for one ISIN."""
+    if PRICE_STORE is None:
+        return None, (jsonify({'error': 'Kursverlauf-Store nicht verfügbar (NumPy nicht installiert)'}), 503)
+    with get_db_connection(readonly=True) as conn:
+        PRICE_STORE.sync(conn)
+    result = compute()
+    if result is None:
+        return None, (jsonify({'error': 'Keine Kursdaten für diese ISIN'}), 404)
+    return result, None
+
+
+@app.route('/analytics/<isin>/returns')
+def analytics_returns(isin):
+    """Daily close-to-close returns of a stock."""
+    result, error = price_series(isin, lambda: price_store.daily_returns(PRICE_STORE, isin))
+    if error:
+        return error
+    dates, returns = result
+    return jsonify({
+        'isin': isin,
+        'dates': [str(d) for d in dates],
+        'returns': [round(float(r), 6) for r in returns],
+        'total_return': round(float((1 + returns).prod() - 1), 6) if len(returns) else 0.0,
+    })
+
+
+@app.route('/analytics/<isin>/rolling_volatility')
+def analytics_rolling_volatility(isin):
+    """Annualized rolling volatility of daily returns (?window=20)."""
+    window = request.args.get('window', 20, type=int)
+    if window < 2:
+        return jsonify({'error': 'window muss mindestens 2 sein'}), 400
+    result, error = price_series(
+        isin, lambda: price_store.rolling_volatility(PRICE_STORE, isin, window))
+    if error:
+        return error
+    dates, volatility = result
+    return jsonify({
+        'isin': isin,
+        'window': window,
+        'dates': [str(d) for d in dates],
+        'volatility': [round(float(v), 6) for v in volatility],
+    })
+
+
+@app.route('/analytics/<isin>/drawdown')
+def analytics_drawdown(isin):
+    """Drawdown of the closing price from its running maximum."""
+    result, error = price_series(isin, lambda: price_store.drawdown(PRICE_STORE, isin))
+    if error:
+        return error
+    dates, dd, max_drawdown = result
+    return jsonify({
+        'isin': isin,
+        'dates': [str(d) for d in dates],
+        'drawdown': [round(float(v), 6) for v in dd],
+        'max_drawdown': round(max_drawdown, 6),
+    })
+
+
+@app.route('/depots/<int:depot_id>/performance')
+def depot_performance(depot_id):
+    """Performance of a depot between ?von= and ?bis= (ISO dates, both optional)."""
+    bounds = {}
+    for name in ('von', 'bis'):
+        value = request.args.get(name)
+        if value:
+            try:
+                bounds[name] = date.fromisoformat(value).isoformat()
+            except ValueError:
+                return jsonify({'error': f'{name} muss ein Datum (JJJJ-MM-TT) sein'}), 400
+    refresh_query_data(PREDEFINED_QUERIES['depot_performance'])
+    with get_db_connection(readonly=True) as conn:
+        result = snapshots.depot_performance(conn, depot_id, bounds.get('von'), bounds.get('bis'),
+                                             HISTORY_ARCHIVE_DIR)
+    if result is None:
+        return jsonify({'error': 'Keine Bewertungen für dieses Depot gefunden'}), 404
+    return jsonify(result)
 
 
 @app.route('/schema')
 def get_schema():
-    """Return the database schema information."""
-    conn = get_db_connection()
+    """Return the database schema information.
+
+    Table metadata is cached until the schema changes. Row counts are exact
+    (one combined COUNT statement, cached like query results) unless
+    ?approx=1 is given, which reads them from the ANALYZE statistics.
+    """
+    approx = request.args.get('approx', '0').lower() in ('1', 'true', 'yes')
     
-    # Get all tables
-    cursor = conn.execute("""
-        SELECT name FROM sqlite_master 
-        WHERE type='table' AND name NOT LIKE 'sqlite_%'
-        ORDER BY name
-    """)
-    tables = [row[0] for row in cursor.fetchall()]
-    
-    schema_info = {}
-    for table in tables:
-        cursor = conn.execute(f"PRAGMA table_info({table})")
-        columns = []
-        for row in cursor.fetchall():
-            columns.append({
-                'name': row[1],
-                'type': row[2],
-                'not_null': bool(row[3]),
-                'primary_key': bool(row[5])
-            })
-        
-        # Get foreign keys
-        cursor = conn.execute(f"PRAGMA foreign_key_list({table})")
-        foreign_keys = []
-        for row in cursor.fetchall():
-            foreign_keys.append({
-                'column': row[3],
-                'references_table': row[2],
-                'references_column': row[4]
-            })
-        
-        # Get row count
-        cursor = conn.execute(f"SELECT COUNT(*) FROM {table}")
-        row_count = cursor.fetchone()[0]
-        
-        schema_info[table] = {
-            'columns': columns,
-            'foreign_keys': foreign_keys,
-            'row_count': row_count
-        }
+    if approx:
+        with get_db_connection(readonly=True) as conn:
+            _, metadata = SCHEMA_CACHE.get(conn)
+            counts = approximate_row_counts(conn, list(metadata))
+        return jsonify({table: dict(info, row_count=counts[table], row_count_approx=True)
+                        for table, info in metadata.items()})
     
-    conn.close()
-    return jsonify(schema_info)
+    return cached_response(*schema_entry())
+
+
+def schema_entry():
+    """Return (cache entry, cache status) for the schema with exact row counts."""
+    with get_db_connection(readonly=True) as conn:
+        version, metadata = SCHEMA_CACHE.get(conn)
+        tables = list(metadata)
+        cache_key = ('schema', version)
+        versions = table_versions(conn)
+        RESULT_CACHE.sync(versions)
+        entry = RESULT_CACHE.get(cache_key, versions)
+        cache_status = 'HIT'
+        if entry is None:
+            cache_status = 'MISS'
+            deps = RESULT_CACHE.dependencies(cache_key, conn, row_count_sql(tables)) if tables else ()
+            counts = exact_row_counts(conn, tables)
+            schema = {table: dict(info, row_count=counts[table]) for table, info in metadata.items()}
+            entry = RESULT_CACHE.put(cache_key, schema, deps, versions)
+    return entry, cache_status
 
 
 @app.route('/statistics')
 def get_statistics():
-    """Return database statistics."""
-    conn = get_db_connection()
-    
-    stats = {}
-    
-    # Total investors
-    cursor = conn.execute("SELECT COUNT(*) FROM Investor")
-    stats['total_investors'] = cursor.fetchone()[0]
-    
-    # Total depots
-    cursor = conn.execute("SELECT COUNT(*) FROM Depot")
-    stats['total_depots'] = cursor.fetchone()[0]
-    
-    # Active depots
-    cursor = conn.execute("SELECT COUNT(*) FROM Depot WHERE Status = 'Aktiv'")
-    stats['active_depots'] = cursor.fetchone()[0]
-    
-    # Total stocks
-    cursor = conn.execute("SELECT COUNT(*) FROM Aktie")
-    stats['total_stocks'] = cursor.fetchone()[0]
+    """Return database statistics (computed in one pass and cached until the data changes)."""
+    return cached_response(*statistics_entry())
+
+
+def statistics_entry():
+    """Return (cache entry, cache status) for the dashboard counters."""
+    with get_db_connection(readonly=True) as conn:
+        versions = table_versions(conn)
+        RESULT_CACHE.sync(versions)
+        entry = RESULT_CACHE.get('statistics', versions)
+        cache_status = 'HIT'
+        if entry is None:
+            cache_status = 'MISS'
+            deps = RESULT_CACHE.dependencies('statistics', conn, STATISTICS_SQL)
+            entry = RESULT_CACHE.put('statistics', database_statistics(conn), deps, versions)
+    return entry, cache_status
+
+
+# Non-query dashboard parts that can be requested in a batch
+BATCH_SOURCES = {
+    'statistics': statistics_entry,
+    'schema': schema_entry,
+}
+
+
+def batch_items(data):
+    """Parse the "queries" list of a /batch body into [(id, after, limit, values)]."""
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries:
+        raise ValueError('queries muss eine nicht-leere Liste sein')
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise ValueError(f'Höchstens {BATCH_MAX_QUERIES} Abfragen pro Batch')
+    items = []
+    for item in queries:
+        if isinstance(item, str):
+            item = {'id': item}
+        if not isinstance(item, dict) or not isinstance(item.get('id'), str):
+            raise ValueError('Jede Abfrage braucht eine id')
+        query_id = item['id']
+        if query_id not in PREDEFINED_QUERIES and query_id not in BATCH_SOURCES:
+            raise ValueError(f'Unbekannte Abfrage: {query_id}')
+        limit, after, _ = pagination_args(item, keyset=True)
+        values = query_arguments(query_id, item) if query_id in PREDEFINED_QUERIES else None
+        items.append((query_id, after, limit, values))
+    return items
+
+
+def run_batch_item(query_id, after, limit, values, fmt):
+    """Compute one batch part on a worker thread; returns its JSON as bytes."""
+    started = time.perf_counter()
+    meta = {'id': query_id}
+    try:
+        if query_id in BATCH_SOURCES:
+            entry, cache_status = BATCH_SOURCES[query_id]()
+            body, _ = encoded_body(entry)
+        else:
+            entry, cache_status, timer = predefined_entry(query_id, values, after, limit)
+            body, _ = encoded_body(entry, fmt)
+            if timer is not None:
+                timer.mark('serialize')
+                METRICS.record_query(timer)
+    except Exception as e:
+        meta.update(status=500, error=str(e),
+                    elapsed_ms=round((time.perf_counter() - started) * 1000, 2))
+        return response_encoding.dumps(meta)
+    meta.update(status=200, cache=cache_status,
+                elapsed_ms=round((time.perf_counter() - started) * 1000, 2))
+    # The cached body is spliced in as is instead of being decoded and re-encoded
+    return response_encoding.dumps(meta)[:-1] + b',"result":' + body + b'}'
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Run several predefined queries (and statistics/schema) concurrently.
+
+    Body: {"queries": ["portfolio_overview", {"id": "trading_activity", "limit": 50, "investor": 3},
+    "statistics"],
+    "format": "columns"|"records", "stream": false}. The parts run in parallel
+    on read-only connections and share the result cache, so a dashboard
+    costs about as much as its slowest query. Without "stream" one JSON
+    document with all parts (in request order) is returned; with
+    "stream": true every part is sent as an NDJSON line as soon as it is done.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    try:
+        items = batch_items(data)
+        fmt = result_format(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Total companies
-    cursor = conn.execute("SELECT COUNT(*) FROM Unternehmen")
-    stats['total_companies'] = cursor.fetchone()[0]
+    started = time.perf_counter()
+    futures = [BATCH_EXECUTOR.submit(run_batch_item, query_id, after, limit, values, fmt)
+               for query_id, after, limit, values in items]
     
-    # Total transactions
-    cursor = conn.execute("SELECT COUNT(*) FROM Transaktionen")
-    stats['total_transactions'] = cursor.fetchone()[0]
+    if not data.get('stream'):
+        parts = [future.result() for future in futures]
+        elapsed = round((time.perf_counter() - started) * 1000, 2)
+        body = (b'{"results":[' + b','.join(parts) + b'],"elapsed_ms":'
+                + response_encoding.dumps(elapsed) + b'}')
+        return app.response_class(body, mimetype='application/json')
     
-    # Total transaction volume
-    cursor = conn.execute("SELECT ROUND(SUM(Gesamtwert), 2) FROM Transaktionen")
-    stats['total_volume'] = cursor.fetchone()[0] or 0
+    def generate():
+        for future in as_completed(futures):
+            yield future.result() + b'\n'
+        yield response_encoding.dumps(
+            {'done': True, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)}) + b'\n'
     
-    # Countries
-    cursor = conn.execute("SELECT COUNT(DISTINCT Land) FROM Unternehmen")
-    stats['countries'] = cursor.fetchone()[0]
+    return streaming_response(generate(), 'application/x-ndjson')
+
+
+@app.route('/prices/ticks', methods=['POST'])
+def price_ticks():
+    """Apply a batch of price ticks and push the revaluation to /events.
+
+    Body: {"ticks": [{"isin": "DE0007164600", "kurs": 118.4, "volumen": 300,
+    "datum": "2024-06-03"}, ...]} (or just the list; volumen and datum are
+    optional). Updates Aktie.AktuellerKurs and the day's Kursverlauf bar in
+    one transaction, then revalues only the depots holding the changed
+    ISINs through the in-memory holders index. Refused (409) with SHARD_DIR.
+    """
+    error = sharded_write_error()
+    if error:
+        return error
+    data = request.get_json(silent=True)
+    ticks = data.get('ticks') if isinstance(data, dict) else data
+    started = time.perf_counter()
+    try:
+        with _ticks_lock:
+            with get_db_connection() as conn:
+                HOLDERS_INDEX.sync(conn)
+                ticks = live_prices.parse_ticks(ticks, HOLDERS_INDEX.prices)
+                prices, version = live_prices.apply_ticks(conn, ticks, HOLDERS_INDEX)
+            depots, risks = HOLDERS_INDEX.revalue(prices, version)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    elapsed = round((time.perf_counter() - started) * 1000, 2)
     
-    # Industries
-    cursor = conn.execute("SELECT COUNT(DISTINCT Branche) FROM Unternehmen")
-    stats['industries'] = cursor.fetchone()[0]
+    if depots:
+        EVENT_HUB.publish('revaluation', live_prices.revaluation_event(depots, elapsed),
+                          {depot['InvestorID'] for depot in depots})
+    for event in risks:
+        EVENT_HUB.publish('risk', event, {event['InvestorID']})
+    return jsonify({
+        'ticks': len(ticks),
+        'isins': len(prices),
+        'depots_revalued': len(depots),
+        'risk_events': risks,
+        'elapsed_ms': elapsed,
+    })
+
+
+@app.route('/events')
+def events():
+    """Server-Sent Events for dashboards instead of polling portfolio_overview.
+
+    'revaluation' events carry the new value of every depot affected by a
+    tick batch, 'risk' events investors whose sector concentration is above
+    RISK_ALERT_THRESHOLD ('breach') or fell back below it ('cleared'). The
+    current breaches are sent on connect. ?investor= limits the stream to
+    one investor.
+    """
+    investor_id = request.args.get('investor')
+    if investor_id is not None:
+        try:
+            investor_id = int(investor_id)
+        except ValueError:
+            return jsonify({'error': 'investor muss eine Zahl sein'}), 400
+    subscriber = EVENT_HUB.subscribe(investor_id)
+    if subscriber is None:
+        return jsonify({'error': 'Zu viele verbundene Clients'}), 503
+    try:
+        with get_db_connection(readonly=True) as conn:
+            HOLDERS_INDEX.sync(conn)
+    except Exception:
+        EVENT_HUB.unsubscribe(subscriber)
+        raise
+    for event in HOLDERS_INDEX.current_breaches(investor_id):
+        EVENT_HUB.send(subscriber, 'risk', event)
     
-    conn.close()
+    response = app.response_class(
+        EVENT_HUB.stream(subscriber, response_encoding.dumps_text, SSE_HEARTBEAT),
+        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(lambda: EVENT_HUB.unsubscribe(subscriber))
+    return response
+
+
+@app.route('/pool_stats')
+def pool_stats():
+    """Return connection pool metrics (hits, waits, open connections)."""
+    stats = {name: pool.stats() for name, pool in _pools.items()}
+    stats['result_cache'] = RESULT_CACHE.stats()
+    stats['custom_queries'] = QUERY_RUNNER.stats()
+    if PRICE_STORE is not None:
+        stats['price_store'] = PRICE_STORE.stats()
+    stats['live_prices'] = HOLDERS_INDEX.stats()
+    stats['events'] = EVENT_HUB.stats()
+    stats['startup'] = STARTUP_STATS
+    if _replica is not None:
+        stats['replica'] = _replica.stats()
+    if SHARDS is not None:
+        stats['shards'] = SHARDS.stats()
+        stats['shards']['pools'] = {pool.name: pool.stats() for pool in SHARDS._pools.values()}
     return jsonify(stats)
 
 
+def ingest_format(source, content_type):
+    """Input format from ?format= or the Content-Type header."""
+    fmt = source.get('format')
+    if fmt is None:
+        fmt = 'ndjson' if content_type in ('application/x-ndjson', 'application/jsonl') else 'csv'
+    if fmt not in ingestion.PARSERS:
+        raise ValueError('format muss "csv" oder "ndjson" sein')
+    return fmt
+
+
+@app.route('/ingest/<table>', methods=['POST'])
+def ingest(table):
+    """Bulk load Transaktionen or Kursverlauf rows from a CSV or NDJSON request body.
+
+    The body is parsed as a stream. Options (query string): format=csv|ndjson,
+    strict=1 (abort on the first invalid record), defer_indexes=1 (rebuild
+    secondary indexes after the load), on_conflict=abort|ignore|replace.
+    Refused (409) with SHARD_DIR.
+    """
+    if table not in ingestion.TABLES:
+        return jsonify({'error': f'Unbekannte Tabelle: {table}'}), 404
+    error = sharded_write_error()
+    if error:
+        return error
+    flag = lambda name: request.args.get(name, '0').lower() in ('1', 'true', 'yes')
+    try:
+        fmt = ingest_format(request.args, request.mimetype)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    text = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    try:
+        with get_db_connection() as conn:
+            result = ingestion.ingest(
+                conn, table, text, fmt,
+                strict=flag('strict'), defer=flag('defer_indexes'),
+                on_conflict=request.args.get('on_conflict', 'abort'))
+    except ingestion.IngestError as e:
+        return jsonify({'error': str(e), 'errors': e.errors}), 400
+    except (ValueError, UnicodeDecodeError, csv.Error, sqlite3.IntegrityError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(result)
+
+
+@app.route('/metrics')
+def metrics():
+    """Query, endpoint, pool and cache metrics in the Prometheus text format."""
+    lines = [METRICS.prometheus().rstrip('\n')]
+    pools = {name: pool.stats() for name, pool in _pools.items()}
+    for key in ('open_connections', 'in_use', 'hits', 'misses', 'waits'):
+        lines += gauge_lines(f'aktienportfolio_pool_{key}', f'Connection pool {key}',
+                             [({'pool': name}, stats[key]) for name, stats in pools.items()])
+    cache = RESULT_CACHE.stats()
+    for key in ('entries', 'hits', 'misses', 'evictions', 'invalidations'):
+        lines += gauge_lines(f'aktienportfolio_result_cache_{key}', f'Result cache {key}',
+                             [({}, cache[key])])
+    runner = QUERY_RUNNER.stats()
+    for key in ('queued', 'running', 'completed', 'failed', 'cancelled', 'timeouts', 'rejected'):
+        lines += gauge_lines(f'aktienportfolio_custom_queries_{key}', f'Custom query jobs {key}',
+                             [({}, runner[key])])
+    hub = EVENT_HUB.stats()
+    for key in ('clients', 'published', 'dropped'):
+        lines += gauge_lines(f'aktienportfolio_events_{key}', f'Server-Sent Events {key}',
+                             [({}, hub[key])])
+    if _replica is not None:
+        replica = _replica.stats()
+        lines += gauge_lines('aktienportfolio_replica_lag_seconds',
+                             'Seconds the in-memory replica is behind the database file',
+                             [({}, replica['lag_s'])])
+        lines += gauge_lines('aktienportfolio_replica_refresh_seconds_total',
+                             'Time spent copying the database into the replica',
+                             [({}, replica['refresh_time_ms'] / 1000)])
+        for key in ('refreshes', 'hits', 'fallbacks', 'memory_bytes'):
+            lines += gauge_lines(f'aktienportfolio_replica_{key}', f'In-memory replica {key}',
+                                 [({}, replica[key])])
+    lines += gauge_lines('aktienportfolio_startup_seconds', 'Duration of the startup phases',
+                         [({'phase': phase}, STARTUP_STATS[f'{phase}_ms'] / 1000)
+                          for phase in ('init', 'warmup') if f'{phase}_ms' in STARTUP_STATS])
+    return app.response_class('\n'.join(lines) + '\n',
+                              content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/slow_queries')
+def slow_queries():
+    """Recent slow queries with their query plans, plus per-query totals."""
+    return jsonify({
+        'threshold_ms': SLOW_QUERY_MS,
+        'slow_queries': list(reversed(METRICS.slow_queries)),
+        'queries': METRICS.snapshot(),
+    })
+
+
+positions_cli = AppGroup('positions', help='Maintain the materialized Position table.')
+
+
+@positions_cli.command('rebuild')
+def positions_rebuild_command():
+    """Recompute all positions from the transaction ledger."""
+    with get_db_connection() as conn:
+        count = rebuild_positions(conn)
+    click.echo(f'{count} Positionen neu berechnet.')
+
+
+@positions_cli.command('verify')
+def positions_verify_command():
+    """Check the Position table against the transaction ledger."""
+    with get_db_connection(readonly=True) as conn:
+        mismatches = verify_positions(conn)
+    for m in mismatches:
+        click.echo(f"Depot {m['DepotID']} / {m['ISIN']}: {m['column']} "
+                   f"erwartet {m['expected']}, gefunden {m['actual']}")
+    if mismatches:
+        raise SystemExit(f'{len(mismatches)} Abweichungen gefunden.')
+    click.echo('Position-Tabelle ist konsistent.')
+
+
+app.cli.add_command(positions_cli)
+
+
+pnl_cli = AppGroup('pnl', help='Maintain the realized gains computed by the lot-matching engine.')
+
+
+@pnl_cli.command('sync')
+def pnl_sync_command():
+    """Process transactions added since the last run."""
+    with get_db_connection() as conn:
+        count = sync_realized_gains(conn)
+    click.echo(f'{count} Transaktionen verarbeitet.')
+
+
+@pnl_cli.command('rebuild')
+def pnl_rebuild_command():
+    """Recompute realized gains for all cost methods from scratch."""
+    with get_db_connection() as conn:
+        count = rebuild_realized_gains(conn)
+    click.echo(f'{count} Transaktionen verarbeitet.')
+
+
+app.cli.add_command(pnl_cli)
+
+
+indexes_cli = AppGroup('indexes', help='Query-plan based index advisor.')
+
+
+@indexes_cli.command('advise')
+def indexes_advise_command():
+    """Run EXPLAIN QUERY PLAN over all predefined queries and propose indexes."""
+    with get_db_connection(readonly=True) as conn:
+        report = index_advisor.advise(
+            conn, {qid: default_statement(q) for qid, q in PREDEFINED_QUERIES.items()})
+    for query_id, result in report.items():
+        if not result['findings']:
+            continue
+        click.echo(f'{query_id}:')
+        for finding in result['findings']:
+            click.echo(f"  [{finding['kind']}] {finding['detail']}")
+        for proposal in result['proposals']:
+            click.echo(f'  -> {proposal}')
+
+
+@indexes_cli.command('migrate')
+def indexes_migrate_command():
+    """Apply pending migrations (including the index migrations)."""
+    with get_db_connection() as conn:
+        applied = apply_migrations(conn)
+    for version, name in applied:
+        click.echo(f'Migration {version:04d} ({name}) angewendet.')
+    if not applied:
+        click.echo('Keine ausstehenden Migrationen.')
+
+
+@indexes_cli.command('benchmark')
+@click.option('--database', default=None, help='Database file to time (default: DATABASE_PATH).')
+@click.option('--repeat', default=5, show_default=True, help='Runs per query.')
+def indexes_benchmark_command(database, repeat):
+    """Report query timings without and with the migration indexes."""
+    results = index_advisor.benchmark_migrations(
+        database or DATABASE_PATH,
+        {qid: default_statement(q) for qid, q in PREDEFINED_QUERIES.items()},
+        repeat=repeat)
+    click.echo(f"{'Abfrage':<24}{'vorher ms':>12}{'nachher ms':>12}{'Faktor':>9}")
+    for query_id, (before, after) in results.items():
+        factor = before / after if after else float('inf')
+        click.echo(f'{query_id:<24}{before:>12.2f}{after:>12.2f}{factor:>8.1f}x')
+
+
+app.cli.add_command(indexes_cli)
+
+
+ingest_cli = AppGroup('ingest', help='Bulk load transactions and prices from CSV or NDJSON files.')
+
+
+@ingest_cli.command('load')
+@click.argument('table', type=click.Choice(sorted(ingestion.TABLES)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(sorted(ingestion.PARSERS)), default=None,
+              help='Input format (default: from the file extension).')
+@click.option('--strict', is_flag=True, help='Abort on the first invalid record.')
+@click.option('--defer-indexes/--no-defer-indexes', default=True, show_default=True,
+              help='Drop secondary indexes during the load and rebuild them afterwards.')
+@click.option('--on-conflict', type=click.Choice(sorted(ingestion.CONFLICT_VERBS)), default='abort',
+              show_default=True, help='What to do with rows whose primary key already exists.')
+@click.option('--batch-size', default=ingestion.BATCH_SIZE, show_default=True)
+def ingest_load_command(table, path, fmt, strict, defer_indexes, on_conflict, batch_size):
+    """Load TABLE (transaktionen or kursverlauf) from PATH ('-' for stdin)."""
+    if fmt is None:
+        fmt = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+    with click.open_file(path, 'r', encoding='utf-8-sig') as f:
+        with get_db_connection() as conn:
+            try:
+                result = ingestion.ingest(conn, table, f, fmt, strict=strict,
+                                          defer=defer_indexes, on_conflict=on_conflict,
+                                          batch_size=batch_size)
+            except ingestion.IngestError as e:
+                raise click.ClickException(str(e))
+    for error in result['errors']:
+        click.echo(f"Datensatz {error['record']}: {error['error']}")
+    click.echo(f"{result['inserted']} Zeilen in {result['table']} geladen, "
+               f"{result['skipped']} übersprungen ({result['elapsed_ms'] / 1000:.1f}s, "
+               f"{result['rows_per_second'] or 0} Zeilen/s).")
+
+
+app.cli.add_command(ingest_cli)
+
+
+snapshots_cli = AppGroup('snapshots', help='Daily depot valuations and their yearly partitions.')
+
+
+@snapshots_cli.command('take')
+@click.option('--until', help='Last day to value (YYYY-MM-DD, default: today).')
+def snapshots_take_command(until):
+    """Value all depots for every trading day since the last snapshot."""
+    with get_db_connection() as conn:
+        days = snapshots.take_snapshots(conn, until, HISTORY_ARCHIVE_DIR)
+    click.echo(f'{days} Handelstage bewertet.')
+
+
+@snapshots_cli.command('rebuild')
+def snapshots_rebuild_command():
+    """Recompute DepotwertUebersicht and the running PnL sums."""
+    with get_db_connection() as conn:
+        snapshots.rebuild_summary(conn, HISTORY_ARCHIVE_DIR)
+    click.echo('Depotwert-Übersicht neu berechnet.')
+
+
+@snapshots_cli.command('archive')
+@click.option('--before', type=int, default=lambda: date.today().year - 1, show_default='last year',
+              help='Archive all years before this one.')
+def snapshots_archive_command(before):
+    """Move old valuations into the attached archive file."""
+    with get_db_connection() as conn:
+        moved = snapshots.archive_before(conn, before, HISTORY_ARCHIVE_DIR)
+    for year, rows in moved.items():
+        click.echo(f'{year}: {rows} Bewertungen nach {snapshots.archive_path(HISTORY_ARCHIVE_DIR)}')
+    if not moved:
+        click.echo(f'Keine Bewertungen vor {before} vorhanden.')
+
+
+app.cli.add_command(snapshots_cli)
+
+
+shards_cli = AppGroup('shards', help='Split the database into per-investor shard files.')
+
+
+@shards_cli.command('build')
+@click.option('--count', default=4, show_default=True, help='Number of shard files.')
+@click.option('--directory', default=None, help='Target directory (default: SHARD_DIR).')
+def shards_build_command(count, directory):
+    """Split DATABASE_PATH into reference.db and COUNT shards by InvestorID."""
+    directory = directory or SHARD_DIR
+    if not directory:
+        raise click.UsageError('--directory oder SHARD_DIR angeben')
+    manifest = sharding.build_shards(DATABASE_PATH, directory, count)
+    click.echo(f"{manifest['count']} Shards und {manifest['reference']} in {directory} angelegt.")
+    click.echo('Mit SHARD_DIR gesetzt lesen die vordefinierten Abfragen aus den Shards; '
+               '/ingest und /prices/ticks sind dann gesperrt.')
+
+
+app.cli.add_command(shards_cli)
+
+
+startup_cli = AppGroup('startup', help='Database snapshots and warm-up for fast starts.')
+
+
+@startup_cli.command('snapshot')
+@click.option('--output', default=None, help='Snapshot file (default: BOOTSTRAP_SNAPSHOT).')
+def startup_snapshot_command(output):
+    """Copy DATABASE_PATH into a snapshot that new installations start from."""
+    output = output or SNAPSHOT_PATH
+    size = startup.create_snapshot(DATABASE_PATH, output)
+    click.echo(f'Snapshot {output} geschrieben ({size / 1024 / 1024:.1f} MiB).')
+    click.echo('Eine leere Datenbank wird beim Start aus diesem Snapshot angelegt.')
+
+
+@startup_cli.command('warmup')
+@click.option('--prepare-only', is_flag=True, help='Only compile the queries, do not run them.')
+def startup_warmup_command(prepare_only):
+    """Initialize the database and run the warm-up, reporting the timings."""
+    steps = init_database()
+    report = warm_up(execute=not prepare_only)
+    click.echo(f"init: {STARTUP_STATS['init_ms']:.1f} ms ({', '.join(steps) or 'Schema aktuell'})")
+    click.echo(f"warm-up: {report['warmup_ms']:.1f} ms, {report['preloaded_bytes'] / 1024 / 1024:.1f} MiB "
+               f"vorgeladen, {report['prepared']} Abfragen geprüft, {report['executed']} ausgeführt")
+    for query_id, error in report['errors'].items():
+        click.echo(f'FEHLER {query_id}: {error}')
+    if report['errors']:
+        raise SystemExit(1)
+
+
+app.cli.add_command(startup_cli)
+
+
 if __name__ == '__main__':
     print("Initialisiere Datenbank...")
     init_database()
     print("Datenbank initialisiert!")
+    if STARTUP_WARMUP != '0':
+        # Runs next to the server; requests arriving meanwhile are served normally
+        threading.Thread(target=warm_up, kwargs={'execute': STARTUP_WARMUP == 'full'},
+                         name='warm-up', daemon=True).start()
     print("\nStarte Webserver auf http://127.0.0.1:5000")
     print("Drücke Ctrl+C zum Beenden\n")
     app.run(debug=True, port=5000)
@@ -0,0 +1,312 @@
+"""
+Benchmark all predefined queries and the /schema and /statistics endpoints.
+
+Generates a database per scale with datagen.py, runs every endpoint through
+the Flask test client and reports p50/p95/p99 latency and the peak resident
+memory (RSS) of each target. Results are written as JSON so runs from
+different commits can be compared.
+
+With --startup, every scale is also started cold in fresh interpreters:
+process time, init_database, warm-up and the latency of the first request
+per predefined query, for an existing database without/with warm-up and
+for bootstrapping from a snapshot or from schema.sql + sample_data.sql.
+The OS page cache is not dropped between runs.
+
+Example:
+    python benchmark.py --scales 1,10 --runs 20 --output bench.json
+    python benchmark.py --scales 1,10 --compare bench.json
+    python benchmark.py --scales 1 --startup
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import app as webapp
+import datagen
+import index_advisor
+import startup
+
+
+# Cold start variants: (database, warm-up) - see startup_run
+STARTUP_MODES = ('existing', 'prepare', 'full', 'snapshot', 'sql')
+
+
+def percentile(values, q):
+    """Percentile with linear interpolation (q in 0..100)."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * q / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def rss_kb():
+    """Current resident set size of this process in KiB (None without /proc)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def reset_peak_rss():
+    """Reset the RSS high-water mark (VmHWM) of this process; False if the kernel does not allow it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KiB since the last reset_peak_rss()."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def use_database(path):
+    """Point the app at another database file and drop all pooled state."""
+    webapp.close_pools()
+    webapp.RESULT_CACHE.clear()
+    webapp.DATABASE_PATH = path
+    if webapp.PRICE_STORE is not None:
+        webapp.PRICE_STORE = webapp.price_store.PriceStore(path + '.kursverlauf_store')
+
+
+def time_endpoint(client, url, runs, cached=False):
+    """Request an endpoint `runs` times; returns the list of latencies in ms."""
+    timings = []
+    for _ in range(runs):
+        if not cached:
+            webapp.RESULT_CACHE.clear()
+        started = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}')
+    return timings
+
+
+def run_scale(scale, runs, seed, workdir, cached=False):
+    """Generate a database for one scale and benchmark every target on it."""
+    path = os.path.join(workdir, f'bench_scale_{scale:g}.db')
+    sizes = datagen.sizes_for(scale)
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        datagen.build_database(path, sizes, seed=seed)
+        print(f'scale {scale:g}: Datenbank erzeugt in {time.perf_counter() - started:.1f}s')
+    use_database(path)
+    client = webapp.app.test_client()
+
+    targets = [(f'query:{qid}', f'/execute_query/{qid}') for qid in webapp.PREDEFINED_QUERIES]
+    targets += [('schema', '/schema'), ('statistics', '/statistics')]
+
+    results = []
+    for name, url in targets:
+        rss_before = rss_kb()
+        # Peaks inside a request (fetchall, JSON encoding) are freed before
+        # it returns, so only the high-water mark shows them
+        per_target = reset_peak_rss()
+        # One untimed warm-up request (connection setup, derived tables)
+        time_endpoint(client, url, 1, cached)
+        timings = time_endpoint(client, url, runs, cached)
+        peak = peak_rss_kb()
+        results.append({
+            'scale': scale,
+            'target': name,
+            'runs': runs,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'peak_rss_kb': peak,
+            # Peak above the RSS at the start of the target
+            'peak_rss_delta_kb': peak - rss_before if per_target and rss_before is not None else None,
+            # 'process': no reset possible, the value is the peak of the whole run so far
+            'peak_rss_scope': 'target' if per_target else 'process',
+        })
+        print(f"scale {scale:<6g}{name:<34}p50 {results[-1]['p50_ms']:>10.2f} ms"
+              f"   p95 {results[-1]['p95_ms']:>10.2f} ms   p99 {results[-1]['p99_ms']:>10.2f} ms")
+    return results, sizes, path
+
+
+def startup_run(mode, path, snapshot):
+    """
+    One cold start in this freshly started process; returns its timings.
+
+    existing/prepare/full start against the database at path without
+    warm-up, with the queries only compiled, or with every query run once;
+    snapshot and sql create a new database next to it from the snapshot or
+    by replaying schema.sql and sample_data.sql.
+    """
+    if mode in ('snapshot', 'sql'):
+        path = os.path.join(os.path.dirname(path), f'startup_{mode}.db')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    use_database(path)
+    webapp.SNAPSHOT_PATH = snapshot if mode == 'snapshot' else path + '.no-snapshot'
+    webapp.init_database()
+    if mode in ('prepare', 'full'):
+        webapp.warm_up(execute=mode == 'full')
+    client = webapp.app.test_client()
+    first = {}
+    for qid in webapp.PREDEFINED_QUERIES:
+        first[qid] = time_endpoint(client, f'/execute_query/{qid}', 1, cached=True)[0]
+    return {
+        'init_ms': webapp.STARTUP_STATS['init_ms'],
+        'init_steps': webapp.STARTUP_STATS['init_steps'],
+        'warmup_ms': webapp.STARTUP_STATS.get('warmup_ms', 0),
+        'first_request_ms': first,
+    }
+
+
+def run_startup(scale, path, runs):
+    """Cold start every STARTUP_MODES variant `runs` times in a new interpreter."""
+    snapshot = path + '.snapshot'
+    if not os.path.exists(snapshot):
+        startup.create_snapshot(path, snapshot)
+    results = []
+    for mode in STARTUP_MODES:
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--startup-run', mode,
+                 '--database', path, '--snapshot', snapshot],
+                check=True, capture_output=True, text=True).stdout
+            process_ms = (time.perf_counter() - started) * 1000
+            sample = json.loads(output.strip().splitlines()[-1])
+            sample['process_ms'] = process_ms
+            samples.append(sample)
+        median = lambda values: round(statistics.median(values), 3)
+        first = [sum(s['first_request_ms'].values()) for s in samples]
+        results.append({
+            'scale': scale,
+            'mode': mode,
+            'runs': runs,
+            'process_ms': median([s['process_ms'] for s in samples]),
+            'init_ms': median([s['init_ms'] for s in samples]),
+            'init_steps': samples[-1]['init_steps'],
+            'warmup_ms': median([s['warmup_ms'] for s in samples]),
+            'first_requests_ms': median(first),
+            'slowest_first_request_ms': median([max(s['first_request_ms'].values()) for s in samples]),
+        })
+        r = results[-1]
+        print(f"scale {scale:<6g}startup {mode:<10}process {r['process_ms']:>9.1f} ms   "
+              f"init {r['init_ms']:>8.1f} ms   warm-up {r['warmup_ms']:>8.1f} ms   "
+              f"first requests {r['first_requests_ms']:>8.1f} ms (max {r['slowest_first_request_ms']:.1f})")
+    return results
+
+
+def compare(current, previous_path, threshold):
+    """Print targets whose p50 got slower by more than threshold (fraction)."""
+    with open(previous_path, 'r', encoding='utf-8') as f:
+        previous = json.load(f)
+    before = {(r['scale'], r['target']): r for r in previous['results']}
+    regressions = 0
+    for result in current['results']:
+        old = before.get((result['scale'], result['target']))
+        if old is None or not old['p50_ms']:
+            continue
+        change = result['p50_ms'] / old['p50_ms'] - 1
+        if change > threshold:
+            regressions += 1
+            print(f"REGRESSION scale {result['scale']:g} {result['target']}: "
+                  f"{old['p50_ms']:.2f} -> {result['p50_ms']:.2f} ms ({change:+.0%})")
+    print(f"{regressions} Regression(en) gegenüber {previous.get('commit') or previous_path}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the predefined queries at several scales.')
+    parser.add_argument('--scales', default='1,10', help='Comma separated scale factors (see datagen.py)')
+    parser.add_argument('--runs', type=int, default=10, help='Timed runs per target')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help='Directory for generated databases (kept between runs)')
+    parser.add_argument('--cached', action='store_true', help='Keep the result cache between runs')
+    parser.add_argument('--indexes', action='store_true',
+                        help='Also time all queries without/with the migration indexes')
+    parser.add_argument('--output', help='Write machine-readable results to this JSON file')
+    parser.add_argument('--compare', help='Previous JSON results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative p50 slowdown reported as regression (default 0.2)')
+    parser.add_argument('--startup', action='store_true',
+                        help='Also measure cold starts and first-request latency')
+    parser.add_argument('--startup-runs', type=int, default=3, help='Cold starts per variant')
+    # Internal: one cold start in a child process (see run_startup)
+    parser.add_argument('--startup-run', choices=STARTUP_MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--snapshot', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.startup_run:
+        print(json.dumps(startup_run(args.startup_run, args.database, args.snapshot)))
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='aktienportfolio_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'cached': args.cached,
+        'sizes': {},
+        'results': [],
+        'indexes': [],
+        'startup': [],
+    }
+    for scale in (float(s) for s in args.scales.split(',')):
+        results, sizes, path = run_scale(scale, args.runs, args.seed, workdir, args.cached)
+        report['sizes'][f'{scale:g}'] = sizes
+        report['results'].extend(results)
+        if args.indexes:
+            queries = {qid: webapp.default_statement(q) for qid, q in webapp.PREDEFINED_QUERIES.items()}
+            for qid, (before, after) in index_advisor.benchmark_migrations(path, queries).items():
+                report['indexes'].append({'scale': scale, 'query': qid,
+                                          'before_ms': round(before, 3), 'after_ms': round(after, 3)})
+                print(f'scale {scale:<6g}index {qid:<28}{before:>10.2f} -> {after:>10.2f} ms')
+        if args.startup:
+            report['startup'].extend(run_startup(scale, path, args.startup_runs))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Ergebnisse geschrieben: {args.output}')
+    if args.compare:
+        if compare(report, args.compare, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+-- Composite and covering indexes proposed by the index advisor
+-- (see `flask indexes advise`).
+
+-- Per depot/stock lookups of the ledger (filters by depot, stock, type and date)
+CREATE INDEX IF NOT EXISTS idx_transaktionen_depot_isin_typ_datum ON Transaktionen(DepotID, ISIN, Typ, Datum);
+
+-- stock_popularity: LEFT JOIN Transaktionen ON ISIN, covering the aggregated columns
+CREATE INDEX IF NOT EXISTS idx_transaktionen_isin ON Transaktionen(ISIN, DepotID, Menge, Gesamtwert);
+
+-- inactive_depots: MAX(Datum) per depot straight from the index
+CREATE INDEX IF NOT EXISTS idx_transaktionen_depot_datum ON Transaktionen(DepotID, Datum);
+
+-- depot_performance: first/last value per depot in the correlated subqueries
+CREATE INDEX IF NOT EXISTS idx_historischer_depotwert_depot_datum ON HistorischerDepotwert(DepotID, Datum, Gesamtwert);
+
+-- inactive_depots / investor_contacts: phone numbers per investor
+CREATE INDEX IF NOT EXISTS idx_telefonnummer_investor ON Telefonnummer(InvestorID);
+
+-- top_performers: price history per stock, covering the closing price
+CREATE INDEX IF NOT EXISTS idx_kursverlauf_isin_datum ON Kursverlauf(ISIN, Datum, Endkurs);
+
+-- Refresh planner statistics for the new indexes
+ANALYZE;
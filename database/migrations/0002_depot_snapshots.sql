@@ -0,0 +1,107 @@
+-- Precomputed depot valuations (see snapshots.py and `flask snapshots`).
+
+-- Running sum of DailyPnL per depot, so the PnL over any date range is the
+-- difference of two index lookups
+ALTER TABLE HistorischerDepotwert ADD COLUMN KumulierterPnL DECIMAL(14, 2);
+
+-- DepotwertUebersicht - First/last valuation and PnL totals per depot,
+-- maintained by the triggers below on every appended valuation
+CREATE TABLE IF NOT EXISTS DepotwertUebersicht (
+    DepotID INTEGER PRIMARY KEY,
+    ErsterTag DATE NOT NULL,
+    ErsterWert DECIMAL(12, 2) NOT NULL,
+    LetzterTag DATE NOT NULL,
+    LetzterWert DECIMAL(12, 2) NOT NULL,
+    SummePnL DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    AnzahlBewertungen INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (DepotID) REFERENCES Depot(DepotID)
+);
+
+-- SnapshotStatus - Last day valued by the snapshot engine
+CREATE TABLE IF NOT EXISTS SnapshotStatus (
+    ID INTEGER PRIMARY KEY CHECK (ID = 1),
+    LetztesDatum DATE,
+    NeuBerechnen INTEGER NOT NULL DEFAULT 0 -- set when existing valuations change
+);
+
+INSERT OR IGNORE INTO SnapshotStatus (ID) VALUES (1);
+
+-- SnapshotBestand / SnapshotKurs - Holdings and last closing prices as of
+-- SnapshotStatus.LetztesDatum (state of the engine between runs)
+CREATE TABLE IF NOT EXISTS SnapshotBestand (
+    DepotID INTEGER NOT NULL,
+    ISIN VARCHAR(12) NOT NULL,
+    Menge INTEGER NOT NULL,
+    PRIMARY KEY (DepotID, ISIN)
+);
+
+CREATE TABLE IF NOT EXISTS SnapshotKurs (
+    ISIN VARCHAR(12) PRIMARY KEY,
+    Datum DATE NOT NULL,
+    Endkurs DECIMAL(10, 2) NOT NULL
+);
+
+-- Appending a valuation extends the summary; anything dated on or before
+-- the last valuation of the depot forces a rebuild
+CREATE TRIGGER IF NOT EXISTS trg_depotwert_insert AFTER INSERT ON HistorischerDepotwert
+BEGIN
+    UPDATE SnapshotStatus SET NeuBerechnen = 1
+    WHERE EXISTS (SELECT 1 FROM DepotwertUebersicht WHERE DepotID = NEW.DepotID AND LetzterTag >= NEW.Datum);
+    INSERT INTO DepotwertUebersicht
+        (DepotID, ErsterTag, ErsterWert, LetzterTag, LetzterWert, SummePnL, AnzahlBewertungen)
+    SELECT NEW.DepotID, NEW.Datum, NEW.Gesamtwert, NEW.Datum, NEW.Gesamtwert, NEW.DailyPnL, 1
+    WHERE NOT EXISTS (SELECT 1 FROM DepotwertUebersicht WHERE DepotID = NEW.DepotID AND LetzterTag >= NEW.Datum)
+    ON CONFLICT (DepotID) DO UPDATE SET
+        LetzterTag = excluded.LetzterTag,
+        LetzterWert = excluded.LetzterWert,
+        SummePnL = ROUND(SummePnL + excluded.SummePnL, 2),
+        AnzahlBewertungen = AnzahlBewertungen + 1;
+    UPDATE HistorischerDepotwert
+    SET KumulierterPnL = (SELECT SummePnL FROM DepotwertUebersicht WHERE DepotID = NEW.DepotID)
+    WHERE Datum = NEW.Datum AND DepotID = NEW.DepotID;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_depotwert_update AFTER UPDATE OF Datum, DepotID, Gesamtwert, DailyPnL
+ON HistorischerDepotwert
+BEGIN
+    UPDATE SnapshotStatus SET NeuBerechnen = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_depotwert_delete AFTER DELETE ON HistorischerDepotwert
+BEGIN
+    UPDATE SnapshotStatus SET NeuBerechnen = 1;
+END;
+
+INSERT OR IGNORE INTO Tabellenversion (Tabelle) VALUES ('DepotwertUebersicht');
+
+CREATE TRIGGER IF NOT EXISTS trg_version_depotwertuebersicht_insert AFTER INSERT ON DepotwertUebersicht
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'DepotwertUebersicht';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_depotwertuebersicht_update AFTER UPDATE ON DepotwertUebersicht
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'DepotwertUebersicht';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_depotwertuebersicht_delete AFTER DELETE ON DepotwertUebersicht
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'DepotwertUebersicht';
+END;
+
+-- Fill running sums and summary for the existing valuations
+UPDATE HistorischerDepotwert AS h
+SET KumulierterPnL = c.Kumuliert
+FROM (SELECT DepotID, Datum,
+             ROUND(SUM(DailyPnL) OVER (PARTITION BY DepotID ORDER BY Datum), 2) AS Kumuliert
+      FROM HistorischerDepotwert) AS c
+WHERE h.DepotID = c.DepotID AND h.Datum = c.Datum;
+
+INSERT OR REPLACE INTO DepotwertUebersicht
+    (DepotID, ErsterTag, ErsterWert, LetzterTag, LetzterWert, SummePnL, AnzahlBewertungen)
+SELECT f.DepotID, f.Datum, f.Gesamtwert, l.Datum, l.Gesamtwert, l.Summe, l.Anzahl
+FROM (SELECT DepotID, MIN(Datum) AS Datum, Gesamtwert FROM HistorischerDepotwert GROUP BY DepotID) f
+JOIN (SELECT DepotID, MAX(Datum) AS Datum, Gesamtwert, ROUND(SUM(DailyPnL), 2) AS Summe, COUNT(*) AS Anzahl
+      FROM HistorischerDepotwert GROUP BY DepotID) l ON l.DepotID = f.DepotID;
+
+UPDATE SnapshotStatus SET NeuBerechnen = 0;
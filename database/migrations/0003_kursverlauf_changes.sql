@@ -0,0 +1,31 @@
+-- Change log of Kursverlauf for the columnar store (see price_store.py).
+
+-- Kursaenderung - Key of every inserted, updated or deleted bar, so the
+-- store only re-reads the bars that changed since it was built. The log
+-- keeps the last 100000 entries; a store that fell further behind is
+-- rebuilt from the table.
+CREATE TABLE IF NOT EXISTS Kursaenderung (
+    Seq INTEGER PRIMARY KEY,
+    ISIN VARCHAR(12) NOT NULL,
+    Datum DATE NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_kursaenderung_insert AFTER INSERT ON Kursverlauf
+BEGIN
+    INSERT INTO Kursaenderung (ISIN, Datum) VALUES (NEW.ISIN, NEW.Datum);
+    DELETE FROM Kursaenderung WHERE Seq <= last_insert_rowid() - 100000;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_kursaenderung_update AFTER UPDATE ON Kursverlauf
+BEGIN
+    INSERT INTO Kursaenderung (ISIN, Datum) VALUES (NEW.ISIN, NEW.Datum);
+    INSERT INTO Kursaenderung (ISIN, Datum)
+    SELECT OLD.ISIN, OLD.Datum WHERE OLD.ISIN <> NEW.ISIN OR OLD.Datum <> NEW.Datum;
+    DELETE FROM Kursaenderung WHERE Seq <= last_insert_rowid() - 100000;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_kursaenderung_delete AFTER DELETE ON Kursverlauf
+BEGIN
+    INSERT INTO Kursaenderung (ISIN, Datum) VALUES (OLD.ISIN, OLD.Datum);
+    DELETE FROM Kursaenderung WHERE Seq <= last_insert_rowid() - 100000;
+END;
@@ -0,0 +1,23 @@
+-- The insert trigger of HistorischerDepotwert only maintains the summary.
+-- Writing KumulierterPnL back into the new row bumped the Tabellenversion
+-- of HistorischerDepotwert a second time; the snapshot engine now inserts
+-- the running sum with the row, and rows without one (other writers)
+-- mark the summary for a rebuild.
+
+DROP TRIGGER IF EXISTS trg_depotwert_insert;
+
+CREATE TRIGGER trg_depotwert_insert AFTER INSERT ON HistorischerDepotwert
+BEGIN
+    UPDATE SnapshotStatus SET NeuBerechnen = 1
+    WHERE NEW.KumulierterPnL IS NULL
+       OR EXISTS (SELECT 1 FROM DepotwertUebersicht WHERE DepotID = NEW.DepotID AND LetzterTag >= NEW.Datum);
+    INSERT INTO DepotwertUebersicht
+        (DepotID, ErsterTag, ErsterWert, LetzterTag, LetzterWert, SummePnL, AnzahlBewertungen)
+    SELECT NEW.DepotID, NEW.Datum, NEW.Gesamtwert, NEW.Datum, NEW.Gesamtwert, NEW.DailyPnL, 1
+    WHERE NOT EXISTS (SELECT 1 FROM DepotwertUebersicht WHERE DepotID = NEW.DepotID AND LetzterTag >= NEW.Datum)
+    ON CONFLICT (DepotID) DO UPDATE SET
+        LetzterTag = excluded.LetzterTag,
+        LetzterWert = excluded.LetzterWert,
+        SummePnL = ROUND(SummePnL + excluded.SummePnL, 2),
+        AnzahlBewertungen = AnzahlBewertungen + 1;
+END;
@@ -0,0 +1,11 @@
+-- Identity of the database file for caches kept outside of it (see price_store.py).
+
+-- Datenbankkennung - Random id created with the database, so a store
+-- built from another (or a deleted and re-created) database is not
+-- mistaken for this one. startup.restore_snapshot assigns a new id.
+CREATE TABLE IF NOT EXISTS Datenbankkennung (
+    ID INTEGER PRIMARY KEY CHECK (ID = 1),
+    Kennung TEXT NOT NULL
+);
+
+INSERT OR IGNORE INTO Datenbankkennung (ID, Kennung) VALUES (1, lower(hex(randomblob(16))));
@@ -85,6 +85,341 @@ CREATE TABLE IF NOT EXISTS HistorischerDepotwert (
     FOREIGN KEY (DepotID) REFERENCES Depot(DepotID)
 );
 
+-- Position - Materialized net holdings per depot and stock.
+-- Maintained incrementally by the triggers below whenever Transaktionen changes,
+-- so queries no longer need to aggregate the full transaction ledger.
+CREATE TABLE IF NOT EXISTS Position (
+    DepotID INTEGER NOT NULL,
+    ISIN VARCHAR(12) NOT NULL,
+    Menge INTEGER NOT NULL DEFAULT 0, -- net quantity (buys - sells)
+    Kaufmenge INTEGER NOT NULL DEFAULT 0,
+    Einstandswert DECIMAL(14, 2) NOT NULL DEFAULT 0, -- cost basis: total value of all buys
+    AnzahlKaeufe INTEGER NOT NULL DEFAULT 0,
+    SummeKaufpreise DECIMAL(14, 2) NOT NULL DEFAULT 0, -- sum of buy prices (for the average buy price)
+    AnzahlTransaktionen INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (DepotID, ISIN),
+    FOREIGN KEY (DepotID) REFERENCES Depot(DepotID),
+    FOREIGN KEY (ISIN) REFERENCES Aktie(ISIN)
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_position_insert AFTER INSERT ON Transaktionen
+BEGIN
+    INSERT INTO Position (DepotID, ISIN, Menge, Kaufmenge, Einstandswert, AnzahlKaeufe, SummeKaufpreise, AnzahlTransaktionen)
+    VALUES (
+        NEW.DepotID,
+        NEW.ISIN,
+        CASE WHEN NEW.Typ = 'Kauf' THEN NEW.Menge ELSE -NEW.Menge END,
+        CASE WHEN NEW.Typ = 'Kauf' THEN NEW.Menge ELSE 0 END,
+        CASE WHEN NEW.Typ = 'Kauf' THEN NEW.Gesamtwert ELSE 0 END,
+        CASE WHEN NEW.Typ = 'Kauf' THEN 1 ELSE 0 END,
+        CASE WHEN NEW.Typ = 'Kauf' THEN NEW.Stueckpreis ELSE 0 END,
+        1
+    )
+    ON CONFLICT (DepotID, ISIN) DO UPDATE SET
+        Menge = Menge + excluded.Menge,
+        Kaufmenge = Kaufmenge + excluded.Kaufmenge,
+        Einstandswert = Einstandswert + excluded.Einstandswert,
+        AnzahlKaeufe = AnzahlKaeufe + excluded.AnzahlKaeufe,
+        SummeKaufpreise = SummeKaufpreise + excluded.SummeKaufpreise,
+        AnzahlTransaktionen = AnzahlTransaktionen + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_position_delete AFTER DELETE ON Transaktionen
+BEGIN
+    UPDATE Position SET
+        Menge = Menge - CASE WHEN OLD.Typ = 'Kauf' THEN OLD.Menge ELSE -OLD.Menge END,
+        Kaufmenge = Kaufmenge - CASE WHEN OLD.Typ = 'Kauf' THEN OLD.Menge ELSE 0 END,
+        Einstandswert = Einstandswert - CASE WHEN OLD.Typ = 'Kauf' THEN OLD.Gesamtwert ELSE 0 END,
+        AnzahlKaeufe = AnzahlKaeufe - CASE WHEN OLD.Typ = 'Kauf' THEN 1 ELSE 0 END,
+        SummeKaufpreise = SummeKaufpreise - CASE WHEN OLD.Typ = 'Kauf' THEN OLD.Stueckpreis ELSE 0 END,
+        AnzahlTransaktionen = AnzahlTransaktionen - 1
+    WHERE DepotID = OLD.DepotID AND ISIN = OLD.ISIN;
+    DELETE FROM Position
+    WHERE DepotID = OLD.DepotID AND ISIN = OLD.ISIN AND AnzahlTransaktionen <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_position_update AFTER UPDATE OF DepotID, ISIN, Typ, Menge, Stueckpreis, Gesamtwert ON Transaktionen
+BEGIN
+    UPDATE Position SET
+        Menge = Menge - CASE WHEN OLD.Typ = 'Kauf' THEN OLD.Menge ELSE -OLD.Menge END,
+        Kaufmenge = Kaufmenge - CASE WHEN OLD.Typ = 'Kauf' THEN OLD.Menge ELSE 0 END,
+        Einstandswert = Einstandswert - CASE WHEN OLD.Typ = 'Kauf' THEN OLD.Gesamtwert ELSE 0 END,
+        AnzahlKaeufe = AnzahlKaeufe - CASE WHEN OLD.Typ = 'Kauf' THEN 1 ELSE 0 END,
+        SummeKaufpreise = SummeKaufpreise - CASE WHEN OLD.Typ = 'Kauf' THEN OLD.Stueckpreis ELSE 0 END,
+        AnzahlTransaktionen = AnzahlTransaktionen - 1
+    WHERE DepotID = OLD.DepotID AND ISIN = OLD.ISIN;
+    DELETE FROM Position
+    WHERE DepotID = OLD.DepotID AND ISIN = OLD.ISIN AND AnzahlTransaktionen <= 0;
+    INSERT INTO Position (DepotID, ISIN, Menge, Kaufmenge, Einstandswert, AnzahlKaeufe, SummeKaufpreise, AnzahlTransaktionen)
+    VALUES (
+        NEW.DepotID,
+        NEW.ISIN,
+        CASE WHEN NEW.Typ = 'Kauf' THEN NEW.Menge ELSE -NEW.Menge END,
+        CASE WHEN NEW.Typ = 'Kauf' THEN NEW.Menge ELSE 0 END,
+        CASE WHEN NEW.Typ = 'Kauf' THEN NEW.Gesamtwert ELSE 0 END,
+        CASE WHEN NEW.Typ = 'Kauf' THEN 1 ELSE 0 END,
+        CASE WHEN NEW.Typ = 'Kauf' THEN NEW.Stueckpreis ELSE 0 END,
+        1
+    )
+    ON CONFLICT (DepotID, ISIN) DO UPDATE SET
+        Menge = Menge + excluded.Menge,
+        Kaufmenge = Kaufmenge + excluded.Kaufmenge,
+        Einstandswert = Einstandswert + excluded.Einstandswert,
+        AnzahlKaeufe = AnzahlKaeufe + excluded.AnzahlKaeufe,
+        SummeKaufpreise = SummeKaufpreise + excluded.SummeKaufpreise,
+        AnzahlTransaktionen = AnzahlTransaktionen + 1;
+END;
+
+-- RealisierterGewinn - Realized gain per sale, computed by the lot-matching engine (pnl.py)
+CREATE TABLE IF NOT EXISTS RealisierterGewinn (
+    TransaktionsID INTEGER NOT NULL,
+    Methode VARCHAR(10) NOT NULL, -- 'FIFO', 'LIFO', 'AVG'
+    DepotID INTEGER NOT NULL,
+    ISIN VARCHAR(12) NOT NULL,
+    Datum DATETIME NOT NULL,
+    Menge INTEGER NOT NULL,
+    Verkaufspreis DECIMAL(10, 2) NOT NULL,
+    Verkaufswert DECIMAL(12, 2) NOT NULL,
+    GedeckteMenge INTEGER NOT NULL, -- quantity matched against earlier buys
+    Einstandswert DECIMAL(12, 2), -- cost of the matched quantity
+    Gewinn DECIMAL(12, 2),
+    PRIMARY KEY (TransaktionsID, Methode),
+    FOREIGN KEY (TransaktionsID) REFERENCES Transaktionen(TransaktionsID)
+);
+
+-- Lot - Open purchase lots per depot, stock and cost method (state of the engine)
+CREATE TABLE IF NOT EXISTS Lot (
+    Methode VARCHAR(10) NOT NULL,
+    DepotID INTEGER NOT NULL,
+    ISIN VARCHAR(12) NOT NULL,
+    Seq INTEGER NOT NULL,
+    KaufTransaktionsID INTEGER NOT NULL,
+    Menge INTEGER NOT NULL,
+    Stueckpreis DECIMAL(10, 2) NOT NULL,
+    PRIMARY KEY (Methode, DepotID, ISIN, Seq)
+);
+
+-- GewinnStatus - Last transaction processed by the engine per cost method
+CREATE TABLE IF NOT EXISTS GewinnStatus (
+    Methode VARCHAR(10) PRIMARY KEY,
+    LetzteTransaktionsID INTEGER NOT NULL DEFAULT 0,
+    LetztesDatum DATETIME,
+    NeuBerechnen INTEGER NOT NULL DEFAULT 0 -- set when processed transactions change
+);
+
+-- Changing or deleting already processed transactions forces a rebuild
+CREATE TRIGGER IF NOT EXISTS trg_gewinn_transaktionen_update AFTER UPDATE ON Transaktionen
+BEGIN
+    UPDATE GewinnStatus SET NeuBerechnen = 1 WHERE LetzteTransaktionsID >= OLD.TransaktionsID;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_gewinn_transaktionen_delete AFTER DELETE ON Transaktionen
+BEGIN
+    UPDATE GewinnStatus SET NeuBerechnen = 1 WHERE LetzteTransaktionsID >= OLD.TransaktionsID;
+END;
+
+-- Tabellenversion - Change counter per table, maintained by triggers.
+-- Used to invalidate cached query results when the underlying data changes.
+CREATE TABLE IF NOT EXISTS Tabellenversion (
+    Tabelle VARCHAR(50) PRIMARY KEY,
+    Version INTEGER NOT NULL DEFAULT 0,
+    GeaendertAm DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT OR IGNORE INTO Tabellenversion (Tabelle) VALUES
+('Unternehmen'),
+('Aktie'),
+('Kursverlauf'),
+('Investor'),
+('Telefonnummer'),
+('Depot'),
+('Transaktionen'),
+('HistorischerDepotwert'),
+('Position'),
+('RealisierterGewinn'),
+('Lot'),
+('GewinnStatus');
+
+CREATE TRIGGER IF NOT EXISTS trg_version_unternehmen_insert AFTER INSERT ON Unternehmen
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Unternehmen';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_unternehmen_update AFTER UPDATE ON Unternehmen
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Unternehmen';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_unternehmen_delete AFTER DELETE ON Unternehmen
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Unternehmen';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_aktie_insert AFTER INSERT ON Aktie
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Aktie';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_aktie_update AFTER UPDATE ON Aktie
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Aktie';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_aktie_delete AFTER DELETE ON Aktie
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Aktie';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_kursverlauf_insert AFTER INSERT ON Kursverlauf
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Kursverlauf';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_kursverlauf_update AFTER UPDATE ON Kursverlauf
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Kursverlauf';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_kursverlauf_delete AFTER DELETE ON Kursverlauf
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Kursverlauf';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_investor_insert AFTER INSERT ON Investor
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Investor';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_investor_update AFTER UPDATE ON Investor
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Investor';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_investor_delete AFTER DELETE ON Investor
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Investor';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_telefonnummer_insert AFTER INSERT ON Telefonnummer
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Telefonnummer';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_telefonnummer_update AFTER UPDATE ON Telefonnummer
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Telefonnummer';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_telefonnummer_delete AFTER DELETE ON Telefonnummer
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Telefonnummer';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_depot_insert AFTER INSERT ON Depot
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Depot';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_depot_update AFTER UPDATE ON Depot
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Depot';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_depot_delete AFTER DELETE ON Depot
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Depot';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_transaktionen_insert AFTER INSERT ON Transaktionen
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Transaktionen';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_transaktionen_update AFTER UPDATE ON Transaktionen
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Transaktionen';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_transaktionen_delete AFTER DELETE ON Transaktionen
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Transaktionen';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_historischerdepotwert_insert AFTER INSERT ON HistorischerDepotwert
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'HistorischerDepotwert';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_historischerdepotwert_update AFTER UPDATE ON HistorischerDepotwert
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'HistorischerDepotwert';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_historischerdepotwert_delete AFTER DELETE ON HistorischerDepotwert
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'HistorischerDepotwert';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_position_insert AFTER INSERT ON Position
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Position';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_position_update AFTER UPDATE ON Position
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Position';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_position_delete AFTER DELETE ON Position
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Position';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_realisiertergewinn_insert AFTER INSERT ON RealisierterGewinn
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'RealisierterGewinn';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_realisiertergewinn_update AFTER UPDATE ON RealisierterGewinn
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'RealisierterGewinn';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_realisiertergewinn_delete AFTER DELETE ON RealisierterGewinn
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'RealisierterGewinn';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_lot_insert AFTER INSERT ON Lot
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Lot';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_lot_update AFTER UPDATE ON Lot
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Lot';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_lot_delete AFTER DELETE ON Lot
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'Lot';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_gewinnstatus_insert AFTER INSERT ON GewinnStatus
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'GewinnStatus';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_gewinnstatus_update AFTER UPDATE ON GewinnStatus
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'GewinnStatus';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_version_gewinnstatus_delete AFTER DELETE ON GewinnStatus
+BEGIN
+    UPDATE Tabellenversion SET Version = Version + 1, GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = 'GewinnStatus';
+END;
+
 -- Indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_aktie_unternehmen ON Aktie(UnternehmenID);
 CREATE INDEX IF NOT EXISTS idx_kursverlauf_datum ON Kursverlauf(Datum);
@@ -93,3 +428,5 @@ CREATE INDEX IF NOT EXISTS idx_transaktionen_datum ON Transaktionen(Datum);
 CREATE INDEX IF NOT EXISTS idx_depot_investor ON Depot(InvestorID);
 CREATE INDEX IF NOT EXISTS idx_historischer_depotwert_datum ON HistorischerDepotwert(Datum);
 
+CREATE INDEX IF NOT EXISTS idx_position_isin ON Position(ISIN);
+CREATE INDEX IF NOT EXISTS idx_realisiertergewinn_methode ON RealisierterGewinn(Methode, Gewinn);
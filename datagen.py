@@ -0,0 +1,226 @@
+"""
+Seeded generator for large synthetic Aktienportfolio databases.
+
+Example:
+    python datagen.py --output /tmp/gross.db --scale 50 --seed 1
+    python datagen.py --output /tmp/kurse.db --unternehmen 2000 --kurstage 2500
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+from migrations import ensure_schema
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'database', 'schema.sql')
+
+# Row counts at scale 1; --scale multiplies them, per-table options override them.
+BASE_SIZES = {
+    'unternehmen': 50,
+    'investoren': 200,
+    'depots': 400,
+    'transaktionen': 20000,
+}
+# Length of the price and depot value history in trading days (not scaled).
+BASE_DAYS = {
+    'kurstage': 250,
+    'bewertungstage': 250,
+}
+
+BRANCHEN = ['Technologie', 'Software', 'Finanzdienstleistungen', 'Automobil', 'Chemie',
+            'Versicherung', 'Pharma', 'Telekommunikation', 'Konsumgüter', 'E-Commerce',
+            'Halbleiter', 'Energie', 'Industrie', 'Immobilien']
+LAENDER = [('Deutschland', 'DE', 'EUR'), ('USA', 'US', 'USD'), ('Schweiz', 'CH', 'CHF'),
+           ('Frankreich', 'FR', 'EUR'), ('Niederlande', 'NL', 'EUR'), ('Japan', 'JP', 'JPY')]
+VORNAMEN = ['Hans', 'Anna', 'Thomas', 'Maria', 'Michael', 'Claudia', 'Stefan', 'Julia',
+            'Christian', 'Sabine', 'Peter', 'Laura', 'Daniel', 'Sarah', 'Markus', 'Lea']
+NACHNAMEN = ['Müller', 'Schmidt', 'Weber', 'Schneider', 'Fischer', 'Meyer', 'Wagner',
+             'Becker', 'Hoffmann', 'Schulz', 'Keller', 'Brunner', 'Frei', 'Gerber']
+ORTE = [('8001', 'Zürich'), ('3011', 'Bern'), ('1204', 'Genf'), ('4001', 'Basel'),
+        ('6900', 'Lugano'), ('6004', 'Luzern'), ('9000', 'St. Gallen')]
+DEPOT_NAMEN = ['Hauptdepot', 'Dividenden Portfolio', 'Altersvorsorge', 'Trading Depot',
+               'Wachstumsdepot', 'Konservatives Depot', 'Familienvorsorge', 'Spekulatives Depot',
+               'Langzeit-Investment', 'US-Tech Depot']
+DEPOT_STATUS = ['Aktiv'] * 8 + ['Gesperrt', 'Geschlossen']
+
+BATCH_SIZE = 50000
+
+
+def sizes_for(scale=1.0, **overrides):
+    """Row counts for a scale factor, with per-table overrides (None = use the scaled default)."""
+    sizes = {name: max(1, int(count * scale)) for name, count in BASE_SIZES.items()}
+    sizes.update(BASE_DAYS)
+    sizes.update({name: value for name, value in overrides.items() if value is not None})
+    return sizes
+
+
+def trading_days(count, end=date(2024, 12, 31)):
+    """The last `count` weekdays up to `end`, oldest first."""
+    days = []
+    day = end
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day -= timedelta(days=1)
+    return days[::-1]
+
+
+def create_schema(conn):
+    ensure_schema(conn, SCHEMA_PATH)
+
+
+def _insert(conn, sql, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        conn.executemany(sql, rows[start:start + BATCH_SIZE])
+
+
+def generate(conn, sizes, seed=42, log=None):
+    """
+    Fill an empty database with synthetic data.
+
+    Everything is written with executemany inside one transaction. The
+    output only depends on the seed and the sizes.
+    """
+    rng = random.Random(seed)
+    say = log or (lambda message: None)
+    conn.execute("BEGIN")
+
+    # Unternehmen and Aktie
+    stocks = []
+    companies = []
+    for n in range(1, sizes['unternehmen'] + 1):
+        land, code, currency = rng.choice(LAENDER)
+        companies.append((n, f'Unternehmen {n:05d} AG', rng.choice(BRANCHEN), land))
+        stocks.append((f'{code}{n:09d}0', n, f'T{n:05d}', currency))
+    _insert(conn, "INSERT INTO Unternehmen (UnternehmenID, Name, Branche, Land) VALUES (?, ?, ?, ?)",
+            companies)
+
+    # Kursverlauf as a random walk per stock; the last close becomes AktuellerKurs
+    days = trading_days(sizes['kurstage'])
+    closes = {}
+    price_rows = []
+    aktie_rows = []
+    for isin, company_id, ticker, currency in stocks:
+        price = rng.uniform(10, 500)
+        history = []
+        for day in days:
+            open_ = price
+            close = max(1.0, open_ * (1 + rng.gauss(0.0003, 0.02)))
+            high = max(open_, close) * (1 + abs(rng.gauss(0, 0.01)))
+            low = min(open_, close) * (1 - abs(rng.gauss(0, 0.01)))
+            history.append(round(close, 2))
+            price_rows.append((day.isoformat(), isin, round(open_, 2), round(low, 2),
+                               round(high, 2), round(close, 2), rng.randint(10000, 5000000)))
+            price = close
+        closes[isin] = history
+        aktie_rows.append((isin, company_id, ticker, currency, history[-1] if history else 100.0))
+    _insert(conn, "INSERT INTO Aktie (ISIN, UnternehmenID, Ticker, Waehrung, AktuellerKurs) "
+                  "VALUES (?, ?, ?, ?, ?)", aktie_rows)
+    _insert(conn, "INSERT INTO Kursverlauf (Datum, ISIN, Oeffnungskurs, Tiefstkurs, Hoechstkurs, "
+                  "Endkurs, Volumen) VALUES (?, ?, ?, ?, ?, ?, ?)", price_rows)
+    say(f'{len(companies)} Unternehmen, {len(price_rows)} Kurse')
+    del price_rows
+
+    # Investor, Telefonnummer, Depot
+    investors, phones = [], []
+    for n in range(1, sizes['investoren'] + 1):
+        plz, ort = rng.choice(ORTE)
+        vorname, nachname = rng.choice(VORNAMEN), rng.choice(NACHNAMEN)
+        investors.append((n, nachname, vorname, f'{vorname.lower()}.{n}@example.ch',
+                          f'Musterstrasse {rng.randint(1, 200)}', plz, ort))
+        for typ in rng.sample(['Mobil', 'Privat', 'Geschäftlich'], rng.randint(1, 2)):
+            phones.append((n, typ, f'+41 7{rng.randint(6, 9)} {rng.randint(100, 999)} '
+                                   f'{rng.randint(10, 99)} {rng.randint(10, 99)}'))
+    _insert(conn, "INSERT INTO Investor (InvestorID, Nachname, Vorname, EMail, Strasse, PLZ, Ort) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?)", investors)
+    _insert(conn, "INSERT INTO Telefonnummer (InvestorID, Typ, Nummer) VALUES (?, ?, ?)", phones)
+
+    depots = [(n, rng.randint(1, sizes['investoren']), rng.choice(DEPOT_NAMEN),
+               rng.choice(DEPOT_STATUS)) for n in range(1, sizes['depots'] + 1)]
+    _insert(conn, "INSERT INTO Depot (DepotID, InvestorID, Bezeichnung, Status) VALUES (?, ?, ?, ?)",
+            depots)
+    say(f'{len(investors)} Investoren, {len(depots)} Depots')
+
+    # Transaktionen in date order; sales never exceed the current holding
+    holdings = {}
+    transactions = []
+    day_indexes = sorted(rng.randrange(len(days)) for _ in range(sizes['transaktionen']))
+    for day_index in day_indexes:
+        depot_id = rng.randint(1, sizes['depots'])
+        held = holdings.setdefault(depot_id, {})
+        if held and rng.random() < 0.35:
+            isin = rng.choice(list(held))
+            typ = 'Verkauf'
+            menge = rng.randint(1, held[isin])
+            held[isin] -= menge
+            if held[isin] == 0:
+                del held[isin]
+        else:
+            isin = rng.choice(stocks)[0]
+            typ = 'Kauf'
+            menge = rng.randint(1, 200)
+            held[isin] = held.get(isin, 0) + menge
+        price = round(closes[isin][day_index] * rng.uniform(0.99, 1.01), 2)
+        timestamp = datetime.combine(days[day_index], datetime.min.time()) + timedelta(
+            seconds=rng.randint(9 * 3600, 17 * 3600))
+        transactions.append((depot_id, isin, timestamp.strftime('%Y-%m-%d %H:%M:%S'), typ, menge,
+                             price, round(menge * price, 2)))
+    _insert(conn, "INSERT INTO Transaktionen (DepotID, ISIN, Datum, Typ, Menge, Stueckpreis, "
+                  "Gesamtwert) VALUES (?, ?, ?, ?, ?, ?, ?)", transactions)
+    say(f'{len(transactions)} Transaktionen')
+    del transactions
+
+    # HistorischerDepotwert as a random walk per depot
+    value_days = trading_days(sizes['bewertungstage'])
+    history = []
+    for depot_id, *_ in depots:
+        value = rng.uniform(5000, 500000)
+        for day in value_days:
+            new_value = max(0.0, value * (1 + rng.gauss(0.0003, 0.012)))
+            history.append((day.isoformat(), depot_id, round(new_value, 2), round(new_value - value, 2)))
+            value = new_value
+    _insert(conn, "INSERT INTO HistorischerDepotwert (Datum, DepotID, Gesamtwert, DailyPnL) "
+                  "VALUES (?, ?, ?, ?)", history)
+    say(f'{len(history)} Depotbewertungen')
+
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def build_database(path, sizes, seed=42, log=None):
+    """Create a new database file at path with schema, migrations and generated data."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA foreign_keys = ON")
+        create_schema(conn)
+        generate(conn, sizes, seed=seed, log=log)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a large synthetic Aktienportfolio database.')
+    parser.add_argument('--output', required=True, help='Path of the database file to create')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for all row counts')
+    parser.add_argument('--seed', type=int, default=42)
+    for name in BASE_SIZES:
+        parser.add_argument(f'--{name}', type=int, help=f'Number of rows (default {BASE_SIZES[name]} x scale)')
+    for name in BASE_DAYS:
+        parser.add_argument(f'--{name}', type=int, help=f'Trading days of history (default {BASE_DAYS[name]})')
+    args = parser.parse_args()
+
+    sizes = sizes_for(args.scale, **{name: getattr(args, name) for name in {**BASE_SIZES, **BASE_DAYS}})
+    started = time.perf_counter()
+    build_database(args.output, sizes, seed=args.seed, log=print)
+    print(f'Fertig in {time.perf_counter() - started:.1f}s: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
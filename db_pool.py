@@ -0,0 +1,208 @@
+import queue
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,       # negative = KiB, i.e. ~64 MB page cache
+    'mmap_size': 268435456,     # 256 MB
+    'temp_store': 'MEMORY',
+}
+
+# Prepared statements kept per connection (keyed by SQL text); parameterized
+# queries bind their values, so each distinct text is compiled only once
+STATEMENT_CACHE_SIZE = 256
+
+
+class PooledConnection:
+    """Thin wrapper around a sqlite3 connection that returns to its pool on close()."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def raw(self):
+        """The underlying sqlite3.Connection."""
+        return self._conn
+
+    def close(self):
+        """Hand the connection back to the pool instead of closing it."""
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    Connections are opened lazily, configured once with the given pragmas
+    and then reused for later requests, so the page cache survives between
+    requests. A thread that already holds a connection gets the same one
+    back when it asks again (nested calls do not use up extra slots).
+    A connection may be released by another thread than the one that
+    acquired it (e.g. a streamed response closed by the server); the
+    owning thread's slot is cleared either way.
+    """
+
+    def __init__(self, database, max_connections=8, readonly=False,
+                 pragmas=None, timeout=30.0, name=None, cached_statements=STATEMENT_CACHE_SIZE):
+        self.database = database
+        self.max_connections = max_connections
+        self.readonly = readonly
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.name = name or ('read' if readonly else 'write')
+        self.on_connect = []
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._held = {}             # thread ident -> (conn, depth)
+        self._owners = {}           # id(conn) -> thread ident holding it
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.open_connections = 0
+        self.in_use = 0
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True,
+                                   check_same_thread=False, timeout=self.timeout,
+                                   cached_statements=self.cached_statements)
+        else:
+            conn = sqlite3.connect(self.database, check_same_thread=False,
+                                   timeout=self.timeout, cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        for pragma, value in self.pragmas.items():
+            # journal_mode is a property of the file and can only be changed
+            # by a writer; read-only connections simply pick it up.
+            if self.readonly and pragma == 'journal_mode':
+                continue
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        for hook in self.on_connect:
+            hook(conn)
+        return conn
+
+    def acquire(self):
+        """Return a PooledConnection, waiting for a free slot if the pool is exhausted."""
+        if self._closed:
+            raise RuntimeError(f'Connection pool "{self.name}" is closed')
+
+        owner = threading.get_ident()
+        with self._lock:
+            held = self._held.get(owner)
+            if held is not None:
+                conn, depth = held
+                self._held[owner] = (conn, depth + 1)
+                self.hits += 1
+                return PooledConnection(self, conn)
+
+        if not self._slots.acquire(blocking=False):
+            started = time.monotonic()
+            if not self._slots.acquire(timeout=self.timeout):
+                raise TimeoutError(f'No free connection in pool "{self.name}"')
+            with self._lock:
+                self.waits += 1
+                self.wait_time += time.monotonic() - started
+
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+            with self._lock:
+                self.misses += 1
+                self.open_connections += 1
+
+        with self._lock:
+            self.in_use += 1
+            self._held[owner] = (conn, 1)
+            self._owners[id(conn)] = owner
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Return a connection to the pool (called by PooledConnection.close)."""
+        with self._lock:
+            owner = self._owners.get(id(conn))
+            held = self._held.get(owner)
+            if held is not None and held[0] is conn and held[1] > 1:
+                self._held[owner] = (conn, held[1] - 1)
+                return
+            self._held.pop(owner, None)
+            self._owners.pop(id(conn), None)
+
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self.in_use -= 1
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def _discard(self, conn):
+        conn.close()
+        with self._lock:
+            self.open_connections -= 1
+
+    def close(self):
+        """Close all idle connections; connections still in use are closed on release."""
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def reset(self):
+        """Close every idle connection and reopen the pool, e.g. after the file was replaced."""
+        self.close()
+        self._closed = False
+
+    def stats(self):
+        """Return a snapshot of the pool metrics."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'name': self.name,
+                'readonly': self.readonly,
+                'max_connections': self.max_connections,
+                'open_connections': self.open_connections,
+                'in_use': self.in_use,
+                'idle': self.open_connections - self.in_use,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+                'waits': self.waits,
+                'wait_time_ms': round(self.wait_time * 1000, 2),
+                'pragmas': self.pragmas,
+            }
+
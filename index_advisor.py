@@ -0,0 +1,236 @@
+import os
+import re
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from migrations import migration_indexes
+
+
+_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?')
+_AUTOMATIC = re.compile(r'^SEARCH (?:TABLE )?(\w+)(?: AS \w+)? USING AUTOMATIC (?:COVERING |PARTIAL )*INDEX \(([^)]*)\)')
+_TEMP_BTREE = re.compile(r'^USE TEMP B-TREE FOR (.+)$')
+
+
+def explain(conn, sql, params=()):
+    """Return EXPLAIN QUERY PLAN rows as (id, parent, detail)."""
+    return [(row[0], row[1], row[3]) for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def columns_read_by(conn, sql, params=()):
+    """Return {table: [columns]} read by a statement, in first-use order."""
+    columns = {}
+
+    def authorizer(action, table, column, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and table and column and not table.startswith('sqlite_'):
+            cols = columns.setdefault(table, [])
+            if column not in cols:
+                cols.append(column)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        conn.execute('EXPLAIN ' + sql, params).fetchall()
+    finally:
+        conn.set_authorizer(None)
+    return columns
+
+
+def _aliases(sql):
+    """Map table aliases used in the SQL text to table names."""
+    aliases = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.I):
+        aliases[table] = table
+        if alias and alias.upper() not in ('ON', 'WHERE', 'JOIN', 'LEFT', 'INNER', 'GROUP',
+                                           'ORDER', 'CROSS', 'USING'):
+            aliases[alias] = table
+    return aliases
+
+
+def analyze_query(conn, sql, params=()):
+    """
+    Inspect the query plan and return a list of findings.
+
+    Each finding is a dict with 'kind' ('full_scan', 'nested_scan',
+    'automatic_index' or 'temp_btree'), 'table' (if any) and 'detail'.
+    A 'nested_scan' is a full scan that runs once per outer row (inner
+    loop of a join or inside a correlated subquery), which is where an
+    index pays off most.
+    """
+    plan = explain(conn, sql, params)
+    aliases = _aliases(sql)
+    parents = {node_id: parent for node_id, parent, _ in plan}
+    details = {node_id: detail for node_id, _, detail in plan}
+    seen_loop = set()
+    findings = []
+
+    for node_id, parent, detail in plan:
+        in_subquery = any(details.get(p, '').startswith('CORRELATED')
+                          for p in _ancestors(node_id, parents))
+        is_loop = detail.startswith(('SCAN', 'SEARCH'))
+        outer = is_loop and parent not in seen_loop
+        if is_loop:
+            seen_loop.add(parent)
+
+        match = _AUTOMATIC.match(detail)
+        if match:
+            columns = [c.split('=')[0].strip() for c in match.group(2).split(' AND ')]
+            findings.append({'kind': 'automatic_index', 'table': aliases.get(match.group(1), match.group(1)),
+                             'columns': columns, 'detail': detail})
+            continue
+        match = _SCAN.match(detail)
+        if match:
+            table = aliases.get(match.group(1), match.group(1))
+            # A scan through an index that is not the automatic one is an ordered
+            # walk chosen by the planner, only flag it inside correlated subqueries.
+            if match.group(2) and not in_subquery:
+                continue
+            kind = 'nested_scan' if (in_subquery or not outer) else 'full_scan'
+            findings.append({'kind': kind, 'table': table, 'alias': match.group(1),
+                             'detail': detail})
+            continue
+        match = _TEMP_BTREE.match(detail)
+        if match:
+            findings.append({'kind': 'temp_btree', 'table': None, 'detail': detail})
+    return findings
+
+
+def _ancestors(node_id, parents):
+    parent = parents.get(node_id)
+    while parent:
+        yield parent
+        parent = parents.get(parent)
+
+
+def propose_indexes(conn, sql, findings=None, params=()):
+    """
+    Propose CREATE INDEX statements for the problems found in a query plan.
+
+    Automatic indexes are turned into permanent ones on the same columns.
+    Nested scans get a composite index on the columns the query reads from
+    that table: columns compared with = first, then dates, then the rest,
+    so that the index also covers the query where possible.
+    """
+    if findings is None:
+        findings = analyze_query(conn, sql, params)
+    read = columns_read_by(conn, sql, params)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    proposals = []
+    for finding in findings:
+        table = finding.get('table')
+        if table not in tables:  # CTEs, subqueries and views cannot be indexed
+            continue
+        if finding['kind'] == 'automatic_index':
+            extra = [c for c in read.get(table, []) if c not in finding['columns']]
+            columns = finding['columns'] + extra[:3]
+        elif finding['kind'] == 'nested_scan':
+            rowid = _rowid_column(conn, table)
+            cols = [c for c in read.get(table, []) if c != rowid]
+            equality = [c for c in cols if _compared_for_equality(sql, finding['alias'], c)]
+            columns = (equality
+                       + [c for c in cols if c == 'Datum' and c not in equality]
+                       + [c for c in cols if c != 'Datum' and c not in equality])[:5]
+        else:
+            continue
+        if not columns or _covered(conn, table, columns):
+            continue
+        name = 'idx_' + table.lower() + '_' + '_'.join(c.lower() for c in columns[:3])
+        statement = f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(columns)});"
+        if statement not in proposals:
+            proposals.append(statement)
+    return proposals
+
+
+def _rowid_column(conn, table):
+    """Name of the INTEGER PRIMARY KEY column (an alias for the rowid), if any."""
+    pk = [row for row in conn.execute(f"PRAGMA table_info({table})").fetchall() if row[5]]
+    if len(pk) == 1 and pk[0][2].upper() == 'INTEGER':
+        return pk[0][1]
+    return None
+
+
+def _compared_for_equality(sql, alias, column):
+    """True if the SQL compares alias.column (or the bare column) with '='."""
+    qualified = rf'\b{alias}\.{column}\b'
+    bare = rf'(?<![.\w]){column}\b'
+    return any(re.search(pattern, sql) for pattern in (
+        qualified + r'\s*=', r'=\s*' + qualified, bare + r'\s*=\s*\w+\.\w+'))
+
+
+def _covered(conn, table, columns):
+    """True if an existing index already leads with the proposed key column(s)."""
+    prefix = columns[:2]
+    for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        indexed = [row[2] for row in conn.execute(f"PRAGMA index_info({index[1]})").fetchall()]
+        if indexed[:len(prefix)] == prefix:
+            return True
+    return False
+
+
+def _statements(queries):
+    """Normalize {query_id: sql or (sql, params)} to {query_id: (sql, params)}."""
+    return {qid: (query, ()) if isinstance(query, str) else query
+            for qid, query in queries.items()}
+
+
+def advise(conn, queries):
+    """Run the advisor over {query_id: sql or (sql, params)}.
+
+    Returns {query_id: {findings, proposals}}.
+    """
+    report = {}
+    for query_id, (sql, params) in _statements(queries).items():
+        findings = analyze_query(conn, sql, params)
+        report[query_id] = {
+            'findings': findings,
+            'proposals': propose_indexes(conn, sql, findings, params),
+        }
+    return report
+
+
+def time_query(conn, sql, repeat=5, params=()):
+    """Median wall time of a query in milliseconds (all rows fetched)."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def benchmark_migrations(database, queries, repeat=5):
+    """
+    Time every query without and with the migration indexes.
+
+    Works on a copy of the database made with the backup API, so the
+    original file is never modified. The indexes are dropped on the copy
+    for the first run and recreated for the second.
+    queries maps query ids to SQL text or to (sql, params).
+    Returns {query_id: (before_ms, after_ms)}.
+    """
+    queries = _statements(queries)
+    source = sqlite3.connect(database)
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    copy = sqlite3.connect(path)
+    try:
+        source.backup(copy)
+        source.close()
+        indexes = migration_indexes()
+        for name, _ in indexes:
+            copy.execute(f"DROP INDEX IF EXISTS {name}")
+        copy.execute("ANALYZE")
+        copy.commit()
+        before = {qid: time_query(copy, sql, repeat, params)
+                  for qid, (sql, params) in queries.items()}
+        for _, statement in indexes:
+            copy.execute(statement)
+        copy.execute("ANALYZE")
+        copy.commit()
+        after = {qid: time_query(copy, sql, repeat, params)
+                 for qid, (sql, params) in queries.items()}
+    finally:
+        copy.close()
+        os.remove(path)
+    return {qid: (before[qid], after[qid]) for qid in queries}
@@ -0,0 +1,292 @@
+import csv
+import json
+import time
+from datetime import date, datetime
+from operator import itemgetter
+
+
+BATCH_SIZE = 50000
+MAX_REPORTED_ERRORS = 100
+
+CONFLICT_VERBS = {
+    'abort': 'INSERT',
+    'ignore': 'INSERT OR IGNORE',
+    'replace': 'INSERT OR REPLACE',
+}
+
+
+class IngestError(Exception):
+    """Raised when a strict load hits an invalid record; nothing is written."""
+
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)
+
+
+def iter_csv(stream, columns):
+    """
+    Yield the values of one CSV row at a time, in the order of `columns`.
+
+    The header row names the columns; missing columns yield None, rows
+    with too few fields are yielded as None (invalid record).
+    """
+    reader = csv.reader(stream)
+    header = [name.strip() for name in next(reader, [])]
+    positions = [header.index(name) if name in header else None for name in columns]
+    if None not in positions:
+        pick = itemgetter(*positions)
+    else:
+        def pick(row):
+            return [row[i] if i is not None else None for i in positions]
+    for row in reader:
+        if not row:
+            continue
+        try:
+            yield pick(row)
+        except IndexError:
+            yield None
+
+
+def iter_ndjson(stream, columns):
+    """Yield the values of one JSON object per line, in the order of `columns`.
+
+    Lines that are not JSON objects are yielded as None.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield [record.get(name) for name in columns] if isinstance(record, dict) else None
+
+
+PARSERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+}
+
+
+def _field(name, value):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise ValueError(f'Feld {name} fehlt')
+    return value.strip() if isinstance(value, str) else value
+
+
+def _number(name, value, kind=float, minimum=None):
+    value = _field(name, value)
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name}: ungültiger Wert {value!r}')
+    if minimum is not None and number < minimum:
+        raise ValueError(f'{name} muss mindestens {minimum} sein')
+    return number
+
+
+def _known(name, value, keys, kind=str):
+    raw = _field(name, value)
+    try:
+        value = kind(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name}: ungültiger Wert {raw!r}')
+    if value not in keys:
+        raise ValueError(f'Unbekannter Wert für {name}: {value}')
+    return value
+
+
+def _timestamp(value):
+    raw = str(_field('Datum', value))
+    try:
+        return datetime.fromisoformat(raw).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        raise ValueError(f'Datum: ungültiger Zeitstempel {raw!r}')
+
+
+def _day(value):
+    raw = str(_field('Datum', value))
+    try:
+        return date.fromisoformat(raw[:10]).isoformat()
+    except ValueError:
+        raise ValueError(f'Datum: ungültiges Datum {raw!r}')
+
+
+def convert_transaktion(values, keys):
+    depot_id, isin, datum, typ, menge, preis, gesamtwert = values
+    depot_id = _known('DepotID', depot_id, keys['DepotID'], int)
+    isin = _known('ISIN', isin, keys['ISIN'])
+    datum = _timestamp(datum)
+    typ = _field('Typ', typ)
+    if typ not in ('Kauf', 'Verkauf'):
+        raise ValueError(f'Typ muss Kauf oder Verkauf sein, nicht {typ!r}')
+    menge = _number('Menge', menge, int, 1)
+    preis = _number('Stueckpreis', preis, float, 0)
+    if gesamtwert is None or gesamtwert == '':
+        gesamtwert = round(menge * preis, 2)
+    else:
+        gesamtwert = _number('Gesamtwert', gesamtwert, float, 0)
+    return depot_id, isin, datum, typ, menge, preis, gesamtwert
+
+
+def convert_kurs(values, keys):
+    datum, isin, oeffnung, tief, hoch, schluss, volumen = values
+    # Fast path for well-formed rows; anything unusual goes through the
+    # field-by-field checks below, which also produce the error message.
+    try:
+        row = (datum, isin, float(oeffnung), float(tief), float(hoch), float(schluss), int(volumen))
+        if (isin in keys['ISIN'] and len(datum) == 10 and date.fromisoformat(datum)
+                and 0 <= row[3] <= row[4] and row[2] >= 0 and row[5] >= 0 and row[6] >= 0):
+            return row
+    except (TypeError, ValueError):
+        pass
+    datum = _day(datum)
+    isin = _known('ISIN', isin, keys['ISIN'])
+    oeffnung = _number('Oeffnungskurs', oeffnung, float, 0)
+    tief = _number('Tiefstkurs', tief, float, 0)
+    hoch = _number('Hoechstkurs', hoch, float, 0)
+    schluss = _number('Endkurs', schluss, float, 0)
+    if tief > hoch:
+        raise ValueError('Tiefstkurs liegt über dem Hoechstkurs')
+    volumen = _number('Volumen', volumen, int, 0)
+    return datum, isin, oeffnung, tief, hoch, schluss, volumen
+
+
+# Tables that can be bulk loaded: target columns (in input order), converter
+# and the foreign keys the converter checks against in-memory key sets.
+TABLES = {
+    'transaktionen': {
+        'table': 'Transaktionen',
+        'columns': ('DepotID', 'ISIN', 'Datum', 'Typ', 'Menge', 'Stueckpreis', 'Gesamtwert'),
+        'convert': convert_transaktion,
+        'references': ('DepotID', 'ISIN'),
+    },
+    'kursverlauf': {
+        'table': 'Kursverlauf',
+        'columns': ('Datum', 'ISIN', 'Oeffnungskurs', 'Tiefstkurs', 'Hoechstkurs', 'Endkurs', 'Volumen'),
+        'convert': convert_kurs,
+        'references': ('ISIN',),
+    },
+}
+
+REFERENCE_SQL = {
+    'ISIN': "SELECT ISIN FROM Aktie",
+    'DepotID': "SELECT DepotID FROM Depot",
+}
+
+
+def reference_keys(conn, names):
+    """Load the primary keys referenced by a table into sets."""
+    return {name: {row[0] for row in conn.execute(REFERENCE_SQL[name])} for name in names}
+
+
+def _defer(conn, table):
+    """
+    Drop the secondary indexes, change-counter and change-log triggers of a table.
+
+    Returns the CREATE statements to run after the load. Primary keys and
+    UNIQUE constraints stay, as do the Position triggers on Transaktionen.
+    """
+    objects = conn.execute("""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name = ? AND sql IS NOT NULL
+          AND (type = 'index' OR (type = 'trigger' AND (name LIKE 'trg\\_version\\_%' ESCAPE '\\'
+                                                        OR name LIKE 'trg\\_kursaenderung\\_%' ESCAPE '\\')))
+    """, (table,)).fetchall()
+    for kind, name, _ in objects:
+        conn.execute(f"DROP {kind.upper()} {name}")
+    return [sql for _, _, sql in objects]
+
+
+def _invalidate_change_log(conn):
+    """
+    Replace the Kursaenderung entries by one marker after a deferred load.
+
+    The load wrote no entries, so every Kursverlauf store built before it
+    has to be rebuilt. The marker leaves a gap after the last Seq, which
+    price_store.PriceStore treats as a log that no longer reaches back to
+    the store.
+    """
+    conn.execute("INSERT INTO Kursaenderung (Seq, ISIN, Datum) "
+                 "SELECT COALESCE(MAX(Seq), 0) + 2, '', '' FROM Kursaenderung")
+    conn.execute("DELETE FROM Kursaenderung WHERE Seq < last_insert_rowid()")
+
+
+def ingest(conn, kind, stream, fmt='csv', strict=False, defer=False, on_conflict='abort',
+           batch_size=BATCH_SIZE):
+    """
+    Stream-parse CSV or NDJSON text and insert the records into a table.
+
+    Foreign keys are checked against in-memory key sets, so SQLite's own
+    foreign key checks are switched off for the load. Rows are written with
+    executemany in batches of batch_size inside one transaction. With
+    defer=True, secondary indexes, change-counter and change-log triggers
+    are dropped for the load and recreated at the end (one index build
+    instead of one B-tree insert per row), the table version is bumped
+    once and the Kursaenderung log is reset to a rebuild marker.
+
+    Invalid records are skipped and reported; with strict=True the first
+    one aborts the load and nothing is written.
+    """
+    spec = TABLES[kind]
+    if on_conflict not in CONFLICT_VERBS:
+        raise ValueError(f'on_conflict muss eines von {", ".join(CONFLICT_VERBS)} sein')
+    started = time.perf_counter()
+    keys = reference_keys(conn, spec['references'])
+    convert = spec['convert']
+    columns = spec['columns']
+    records = PARSERS[fmt](stream, columns)
+    sql = (f"{CONFLICT_VERBS[on_conflict]} INTO {spec['table']} ({', '.join(columns)}) "
+           f"VALUES ({', '.join('?' * len(columns))})")
+
+    inserted = skipped = 0
+    errors = []
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        deferred = _defer(conn, spec['table']) if defer else []
+        batch = []
+        for number, record in enumerate(records, 1):
+            try:
+                if record is None:
+                    raise ValueError('Kein gültiger Datensatz')
+                batch.append(convert(record, keys))
+            except (ValueError, TypeError) as e:
+                skipped += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'record': number, 'error': str(e)})
+                if strict:
+                    raise IngestError(f'Datensatz {number}: {e}', errors)
+                continue
+            if len(batch) >= batch_size:
+                inserted += conn.executemany(sql, batch).rowcount
+                batch = []
+        if batch:
+            inserted += conn.executemany(sql, batch).rowcount
+
+        for statement in deferred:
+            conn.execute(statement)
+        if deferred and inserted:
+            conn.execute("UPDATE Tabellenversion SET Version = Version + 1, "
+                         "GeaendertAm = CURRENT_TIMESTAMP WHERE Tabelle = ?", (spec['table'],))
+            if any('trg_kursaenderung_' in statement for statement in deferred):
+                _invalidate_change_log(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}")
+
+    elapsed = time.perf_counter() - started
+    return {
+        'table': spec['table'],
+        'inserted': inserted,
+        'skipped': skipped,
+        'errors': errors,
+        'deferred_objects': len(deferred),
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'rows_per_second': round(inserted / elapsed) if elapsed else None,
+    }
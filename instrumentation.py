@@ -0,0 +1,290 @@
+import cProfile
+import io
+import logging
+import pstats
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+# Progress handlers are called every PROGRESS_STEPS SQLite VM instructions,
+# so VM step counts are accurate to this granularity.
+PROGRESS_STEPS = 1000
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PHASES = ('execute', 'fetch', 'serialize')
+
+slow_query_logger = logging.getLogger('aktienportfolio.slow_query')
+
+
+class QueryTimer:
+    """
+    Timing of one query run: execute, fetch and serialize phases, rows
+    returned and SQLite VM steps.
+
+    attach() installs a progress handler on the connection that counts VM
+    steps; an optional abort callable (e.g. a deadline) is checked from the
+    same handler, because SQLite allows only one per connection.
+    """
+
+    def __init__(self, kind, name, sql=None, params=()):
+        self.kind = kind
+        self.name = name
+        self.sql = sql
+        self.params = params
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.rows = 0
+        self.vm_steps = 0
+        self.error = None
+        self._abort = None
+        self._last = time.perf_counter()
+
+    def _progress(self):
+        self.vm_steps += PROGRESS_STEPS
+        return 1 if self._abort is not None and self._abort() else 0
+
+    def attach(self, conn, abort=None):
+        self._abort = abort
+        conn.set_progress_handler(self._progress, PROGRESS_STEPS)
+
+    def detach(self, conn):
+        conn.set_progress_handler(None, 0)
+        self._abort = None
+
+    def restart(self):
+        """Start timing the next phase from now."""
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        """Book the time since the last mark to a phase."""
+        now = time.perf_counter()
+        self.phases[phase] += now - self._last
+        self._last = now
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def samples(self):
+        """Cumulative (le, count) pairs as Prometheus expects them."""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{bound:g}', cumulative
+        yield '+Inf', self.count
+
+
+class _QueryStats:
+    def __init__(self, buckets):
+        self.executions = 0
+        self.errors = 0
+        self.rows = 0
+        self.vm_steps = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.latency = _Histogram(buckets)
+
+
+class Metrics:
+    """
+    In-process metrics registry for queries and HTTP endpoints.
+
+    Queries slower than slow_query_ms go to a bounded slow-query log together
+    with their EXPLAIN QUERY PLAN (obtained through the `explain` callable,
+    which receives the SQL text). Everything can be rendered in the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self, slow_query_ms=500, slow_log_size=100, explain=None,
+                 buckets=LATENCY_BUCKETS, prefix='aktienportfolio'):
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+        self.buckets = buckets
+        self.prefix = prefix
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self.slow_query_count = 0
+        self._queries = {}
+        self._requests = {}
+        self._request_latency = {}
+        self._lock = threading.Lock()
+
+    def record_query(self, timer):
+        key = (timer.kind, timer.name)
+        total = timer.total
+        with self._lock:
+            stats = self._queries.get(key)
+            if stats is None:
+                stats = self._queries[key] = _QueryStats(self.buckets)
+            stats.executions += 1
+            stats.errors += timer.error is not None
+            stats.rows += timer.rows
+            stats.vm_steps += timer.vm_steps
+            for phase, seconds in timer.phases.items():
+                stats.phases[phase] += seconds
+            stats.latency.observe(total)
+        if self.slow_query_ms is not None and total * 1000 >= self.slow_query_ms:
+            self._log_slow_query(timer)
+
+    def _log_slow_query(self, timer):
+        plan = None
+        if self.explain is not None and timer.sql:
+            try:
+                plan = self.explain(timer.sql, timer.params)
+            except Exception as e:
+                plan = [f'EXPLAIN fehlgeschlagen: {e}']
+        entry = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'kind': timer.kind,
+            'query': timer.name,
+            'sql': timer.sql,
+            'total_ms': round(timer.total * 1000, 2),
+            'phases_ms': {phase: round(s * 1000, 2) for phase, s in timer.phases.items()},
+            'rows': timer.rows,
+            'vm_steps': timer.vm_steps,
+            'error': timer.error,
+            'plan': plan,
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+            self.slow_query_count += 1
+        slow_query_logger.warning('Langsame Abfrage %s/%s: %.1f ms, %d Zeilen, %d VM-Schritte',
+                                  timer.kind, timer.name, entry['total_ms'], timer.rows, timer.vm_steps)
+
+    def record_request(self, endpoint, method, status, seconds):
+        endpoint = endpoint or 'unknown'
+        with self._lock:
+            key = (endpoint, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._request_latency.get(endpoint)
+            if histogram is None:
+                histogram = self._request_latency[endpoint] = _Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """Per-query metrics as plain dicts (for JSON endpoints)."""
+        with self._lock:
+            return [{
+                'kind': kind,
+                'query': name,
+                'executions': s.executions,
+                'errors': s.errors,
+                'rows': s.rows,
+                'vm_steps': s.vm_steps,
+                'phases_ms': {phase: round(v * 1000, 2) for phase, v in s.phases.items()},
+                'mean_ms': round(s.latency.sum / s.executions * 1000, 2) if s.executions else None,
+            } for (kind, name), s in sorted(self._queries.items())]
+
+    def prometheus(self):
+        """Render all metrics in the Prometheus text format."""
+        p = self.prefix
+        lines = []
+        with self._lock:
+            queries = sorted(self._queries.items())
+            lines += _header(f'{p}_query_executions_total', 'Executed queries', 'counter')
+            lines += [_sample(f'{p}_query_executions_total', s.executions, kind=k, query=n)
+                      for (k, n), s in queries]
+            lines += _header(f'{p}_query_errors_total', 'Failed queries', 'counter')
+            lines += [_sample(f'{p}_query_errors_total', s.errors, kind=k, query=n)
+                      for (k, n), s in queries]
+            lines += _header(f'{p}_query_rows_total', 'Rows returned by queries', 'counter')
+            lines += [_sample(f'{p}_query_rows_total', s.rows, kind=k, query=n)
+                      for (k, n), s in queries]
+            lines += _header(f'{p}_query_vm_steps_total',
+                             f'SQLite VM steps (counted in units of {PROGRESS_STEPS})', 'counter')
+            lines += [_sample(f'{p}_query_vm_steps_total', s.vm_steps, kind=k, query=n)
+                      for (k, n), s in queries]
+            lines += _header(f'{p}_query_phase_seconds_total',
+                             'Time spent per query phase (execute, fetch, serialize)', 'counter')
+            lines += [_sample(f'{p}_query_phase_seconds_total', seconds, kind=k, query=n, phase=phase)
+                      for (k, n), s in queries for phase, seconds in s.phases.items()]
+            lines += _header(f'{p}_query_duration_seconds', 'Query latency', 'histogram')
+            for (k, n), s in queries:
+                lines += _histogram(f'{p}_query_duration_seconds', s.latency, kind=k, query=n)
+
+            lines += _header(f'{p}_slow_queries_total',
+                             'Queries slower than the slow-query threshold', 'counter')
+            lines.append(_sample(f'{p}_slow_queries_total', self.slow_query_count))
+
+            lines += _header(f'{p}_http_requests_total', 'HTTP requests', 'counter')
+            lines += [_sample(f'{p}_http_requests_total', count, endpoint=e, method=m, status=st)
+                      for (e, m, st), count in sorted(self._requests.items())]
+            lines += _header(f'{p}_http_request_duration_seconds', 'HTTP request latency', 'histogram')
+            for endpoint, histogram in sorted(self._request_latency.items()):
+                lines += _histogram(f'{p}_http_request_duration_seconds', histogram, endpoint=endpoint)
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _header(name, help_text, metric_type):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+
+
+def _sample(name, value, **labels):
+    value = repr(round(value, 6)) if isinstance(value, float) else value
+    if not labels:
+        return f'{name} {value}'
+    label_text = ','.join(f'{key}="{_escape(v)}"' for key, v in labels.items())
+    return f'{name}{{{label_text}}} {value}'
+
+
+def _histogram(name, histogram, **labels):
+    lines = [_sample(f'{name}_bucket', count, **labels, le=le) for le, count in histogram.samples()]
+    lines.append(_sample(f'{name}_sum', histogram.sum, **labels))
+    lines.append(_sample(f'{name}_count', histogram.count, **labels))
+    return lines
+
+
+def gauge_lines(name, help_text, samples):
+    """Prometheus lines for a gauge; samples is a list of (labels dict, value)."""
+    return _header(name, help_text, 'gauge') + [_sample(name, value, **labels)
+                                                for labels, value in samples]
+
+
+class RequestProfiler:
+    """
+    Opt-in cProfile run for a single request.
+
+    Only one request is profiled at a time; start() returns None while
+    another profile is running.
+    """
+
+    def __init__(self, limit=40, sort='cumulative'):
+        self.limit = limit
+        self.sort = sort
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler):
+        """Stop a profile and return the report as text."""
+        profiler.disable()
+        self._lock.release()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats(self.sort).print_stats(self.limit)
+        return out.getvalue()
@@ -0,0 +1,395 @@
+import queue
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+
+from query_cache import table_versions
+
+
+MAX_TICKS = 10000
+
+# Tables the holders index is built from; a change forces a rebuild. Price
+# changes (Aktie) by other writers or workers are applied incrementally instead.
+INDEX_TABLES = ('Position', 'Depot', 'Investor', 'Unternehmen')
+PRICE_TABLE = 'Aktie'
+
+# Backdated ticks only extend their daily bar: the current price follows the
+# newest bar of the ISIN (which, after the upsert, includes the tick's own day)
+UPDATE_PRICE_SQL = """
+    UPDATE Aktie SET AktuellerKurs = :kurs
+    WHERE ISIN = :isin AND AktuellerKurs <> :kurs
+      AND :datum >= (SELECT MAX(Datum) FROM Kursverlauf WHERE ISIN = :isin)
+"""
+
+# The first tick of a day opens the daily bar, later ones extend it
+UPSERT_BAR_SQL = """
+    INSERT INTO Kursverlauf (Datum, ISIN, Oeffnungskurs, Tiefstkurs, Hoechstkurs, Endkurs, Volumen)
+    VALUES (:datum, :isin, :kurs, :kurs, :kurs, :kurs, :volumen)
+    ON CONFLICT (Datum, ISIN) DO UPDATE SET
+        Tiefstkurs = MIN(Tiefstkurs, excluded.Endkurs),
+        Hoechstkurs = MAX(Hoechstkurs, excluded.Endkurs),
+        Endkurs = excluded.Endkurs,
+        Volumen = Volumen + excluded.Volumen
+"""
+
+HOLDINGS_SQL = """
+    SELECT p.ISIN, p.DepotID, p.Menge
+    FROM Position p
+    JOIN Depot d ON p.DepotID = d.DepotID
+    WHERE d.Status = 'Aktiv' AND p.Menge <> 0
+"""
+
+DEPOTS_SQL = """
+    SELECT d.DepotID, d.InvestorID, d.Bezeichnung, i.Vorname || ' ' || i.Nachname
+    FROM Depot d
+    JOIN Investor i ON d.InvestorID = i.InvestorID
+    WHERE d.Status = 'Aktiv'
+"""
+
+PRICE_VERSION_SQL = "SELECT Version FROM Tabellenversion WHERE Tabelle = 'Aktie'"
+
+STOCKS_SQL = """
+    SELECT a.ISIN, a.AktuellerKurs, u.Branche
+    FROM Aktie a
+    JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
+"""
+
+
+def parse_ticks(data, known_isins):
+    """
+    Validate a tick batch: [{"isin", "kurs", "volumen"?, "datum"?}, ...].
+
+    Later ticks for the same ISIN win for the current price; every tick
+    extends the daily bar. Raises ValueError with the position of the
+    first invalid tick.
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError('ticks muss eine nicht-leere Liste sein')
+    if len(data) > MAX_TICKS:
+        raise ValueError(f'Höchstens {MAX_TICKS} Ticks pro Aufruf')
+    today = date.today().isoformat()
+    ticks = []
+    for number, tick in enumerate(data, 1):
+        try:
+            ticks.append(_tick(tick, known_isins, today))
+        except ValueError as e:
+            raise ValueError(f'Tick {number}: {e}')
+    return ticks
+
+
+def _tick(tick, known_isins, today):
+    if not isinstance(tick, dict):
+        raise ValueError('kein gültiges Objekt')
+    isin = str(tick.get('isin') or '').strip().upper()
+    if isin not in known_isins:
+        raise ValueError(f'unbekannte ISIN {isin or "-"}')
+    try:
+        kurs = float(tick.get('kurs'))
+        volumen = int(tick.get('volumen') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('kurs und volumen müssen Zahlen sein')
+    if not kurs > 0:
+        raise ValueError('kurs muss größer als 0 sein')
+    if volumen < 0:
+        raise ValueError('volumen darf nicht negativ sein')
+    try:
+        datum = date.fromisoformat(str(tick.get('datum') or today)[:10]).isoformat()
+    except ValueError:
+        raise ValueError(f'ungültiges Datum {tick.get("datum")!r}')
+    return {'isin': isin, 'kurs': round(kurs, 4), 'volumen': volumen, 'datum': datum}
+
+
+def apply_ticks(conn, ticks, index=None):
+    """
+    Write a validated tick batch (AktuellerKurs and daily Kursverlauf bars) in one transaction.
+
+    Returns ({isin: kurs} for the ISINs whose current price actually
+    changed, Aktie version after the write); ticks older than the newest
+    bar of their ISIN only update their bar. An index is synced inside the
+    write transaction, so it starts from the prices the ticks replace.
+    """
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if index is not None:
+            index.sync(conn)
+        conn.executemany(UPSERT_BAR_SQL, ticks)
+        latest = {}
+        for tick in ticks:
+            # The current price only moves forward in time
+            if tick['isin'] not in latest or tick['datum'] >= latest[tick['isin']]['datum']:
+                latest[tick['isin']] = tick
+        prices = {}
+        for isin, tick in latest.items():
+            if conn.execute(UPDATE_PRICE_SQL, tick).rowcount:
+                prices[isin] = tick['kurs']
+        version = conn.execute(PRICE_VERSION_SQL).fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return prices, version
+
+
+class HoldersIndex:
+    """
+    In-memory ISIN -> holders index for incremental revaluation.
+
+    Keeps the holdings of active depots per ISIN, the current prices and
+    the resulting value per depot and per investor and sector. A price
+    change only touches the depots holding that ISIN. Concentration
+    (largest sector / portfolio, as in the risk_concentration query) is
+    re-checked for the affected investors only.
+    The index is rebuilt when another writer changed the tables it was
+    built from (Tabellenversion); prices changed elsewhere (ingest, other
+    workers) are re-read and applied like ticks.
+    """
+
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self.holders = {}
+        self.prices = {}
+        self.sectors = {}
+        self.depots = {}
+        self.investors = {}
+        self.depot_values = {}
+        self.sector_values = {}
+        self.breaches = {}
+        self.versions = None
+        self.price_version = None
+        self.builds = 0
+        self.reprices = 0
+        self.revaluations = 0
+        self._lock = threading.Lock()
+
+    def sync(self, conn):
+        """Rebuild the index if its tables changed; pick up prices written by others."""
+        with self._lock:
+            current = table_versions(conn)
+            versions = tuple(current.get(table) for table in INDEX_TABLES)
+            price_version = current.get(PRICE_TABLE, (None,))[0]
+            if versions != self.versions:
+                self._build(conn)
+                self.versions = versions
+            elif price_version != self.price_version:
+                prices = {isin: kurs for isin, kurs, _ in conn.execute(STOCKS_SQL)
+                          if self.prices.get(isin) != kurs}
+                _, investors = self._apply(prices)
+                self._check_breaches(investors)
+                self.reprices += 1
+            self.price_version = price_version
+
+    def _build(self, conn):
+        self.prices = {}
+        self.sectors = {}
+        for isin, kurs, branche in conn.execute(STOCKS_SQL):
+            self.prices[isin] = kurs
+            self.sectors[isin] = branche
+        self.depots = {row[0]: {'InvestorID': row[1], 'Depot': row[2], 'Investor': row[3]}
+                       for row in conn.execute(DEPOTS_SQL)}
+        self.investors = {depot['InvestorID']: depot['Investor'] for depot in self.depots.values()}
+        self.holders = defaultdict(dict)
+        self.depot_values = defaultdict(float)
+        self.sector_values = defaultdict(lambda: defaultdict(float))
+        for isin, depot_id, menge in conn.execute(HOLDINGS_SQL):
+            self.holders[isin][depot_id] = menge
+            value = menge * self.prices[isin]
+            self.depot_values[depot_id] += value
+            self.sector_values[self.depots[depot_id]['InvestorID']][self.sectors[isin]] += value
+        self.breaches = {}
+        for investor_id in self.sector_values:
+            breach = self._concentration(investor_id)
+            if breach is not None:
+                self.breaches[investor_id] = breach
+        self.builds += 1
+
+    def _concentration(self, investor_id):
+        """(sector, share) if one sector exceeds the threshold, else None."""
+        values = {sector: value for sector, value in self.sector_values[investor_id].items() if value > 0}
+        total = sum(values.values())
+        if not total:
+            return None
+        sector = max(values, key=values.get)
+        share = values[sector] / total
+        return (sector, share) if share > self.threshold else None
+
+    def _apply(self, prices):
+        """Move the index to new prices; returns ({depot: change}, affected investors)."""
+        changed = {}
+        investors = set()
+        for isin, kurs in prices.items():
+            old = self.prices.get(isin)
+            if old is None or old == kurs:
+                continue
+            self.prices[isin] = kurs
+            sector = self.sectors[isin]
+            for depot_id, menge in self.holders.get(isin, {}).items():
+                delta = menge * (kurs - old)
+                self.depot_values[depot_id] += delta
+                changed[depot_id] = changed.get(depot_id, 0.0) + delta
+                investor_id = self.depots[depot_id]['InvestorID']
+                self.sector_values[investor_id][sector] += delta
+                investors.add(investor_id)
+        return changed, investors
+
+    def _check_breaches(self, investors):
+        """Re-check the concentration of investors; returns their risk events."""
+        events = []
+        for investor_id in sorted(investors):
+            breach = self._concentration(investor_id)
+            before = self.breaches.get(investor_id)
+            if breach is not None:
+                self.breaches[investor_id] = breach
+                events.append(self._risk_event(investor_id, breach, 'breach'))
+            else:
+                self.breaches.pop(investor_id, None)
+                if before is not None:
+                    events.append(self._risk_event(investor_id, (before[0], None), 'cleared'))
+        return events
+
+    def revalue(self, prices, price_version=None):
+        """
+        Apply the prices of a tick batch {isin: kurs}; returns (revaluation, risk events).
+
+        The revaluation lists every depot holding a changed ISIN with its new
+        value and the change. Risk events cover the affected investors that
+        are above the threshold ('breach', with the current share) or just
+        fell back below it ('cleared'). price_version is the Aktie version
+        the batch wrote (see apply_ticks), so sync does not re-read it.
+        """
+        with self._lock:
+            changed, investors = self._apply(prices)
+            events = self._check_breaches(investors)
+            if price_version is not None:
+                self.price_version = price_version
+
+            depots = [{
+                'DepotID': depot_id,
+                'InvestorID': self.depots[depot_id]['InvestorID'],
+                'Investor': self.depots[depot_id]['Investor'],
+                'Depot': self.depots[depot_id]['Depot'],
+                'Wert': round(self.depot_values[depot_id], 2),
+                'Aenderung': round(delta, 2),
+            } for depot_id, delta in sorted(changed.items())]
+            self.revaluations += 1
+            return depots, events
+
+    def _risk_event(self, investor_id, breach, status):
+        sector, share = breach
+        return {
+            'status': status,
+            'InvestorID': investor_id,
+            'Investor': self.investors.get(investor_id),
+            'Branche': sector,
+            'Anteil': round(share * 100, 1) if share is not None else None,
+            'Schwelle': round(self.threshold * 100, 1),
+        }
+
+    def current_breaches(self, investor_id=None):
+        """Risk events for all investors currently above the threshold (or just one)."""
+        with self._lock:
+            return [self._risk_event(investor, breach, 'breach')
+                    for investor, breach in sorted(self.breaches.items())
+                    if investor_id is None or investor == investor_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'isins': len(self.holders),
+                'depots': len(self.depot_values),
+                'breaches': len(self.breaches),
+                'threshold': self.threshold,
+                'builds': self.builds,
+                'reprices': self.reprices,
+                'revaluations': self.revaluations,
+            }
+
+
+class EventHub:
+    """
+    Fan-out of events to Server-Sent-Event subscribers.
+
+    Every subscriber has a bounded queue; a client that does not keep up
+    loses its oldest events instead of blocking the publisher.
+    """
+
+    def __init__(self, max_clients=100, queue_size=256):
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, investor_id=None):
+        """Register a subscriber (optionally for one investor); None if the hub is full."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscriber = (queue.Queue(self.queue_size), investor_id)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def send(self, subscriber, kind, data):
+        """Queue an event for one subscriber (e.g. the current state on connect)."""
+        self._put(subscriber[0], kind, data)
+
+    def publish(self, kind, payload, investor_ids=None):
+        """Queue an event; payload may be a callable(investor_id) for per-investor views."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        self.published += 1
+        for events, investor_id in subscribers:
+            if investor_id is not None and investor_ids is not None and investor_id not in investor_ids:
+                continue
+            data = payload(investor_id) if callable(payload) else payload
+            if data is not None:
+                self._put(events, kind, data)
+
+    def _put(self, events, kind, data):
+        while True:
+            try:
+                events.put_nowait((kind, data))
+                return
+            except queue.Full:
+                try:
+                    events.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def stream(self, subscriber, encode, heartbeat=15.0):
+        """Yield SSE frames for a subscriber; a comment line is sent when idle."""
+        events, _ = subscriber
+        yield 'retry: 3000\n\n'
+        try:
+            while True:
+                try:
+                    kind, data = events.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield f': {datetime.now().isoformat(timespec="seconds")}\n\n'
+                    continue
+                yield f'event: {kind}\ndata: {encode(data)}\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            clients = len(self._subscribers)
+        return {'clients': clients, 'max_clients': self.max_clients,
+                'published': self.published, 'dropped': self.dropped}
+
+
+def revaluation_event(depots, elapsed_ms):
+    """Payload of a 'revaluation' event, with per-investor filtering for subscribers."""
+    stamp = datetime.now().isoformat(timespec='milliseconds')
+
+    def view(investor_id):
+        selected = depots if investor_id is None else [d for d in depots if d['InvestorID'] == investor_id]
+        if not selected:
+            return None
+        return {'zeit': stamp, 'depots': selected, 'elapsed_ms': elapsed_ms}
+    return view
@@ -0,0 +1,107 @@
+import os
+import re
+import zlib
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'database', 'migrations')
+
+_FILENAME = re.compile(r'^(\d+)_([\w-]+)\.sql$')
+
+
+def available_migrations(directory=MIGRATIONS_DIR):
+    """Return [(version, name, path)] for all migration files, ordered by version."""
+    migrations = []
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            match = _FILENAME.match(filename)
+            if match:
+                migrations.append((int(match.group(1)), match.group(2),
+                                   os.path.join(directory, filename)))
+    return sorted(migrations)
+
+
+def latest_version(directory=MIGRATIONS_DIR):
+    migrations = available_migrations(directory)
+    return migrations[-1][0] if migrations else 0
+
+
+def current_version(conn):
+    """The schema version recorded in the database (PRAGMA user_version)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def pending_migrations(conn, directory=MIGRATIONS_DIR):
+    version = current_version(conn)
+    return [m for m in available_migrations(directory) if m[0] > version]
+
+
+def apply_migrations(conn, directory=MIGRATIONS_DIR):
+    """
+    Apply all pending migrations in order.
+
+    Each migration runs in its own transaction together with the update of
+    PRAGMA user_version, so a failed migration leaves the database at the
+    previous version. Returns the list of applied (version, name).
+    """
+    applied = []
+    for version, name, path in pending_migrations(conn, directory):
+        with open(path, 'r', encoding='utf-8') as f:
+            sql = f.read()
+        try:
+            conn.executescript(f"BEGIN;\n{sql}\nPRAGMA user_version = {version};\nCOMMIT;")
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        applied.append((version, name))
+    return applied
+
+
+def schema_checksum(schema_path):
+    """crc32 of the base schema file as a signed 32-bit value (fits PRAGMA application_id)."""
+    with open(schema_path, 'rb') as f:
+        checksum = zlib.crc32(f.read())
+    return checksum - (1 << 32) if checksum >= 1 << 31 else checksum
+
+
+def schema_is_current(conn, schema_path, directory=MIGRATIONS_DIR):
+    """True if the database has the current base schema and all migrations."""
+    application_id = conn.execute("PRAGMA application_id").fetchone()[0]
+    return (current_version(conn) == latest_version(directory)
+            and application_id == schema_checksum(schema_path))
+
+
+def ensure_schema(conn, schema_path, data_path=None, directory=MIGRATIONS_DIR):
+    """
+    Bring a database to the current schema; returns the steps that ran.
+
+    A database that already has the current schema is left alone: both
+    checks are header reads (PRAGMA user_version for the migrations, and
+    the schema.sql checksum recorded in PRAGMA application_id), so starting
+    against an existing database costs nothing. Otherwise the base schema
+    is executed (every statement is IF NOT EXISTS), the sample data loaded
+    into an empty database and the pending migrations applied.
+    """
+    if schema_is_current(conn, schema_path, directory):
+        return []
+    steps = ['schema']
+    with open(schema_path, 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    if data_path is not None and not conn.execute("SELECT EXISTS(SELECT 1 FROM Unternehmen)").fetchone()[0]:
+        with open(data_path, 'r', encoding='utf-8') as f:
+            conn.executescript(f.read())
+        steps.append('sample_data')
+    steps += [f'{version:04d}_{name}' for version, name in apply_migrations(conn, directory)]
+    conn.execute(f"PRAGMA application_id = {schema_checksum(schema_path)}")
+    return steps
+
+
+def migration_indexes(directory=MIGRATIONS_DIR):
+    """Return [(name, statement)] for all indexes created by migration files."""
+    indexes = []
+    pattern = re.compile(
+        r'(CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)[^;]*;)', re.I)
+    for _, _, path in available_migrations(directory):
+        with open(path, 'r', encoding='utf-8') as f:
+            indexes.extend((name, statement) for statement, name in pattern.findall(f.read()))
+    return indexes
@@ -0,0 +1,163 @@
+from collections import deque
+
+
+METHODS = ('FIFO', 'LIFO', 'AVG')
+
+
+class LotBook:
+    """
+    Open purchase lots of one depot/stock under one cost method.
+
+    Every lot is added and removed at most once, so matching a whole
+    transaction history is linear in the number of transactions.
+    """
+
+    def __init__(self, method, lots=()):
+        self.method = method
+        self.lots = deque([list(lot) for lot in lots])  # [KaufTransaktionsID, Menge, Stueckpreis]
+
+    def buy(self, transaction_id, quantity, price):
+        if self.method == 'AVG' and self.lots:
+            lot = self.lots[0]
+            total = lot[1] + quantity
+            lot[2] = (lot[1] * lot[2] + quantity * price) / total if total else price
+            lot[1] = total
+            lot[0] = transaction_id
+        else:
+            self.lots.append([transaction_id, quantity, price])
+
+    def sell(self, quantity):
+        """Consume lots for a sale; returns (matched quantity, cost of the matched quantity)."""
+        matched = 0
+        cost = 0.0
+        while quantity > 0 and self.lots:
+            lot = self.lots[-1] if self.method == 'LIFO' else self.lots[0]
+            take = min(quantity, lot[1])
+            matched += take
+            cost += take * lot[2]
+            quantity -= take
+            lot[1] -= take
+            if lot[1] == 0:
+                if self.method == 'LIFO':
+                    self.lots.pop()
+                else:
+                    self.lots.popleft()
+        return matched, cost
+
+
+def _status(conn, method):
+    row = conn.execute(
+        "SELECT LetzteTransaktionsID, LetztesDatum, NeuBerechnen FROM GewinnStatus WHERE Methode = ?",
+        (method,)).fetchone()
+    return row if row is not None else (0, None, 1)
+
+
+def needs_sync(conn):
+    """True if there are transactions the engine has not processed yet (cheap check)."""
+    last_id = conn.execute("SELECT COALESCE(MAX(TransaktionsID), 0) FROM Transaktionen").fetchone()[0]
+    for method in METHODS:
+        processed_id, _, rebuild = _status(conn, method)
+        if rebuild or processed_id != last_id:
+            return True
+    return False
+
+
+def sync_method(conn, method):
+    """
+    Bring RealisierterGewinn and the lot state for one method up to date.
+
+    Only transactions after the last processed TransaktionsID are walked.
+    If earlier transactions were changed or deleted, or a new transaction
+    is dated before already processed ones, the method is rebuilt from
+    scratch. Returns the number of transactions processed.
+    """
+    processed_id, processed_date, rebuild = _status(conn, method)
+    if not rebuild and processed_date is not None:
+        backdated = conn.execute(
+            "SELECT EXISTS(SELECT 1 FROM Transaktionen WHERE TransaktionsID > ? AND Datum < ?)",
+            (processed_id, processed_date)).fetchone()[0]
+        rebuild = bool(backdated)
+    if rebuild:
+        conn.execute("DELETE FROM RealisierterGewinn WHERE Methode = ?", (method,))
+        conn.execute("DELETE FROM Lot WHERE Methode = ?", (method,))
+        processed_id, processed_date = 0, None
+
+    cursor = conn.execute("""
+        SELECT TransaktionsID, DepotID, ISIN, Datum, Typ, Menge, Stueckpreis, Gesamtwert
+        FROM Transaktionen
+        WHERE TransaktionsID > ?
+        ORDER BY Datum, TransaktionsID
+    """, (processed_id,))
+
+    books = {}
+    gains = []
+    count = 0
+    for tx_id, depot_id, isin, datum, typ, menge, preis, gesamtwert in cursor.fetchall():
+        key = (depot_id, isin)
+        book = books.get(key)
+        if book is None:
+            lots = conn.execute(
+                "SELECT KaufTransaktionsID, Menge, Stueckpreis FROM Lot "
+                "WHERE Methode = ? AND DepotID = ? AND ISIN = ? ORDER BY Seq",
+                (method, depot_id, isin)).fetchall()
+            book = books[key] = LotBook(method, lots)
+
+        if typ == 'Kauf':
+            book.buy(tx_id, menge, preis)
+        else:
+            matched, cost = book.sell(menge)
+            gains.append((
+                tx_id, method, depot_id, isin, datum, menge, preis, gesamtwert, matched,
+                cost if matched else None,
+                matched * preis - cost if matched else None,
+            ))
+        processed_id = max(processed_id, tx_id)
+        processed_date = datum if processed_date is None else max(processed_date, datum)
+        count += 1
+
+    conn.executemany("""
+        INSERT OR REPLACE INTO RealisierterGewinn
+            (TransaktionsID, Methode, DepotID, ISIN, Datum, Menge, Verkaufspreis,
+             Verkaufswert, GedeckteMenge, Einstandswert, Gewinn)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, gains)
+    for (depot_id, isin), book in books.items():
+        conn.execute("DELETE FROM Lot WHERE Methode = ? AND DepotID = ? AND ISIN = ?",
+                     (method, depot_id, isin))
+        conn.executemany(
+            "INSERT INTO Lot (Methode, DepotID, ISIN, Seq, KaufTransaktionsID, Menge, Stueckpreis) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(method, depot_id, isin, seq, lot[0], lot[1], lot[2])
+             for seq, lot in enumerate(book.lots)])
+    conn.execute("""
+        INSERT INTO GewinnStatus (Methode, LetzteTransaktionsID, LetztesDatum, NeuBerechnen)
+        VALUES (?, ?, ?, 0)
+        ON CONFLICT (Methode) DO UPDATE SET
+            LetzteTransaktionsID = excluded.LetzteTransaktionsID,
+            LetztesDatum = excluded.LetztesDatum,
+            NeuBerechnen = 0
+    """, (method, processed_id, processed_date))
+    return count
+
+
+def sync_realized_gains(conn, methods=METHODS):
+    """Process new transactions for all cost methods in one write transaction."""
+    if not needs_sync(conn):
+        return 0
+    processed = 0
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for method in methods:
+            processed += sync_method(conn, method)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return processed
+
+
+def rebuild_realized_gains(conn, methods=METHODS):
+    """Discard the engine state and recompute all realized gains."""
+    conn.execute("UPDATE GewinnStatus SET NeuBerechnen = 1")
+    conn.commit()
+    return sync_realized_gains(conn, methods)
@@ -0,0 +1,72 @@
+AGGREGATE_LEDGER_SQL = """
+    SELECT
+        DepotID,
+        ISIN,
+        SUM(CASE WHEN Typ = 'Kauf' THEN Menge ELSE -Menge END) AS Menge,
+        SUM(CASE WHEN Typ = 'Kauf' THEN Menge ELSE 0 END) AS Kaufmenge,
+        SUM(CASE WHEN Typ = 'Kauf' THEN Gesamtwert ELSE 0 END) AS Einstandswert,
+        SUM(CASE WHEN Typ = 'Kauf' THEN 1 ELSE 0 END) AS AnzahlKaeufe,
+        SUM(CASE WHEN Typ = 'Kauf' THEN Stueckpreis ELSE 0 END) AS SummeKaufpreise,
+        COUNT(*) AS AnzahlTransaktionen
+    FROM Transaktionen
+    GROUP BY DepotID, ISIN
+"""
+
+COLUMNS = ('Menge', 'Kaufmenge', 'Einstandswert', 'AnzahlKaeufe',
+           'SummeKaufpreise', 'AnzahlTransaktionen')
+
+# Sums of DECIMAL values are floating point; differences below a cent are noise.
+TOLERANCE = 0.005
+
+
+def rebuild_positions(conn):
+    """Recompute the Position table from the raw transaction ledger."""
+    conn.execute("DELETE FROM Position")
+    conn.execute(f"""
+        INSERT INTO Position (DepotID, ISIN, {', '.join(COLUMNS)})
+        {AGGREGATE_LEDGER_SQL}
+    """)
+    conn.commit()
+    return conn.execute("SELECT COUNT(*) FROM Position").fetchone()[0]
+
+
+def positions_need_rebuild(conn):
+    """True if there are transactions but no positions (e.g. a database from before Position existed)."""
+    has_positions = conn.execute("SELECT EXISTS(SELECT 1 FROM Position)").fetchone()[0]
+    has_transactions = conn.execute("SELECT EXISTS(SELECT 1 FROM Transaktionen)").fetchone()[0]
+    return bool(has_transactions) and not has_positions
+
+
+def verify_positions(conn):
+    """
+    Compare the Position table against the raw ledger.
+
+    Returns a list of mismatches as dicts with the DepotID, ISIN, the column
+    and both values; an empty list means the table is consistent.
+    """
+    expected = {(row[0], row[1]): row[2:]
+                for row in conn.execute(AGGREGATE_LEDGER_SQL).fetchall()}
+    actual = {(row[0], row[1]): row[2:]
+              for row in conn.execute(
+                  f"SELECT DepotID, ISIN, {', '.join(COLUMNS)} FROM Position").fetchall()}
+
+    mismatches = []
+    for key in sorted(expected.keys() | actual.keys()):
+        want = expected.get(key)
+        have = actual.get(key)
+        for i, column in enumerate(COLUMNS):
+            want_value = want[i] if want else None
+            have_value = have[i] if have else None
+            if want_value is None or have_value is None:
+                ok = want_value == have_value
+            else:
+                ok = abs(want_value - have_value) < TOLERANCE
+            if not ok:
+                mismatches.append({
+                    'DepotID': key[0],
+                    'ISIN': key[1],
+                    'column': column,
+                    'expected': want_value,
+                    'actual': have_value,
+                })
+    return mismatches
@@ -0,0 +1,439 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, the SQL queries are used without it
+    np = None
+
+
+FIELDS = ('Oeffnungskurs', 'Tiefstkurs', 'Hoechstkurs', 'Endkurs', 'Volumen')
+OPEN, LOW, HIGH, CLOSE, VOLUME = range(len(FIELDS))
+TRADING_DAYS = 252
+BUILD_BATCH_SIZE = 100000
+# Changed bars kept beside the files before they are rebuilt
+MAX_PENDING_CHANGES = 20000
+
+
+def available():
+    """True if NumPy is installed and the columnar store can be used."""
+    return np is not None
+
+
+class PriceStore:
+    """
+    Columnar, memory-mapped copy of Kursverlauf.
+
+    All rows are sorted by ISIN and date, so the history of one stock is a
+    contiguous slice of every column. The store lives in a directory with
+    prices.npy (one row per field), dates.npy and meta.json (ISIN offsets,
+    the Datenbankkennung of the database, the Kursverlauf version and the
+    last Kursaenderung entry it was built from). When Kursverlauf changes,
+    only the bars listed in Kursaenderung since then are read and kept
+    beside the files (changed bars hide their old row, new bars are
+    appended per ISIN). Once more than MAX_PENDING_CHANGES bars piled up,
+    the log no longer reaches back to the store (or is behind it), or the
+    store belongs to another database, the files are rebuilt.
+
+    Readers work on one immutable _State (sync() returns it), so a
+    concurrent update never shows them a half-replaced store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._state = None
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.updates = 0
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read(self):
+        """State of the files on disk, or None if there is no store."""
+        try:
+            with open(self._file('meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            prices = np.load(self._file('prices.npy'), mmap_mode='r')
+            dates = np.load(self._file('dates.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        isins = tuple(meta['isins'])
+        offsets = np.asarray(meta['offsets'], dtype=np.int64)
+        if len(offsets) != len(isins) + 1 or offsets[-1] != prices.shape[1]:
+            return None
+        return _State(prices, dates, isins, offsets, {isin: i for i, isin in enumerate(isins)},
+                      meta.get('database'), meta['version'], meta.get('seq'), {}, _NO_ROWS, None)
+
+    def load(self):
+        """Memory-map an existing store; returns False if there is none."""
+        state = self._read()
+        if state is None:
+            return False
+        self._state = state
+        return True
+
+    def build(self, conn, database, version, seq):
+        """Write a fresh store from Kursverlauf (in the caller's read transaction) and map it."""
+        os.makedirs(self.path, exist_ok=True)
+        n = conn.execute("SELECT COUNT(*) FROM Kursverlauf").fetchone()[0]
+        # Per-process temporary names: several workers may rebuild at once,
+        # the last os.replace wins and every one of them is complete
+        temporary = [_temporary(self.path, suffix) for suffix in ('.npy', '.npy', '.json')]
+        tmp_prices, tmp_dates, tmp_meta = temporary
+        try:
+            prices = np.lib.format.open_memmap(tmp_prices, mode='w+', dtype=np.float64,
+                                               shape=(len(FIELDS), n))
+            dates = np.lib.format.open_memmap(tmp_dates, mode='w+', dtype='datetime64[D]',
+                                              shape=(n,))
+            isins, offsets = [], []
+            cursor = conn.execute(f"""
+                SELECT ISIN, Datum, {', '.join(FIELDS)}
+                FROM Kursverlauf
+                ORDER BY ISIN, Datum
+            """)
+            pos = 0
+            while True:
+                rows = cursor.fetchmany(BUILD_BATCH_SIZE)
+                if not rows:
+                    break
+                for i, row in enumerate(rows):
+                    if not isins or row[0] != isins[-1]:
+                        isins.append(row[0])
+                        offsets.append(pos + i)
+                end = pos + len(rows)
+                prices[:, pos:end] = np.array([row[2:] for row in rows], dtype=np.float64).T
+                dates[pos:end] = np.array([str(row[1])[:10] for row in rows], dtype='datetime64[D]')
+                pos = end
+            offsets.append(pos)
+            prices.flush()
+            dates.flush()
+            del prices, dates
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({'isins': isins, 'offsets': offsets, 'database': database,
+                           'version': version, 'seq': seq}, f)
+
+            os.replace(tmp_prices, self._file('prices.npy'))
+            os.replace(tmp_dates, self._file('dates.npy'))
+            os.replace(tmp_meta, self._file('meta.json'))
+        finally:
+            for path in temporary:
+                if os.path.exists(path):
+                    os.remove(path)
+        self.builds += 1
+        # Map what was just written; another worker may have replaced a file
+        # in between, then the next sync catches up from its meta.json
+        state = self._read()
+        if state is None or (state.database, state.version, state.seq) != (database, version, seq):
+            raise RuntimeError('Kursverlauf-Store wurde während des Aufbaus ersetzt')
+        self._state = state
+        return state
+
+    def sync(self, conn):
+        """Bring the store up to the current Kursverlauf table; returns the state to read."""
+        state = self._state
+        if state is not None and (state.database, state.version) == _identity(conn):
+            return state
+        with self._lock:
+            if self._state is None:
+                self.load()
+            own = not conn.in_transaction
+            if own:
+                conn.execute("BEGIN")
+            try:
+                database, version = _identity(conn)
+                state = self._state
+                if state is not None and (state.database, state.version) == (database, version):
+                    return state
+                self._state = self._update(conn, state, database, version)
+            finally:
+                if own:
+                    conn.rollback()
+            return self._state
+
+    def _update(self, conn, state, database, version):
+        """Apply the Kursaenderung entries since the store was built, or rebuild it."""
+        try:
+            first, last = conn.execute("SELECT MIN(Seq), MAX(Seq) FROM Kursaenderung").fetchone()
+        except sqlite3.OperationalError:  # database without the change log
+            return self.build(conn, database, version, None)
+        last = last or 0
+
+        def reachable(candidate):
+            # A store ahead of the log was built from another (or a since
+            # replaced) database; one before its first entry missed changes
+            return (candidate is not None and candidate.seq is not None
+                    and candidate.database == database
+                    and candidate.seq <= last
+                    and (first is None or first <= candidate.seq + 1)
+                    and last - candidate.seq + len(candidate.changes) <= MAX_PENDING_CHANGES)
+
+        if not reachable(state):
+            # Another worker may already have rebuilt the files
+            state = self._read()
+            if not reachable(state):
+                return self.build(conn, database, version, last)
+        if last == state.seq:
+            return state._replace(version=version)
+
+        changes = dict(state.changes)
+        cursor = conn.execute(f"""
+            SELECT c.ISIN, c.Datum, {', '.join('k.' + field for field in FIELDS)}
+            FROM (SELECT DISTINCT ISIN, Datum FROM Kursaenderung WHERE Seq > ?) c
+            LEFT JOIN Kursverlauf k ON k.Datum = c.Datum AND k.ISIN = c.ISIN
+        """, (state.seq,))
+        for row in cursor:
+            # All columns are NOT NULL, so NULL means the bar was deleted
+            changes[(row[0], str(row[1])[:10])] = tuple(row[2:]) if row[2] is not None else None
+        self.updates += 1
+        return _with_changes(state, changes, version, last)
+
+    def series(self, isin):
+        """Return (dates, prices) for one ISIN, or None if it has no history."""
+        state = self._state
+        return _series(state, isin) if state is not None else None
+
+    def stats(self):
+        state = self._state
+        if state is None:
+            return {'path': self.path, 'loaded': False, 'rows': 0, 'isins': 0, 'version': None,
+                    'pending_changes': 0, 'builds': self.builds, 'updates': self.updates}
+        extra_rows = state.extra[1].shape[0] if state.extra else 0
+        return {
+            'path': self.path,
+            'loaded': True,
+            'rows': int(state.prices.shape[1]) - len(state.hidden) + extra_rows,
+            'isins': len(state.isins),
+            'version': state.version,
+            'pending_changes': len(state.changes),
+            'builds': self.builds,
+            'updates': self.updates,
+        }
+
+
+# prices/dates: mapped files; isins, offsets, positions: ISINs of the files
+# (plus ISINs that only have new bars) and their slices; changes: bars read
+# since the files were built ((ISIN, Datum) -> values, None if deleted);
+# hidden: sorted file rows replaced by changes; extra: (stock, dates, prices,
+# ranges) of the changed bars ordered by stock and date, or None
+_State = namedtuple('_State', 'prices dates isins offsets positions database version seq changes hidden extra')
+_NO_ROWS = np.zeros(0, dtype=np.int64) if np is not None else None
+
+
+def _temporary(directory, suffix):
+    handle, path = tempfile.mkstemp(prefix='.build-', suffix=suffix, dir=directory)
+    os.close(handle)
+    return path
+
+
+def _identity(conn):
+    """(Datenbankkennung, Kursverlauf version) of the database behind conn."""
+    try:
+        database = conn.execute("SELECT Kennung FROM Datenbankkennung").fetchone()
+    except sqlite3.OperationalError:  # database without migration 0005
+        database = None
+    row = conn.execute(
+        "SELECT Version FROM Tabellenversion WHERE Tabelle = 'Kursverlauf'").fetchone()
+    return (database[0] if database else None), (row[0] if row else None)
+
+
+def _with_changes(state, changes, version, seq):
+    """New state: the files of `state` overlaid with `changes`."""
+    base = len(state.offsets) - 1
+    isins = list(state.isins[:base])
+    positions = {isin: i for i, isin in enumerate(isins)}
+    hidden, extra = [], []
+    for (isin, datum), values in changes.items():
+        i = positions.get(isin)
+        if i is not None and i < base:
+            start, end = state.offsets[i], state.offsets[i + 1]
+            day = np.datetime64(datum, 'D')
+            row = start + int(np.searchsorted(state.dates[start:end], day))
+            if row < end and state.dates[row] == day:
+                hidden.append(row)
+        if values is not None:
+            if i is None:
+                i = positions[isin] = len(isins)
+                isins.append(isin)
+            extra.append((i, datum, values))
+
+    overlay = None
+    if extra:
+        extra.sort()
+        stock = np.array([e[0] for e in extra], dtype=np.int64)
+        dates = np.array([e[1] for e in extra], dtype='datetime64[D]')
+        prices = np.array([e[2] for e in extra], dtype=np.float64).T
+        bounds = np.flatnonzero(np.diff(stock)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(stock)]))
+        ranges = {isins[stock[s]]: (int(s), int(e)) for s, e in zip(starts, ends)}
+        overlay = (stock, dates, prices, ranges)
+    return state._replace(isins=tuple(isins), positions=positions, version=version, seq=seq,
+                          changes=changes, hidden=np.array(sorted(hidden), dtype=np.int64),
+                          extra=overlay)
+
+
+def _series(state, isin):
+    i = state.positions.get(isin)
+    if i is None:
+        return None
+    if i < len(state.offsets) - 1:
+        start, end = int(state.offsets[i]), int(state.offsets[i + 1])
+    else:
+        start = end = 0
+    dates, prices = state.dates[start:end], state.prices[:, start:end]
+    first, last = np.searchsorted(state.hidden, [start, end])
+    extra = state.extra[3].get(isin) if state.extra else None
+    if first == last and extra is None:
+        return dates, prices
+    keep = np.ones(end - start, dtype=bool)
+    keep[state.hidden[first:last] - start] = False
+    dates, prices = dates[keep], prices[:, keep]
+    if extra is not None:
+        _, extra_dates, extra_prices, _ = state.extra
+        dates = np.concatenate((dates, extra_dates[extra[0]:extra[1]]))
+        prices = np.concatenate((prices, extra_prices[:, extra[0]:extra[1]]), axis=1)
+        order = np.argsort(dates, kind='stable')
+        dates, prices = dates[order], prices[:, order]
+    return (dates, prices) if len(dates) else None
+
+
+def _stock_info(conn):
+    cursor = conn.execute("""
+        SELECT a.ISIN, u.Name, a.Ticker, u.Branche, u.Land, a.AktuellerKurs
+        FROM Aktie a
+        JOIN Unternehmen u ON a.UnternehmenID = u.UnternehmenID
+    """)
+    return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+
+def _touched(state):
+    """Positions of the ISINs whose history differs from the files."""
+    touched = set(state.extra[3]) if state.extra else set()
+    if len(state.hidden):
+        stocks = np.searchsorted(state.offsets, state.hidden, side='right') - 1
+        touched.update(state.isins[i] for i in np.unique(stocks))
+    return {state.positions[isin] for isin in touched}
+
+
+def top_performers(store, conn, limit=10):
+    """Vectorized version of the top_performers query."""
+    state = store.sync(conn)
+    columns = ['Unternehmen', 'Ticker', 'Branche', 'Land', 'TiefsterKurs', 'HoechsterKurs',
+               'AktuellerKurs', 'PerformanceInProzent', 'AnzahlHandelstage']
+    if not state.isins:
+        return columns, []
+    lows = np.zeros(len(state.isins))
+    highs = np.zeros(len(state.isins))
+    days = np.zeros(len(state.isins), dtype=np.int64)
+    base = len(state.offsets) - 1
+    if state.prices.shape[1]:
+        starts = state.offsets[:-1]
+        close = state.prices[CLOSE]
+        lows[:base] = np.minimum.reduceat(close, starts)
+        highs[:base] = np.maximum.reduceat(close, starts)
+        # Dates are unique per ISIN (primary key), so the segment length is the day count
+        days[:base] = np.diff(state.offsets)
+    for i in _touched(state):
+        series = _series(state, state.isins[i])
+        close = series[1][CLOSE] if series is not None else ()
+        days[i] = len(close)
+        if len(close):
+            lows[i], highs[i] = close.min(), close.max()
+
+    info = _stock_info(conn)
+    rows = []
+    for i, isin in enumerate(state.isins):
+        stock = info.get(isin)
+        if stock is None or not days[i]:
+            continue
+        name, ticker, branche, land, kurs = stock
+        performance = round(float((kurs - lows[i]) / lows[i] * 100), 2) if lows[i] else None
+        rows.append((name, ticker, branche, land, float(lows[i]), float(highs[i]),
+                     kurs, performance, int(days[i])))
+    rows.sort(key=lambda r: (r[7] is not None, r[7] or 0), reverse=True)
+    return columns, rows[:limit]
+
+
+def _volatility(prices):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volatility = (prices[HIGH] - prices[LOW]) / prices[OPEN]
+    # Division by zero is NULL in SQL, so those bars never pass the threshold
+    volatility[prices[OPEN] == 0] = np.nan
+    return volatility
+
+
+def volatility_alert(store, conn, threshold=0.05, limit=15):
+    """Vectorized version of the volatility_alert query."""
+    state = store.sync(conn)
+    columns = ['Unternehmen', 'Ticker', 'Datum', 'Oeffnungskurs', 'Tiefstkurs', 'Hoechstkurs',
+               'Endkurs', 'Tagesvolatilitaet', 'Volumen']
+    if not state.isins:
+        return columns, []
+    # Rows of the files first, then the changed bars; replaced rows are masked
+    n = state.prices.shape[1]
+    volatility = _volatility(state.prices)
+    volatility[state.hidden] = np.nan
+    if state.extra:
+        volatility = np.concatenate((volatility, _volatility(state.extra[2])))
+    candidates = np.flatnonzero(volatility > threshold)
+    if limit is not None and len(candidates) > limit:
+        top = np.argpartition(-volatility[candidates], limit - 1)[:limit]
+        candidates = candidates[top]
+    candidates = candidates[np.argsort(-volatility[candidates], kind='stable')]
+
+    info = _stock_info(conn)
+    rows = []
+    for row in candidates:
+        if row < n:
+            i = int(np.searchsorted(state.offsets, row, side='right')) - 1
+            day, bar = state.dates[row], state.prices[:, row]
+        else:
+            stock, dates, prices, _ = state.extra
+            i, day, bar = stock[row - n], dates[row - n], prices[:, row - n]
+        stock = info.get(state.isins[i])
+        if stock is None:
+            continue
+        rows.append((stock[0], stock[1], str(day),
+                     float(bar[OPEN]), float(bar[LOW]), float(bar[HIGH]),
+                     float(bar[CLOSE]), round(float(volatility[row]) * 100, 2),
+                     int(bar[VOLUME])))
+    return columns, rows
+
+
+def daily_returns(store, isin):
+    """Close-to-close simple returns for one ISIN: (dates, returns)."""
+    series = store.series(isin)
+    if series is None:
+        return None
+    dates, prices = series
+    close = prices[CLOSE]
+    return dates[1:], np.diff(close) / close[:-1]
+
+
+def rolling_volatility(store, isin, window=20):
+    """Annualized rolling standard deviation of daily returns: (dates, volatility)."""
+    result = daily_returns(store, isin)
+    if result is None:
+        return None
+    dates, returns = result
+    if len(returns) < window:
+        return dates[:0], returns[:0]
+    windows = np.lib.stride_tricks.sliding_window_view(returns, window)
+    return dates[window - 1:], windows.std(axis=1, ddof=1) * np.sqrt(TRADING_DAYS)
+
+
+def drawdown(store, isin):
+    """Drawdown from the running maximum close: (dates, drawdown, max_drawdown)."""
+    series = store.series(isin)
+    if series is None:
+        return None
+    dates, prices = series
+    close = prices[CLOSE]
+    peak = np.maximum.accumulate(close)
+    dd = close / peak - 1.0
+    return dates, dd, float(dd.min()) if len(dd) else 0.0
@@ -0,0 +1,154 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+def tables_read_by(conn, sql, params=()):
+    """
+    Return the set of tables a statement reads.
+
+    The statement is only prepared (via EXPLAIN), never executed; SQLite's
+    authorizer reports every table it touches while compiling it.
+    """
+    tables = set()
+
+    def authorizer(action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and arg1 and not arg1.startswith('sqlite_'):
+            tables.add(arg1)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        conn.execute('EXPLAIN ' + sql, params).fetchall()
+    finally:
+        conn.set_authorizer(None)
+    return tables
+
+
+def table_versions(conn):
+    """Return {table: (version, changed_at)} from the Tabellenversion change counters."""
+    cursor = conn.execute("SELECT Tabelle, Version, GeaendertAm FROM Tabellenversion")
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+
+class CacheEntry:
+    """A cached query result together with the table versions it was computed from."""
+
+    def __init__(self, key, value, versions, created):
+        self.value = value
+        self.versions = versions
+        self.created = created
+        fingerprint = repr((key, sorted(versions.items()))).encode()
+        self.etag = hashlib.sha1(fingerprint).hexdigest()[:16]
+        # Tables without a change counter (e.g. Tabellenversion itself) map to None
+        changed = [version[1] for version in versions.values() if version and version[1]]
+        self.last_modified = _parse_timestamp(max(changed)) if changed else None
+        # Serialized representations of the value, filled lazily by the caller
+        self.bodies = {}
+
+
+class ResultCache:
+    """
+    Bounded LRU/TTL cache for query results.
+
+    Each entry remembers which tables it depends on and the versions of
+    those tables at the time it was computed. Whenever the current versions
+    are passed in (see sync), only entries depending on a changed table are
+    dropped.
+    """
+
+    def __init__(self, max_entries=128, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._dependencies = {}
+        self._seen_versions = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def sync(self, versions):
+        """Drop every entry that depends on a table whose version changed."""
+        with self._lock:
+            changed = {table for table, version in versions.items()
+                       if self._seen_versions.get(table, version)[0] != version[0]}
+            self._seen_versions = dict(versions)
+            if changed:
+                self._invalidate_tables(changed)
+
+    def invalidate_tables(self, tables):
+        """Drop every entry that depends on one of the given tables."""
+        with self._lock:
+            self._invalidate_tables(set(tables))
+
+    def _invalidate_tables(self, tables):
+        for key in [k for k, entry in self._entries.items() if tables & entry.versions.keys()]:
+            del self._entries[key]
+            self.invalidations += 1
+
+    def dependencies(self, key, conn, sql, params=()):
+        """Return (and memoize) the tables read by the statement behind a cache key."""
+        deps = self._dependencies.get(key)
+        if deps is None:
+            deps = frozenset(tables_read_by(conn, sql, params))
+            self._dependencies[key] = deps
+        return deps
+
+    def get(self, key, versions):
+        """Return a valid entry for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expired = self.ttl is not None and time.monotonic() - entry.created > self.ttl
+                stale = any(versions.get(table) != version
+                            for table, version in entry.versions.items())
+                if expired or stale:
+                    del self._entries[key]
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value, tables, versions):
+        """Store a value computed while the given tables had the given versions."""
+        entry = CacheEntry(key, value, {t: versions.get(t) for t in tables}, time.monotonic())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+def _parse_timestamp(value):
+    """Parse SQLite's CURRENT_TIMESTAMP format (UTC) into an aware datetime."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
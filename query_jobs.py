@@ -0,0 +1,318 @@
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from instrumentation import QueryTimer
+from result_stream import fetch_page
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED, TIMEOUT = (
+    'queued', 'running', 'done', 'failed', 'cancelled', 'timeout')
+FINISHED = (DONE, FAILED, CANCELLED, TIMEOUT)
+
+
+class QueueFull(Exception):
+    """Raised when no more queries can be queued."""
+
+
+def deadline_handler(deadline, cancelled=None):
+    """Progress handler that aborts the running statement after the deadline or on cancel."""
+    def handler():
+        if cancelled is not None and cancelled.is_set():
+            return 1
+        return 1 if time.monotonic() > deadline else 0
+    return handler
+
+
+class QueryJob:
+    """A custom query submitted to the QueryRunner, with its status and result."""
+
+    def __init__(self, sql, timeout, max_rows, offset=0, limit=None):
+        self.id = uuid.uuid4().hex
+        self.sql = sql
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.offset = offset
+        self.limit = limit
+        self.status = QUEUED
+        self.submitted = time.time()
+        # The time limit counts from submission, so time spent queued is included
+        self.deadline = time.monotonic() + timeout
+        self.started = None
+        self.finished = None
+        self.columns = None
+        self.rows = None
+        self.has_more = False
+        self.error = None
+        self.future = None
+        self.timer = None
+        self.keep = True
+        self._cancelled = threading.Event()
+        self._expired = False
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; returns False if the wait timed out."""
+        if self.future is None:
+            return self.done
+        try:
+            self.future.result(timeout)
+        except Exception:
+            pass
+        return self.done
+
+    def info(self):
+        def stamp(value):
+            return datetime.fromtimestamp(value).isoformat(timespec='milliseconds') if value else None
+        end = self.finished or time.time()
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'query': self.sql,
+            'submitted': stamp(self.submitted),
+            'started': stamp(self.started),
+            'finished': stamp(self.finished),
+            'elapsed_ms': round((end - self.started) * 1000, 1) if self.started else None,
+            'timeout_seconds': self.timeout,
+            'row_count': len(self.rows) if self.rows is not None else None,
+            'truncated': self.has_more,
+            'error': self.error,
+        }
+
+
+class QueryRunner:
+    """
+    Runs custom queries on bounded pools of worker threads.
+
+    Every query gets a deadline (counted from submission), enforced by a
+    SQLite progress handler that interrupts the statement, and a maximum
+    number of result rows. Synchronous queries and streams share `workers`
+    slots; asynchronous jobs (submit with keep=True) run on their own
+    `job_workers` threads, so long jobs cannot block the synchronous
+    endpoint. Jobs can be cancelled while queued or running. Finished jobs
+    are kept (up to `history` of them, for `result_ttl` seconds) so their
+    results can be fetched later.
+    """
+
+    # Extra time run() waits for an interrupted query to report its timeout
+    WAIT_GRACE = 1.0
+
+    def __init__(self, connect, workers=4, max_queued=32, timeout=30.0, max_rows=10000,
+                 history=100, result_ttl=600, metrics=None, job_workers=2):
+        self.connect = connect
+        self.metrics = metrics
+        self.workers = workers
+        self.job_workers = job_workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.history = history
+        self.result_ttl = result_ttl
+
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='custom-query')
+        self._job_executor = ThreadPoolExecutor(max_workers=job_workers,
+                                                thread_name_prefix='query-job')
+        # Synchronous queries and streamed queries take one of these slots
+        self._slots = threading.BoundedSemaphore(workers)
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._running = 0
+        self._streams = 0
+        self._lock = threading.Lock()
+
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def submit(self, sql, timeout=None, max_rows=None, offset=0, limit=None, keep=True):
+        """Queue a query; raises QueueFull when max_queued jobs are already waiting."""
+        job = QueryJob(sql, timeout or self.timeout, max_rows or self.max_rows, offset, limit)
+        job.keep = keep
+        with self._lock:
+            if self._pending >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull('Zu viele Abfragen in der Warteschlange')
+            self._pending += 1
+            if keep:
+                self._prune()
+                self._jobs[job.id] = job
+        executor = self._job_executor if keep else self._executor
+        job.future = executor.submit(self._execute, job)
+        return job
+
+    def run(self, sql, timeout=None, max_rows=None, offset=0, limit=None):
+        """Run a query on the worker pool and wait for it (used by the synchronous endpoint).
+
+        Waits at most until the job's deadline; a job still queued or
+        running then is cancelled and reported as timed out.
+        """
+        job = self.submit(sql, timeout, max_rows, offset, limit, keep=False)
+        if not job.wait(max(job.deadline - time.monotonic(), 0) + self.WAIT_GRACE):
+            job._expired = True
+            job._cancelled.set()
+            if job.future.cancel():
+                with self._lock:
+                    self._pending -= 1
+                self._finish(job, TIMEOUT, self._timeout_message(job))
+            else:
+                job.wait(self.WAIT_GRACE)
+        return job
+
+    def stream_slot(self, timeout=None):
+        """
+        Reserve a synchronous query slot for a streamed query; returns its release function.
+
+        Raises QueueFull if no slot frees up within the timeout.
+        """
+        if not self._slots.acquire(timeout=timeout or self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise QueueFull('Zu viele gleichzeitige Abfragen')
+        with self._lock:
+            self._streams += 1
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                with self._lock:
+                    self._streams -= 1
+                self._slots.release()
+        return release
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job or None if unknown."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return job
+        job._cancelled.set()
+        if job.future.cancel():
+            # Never started: _execute will not run, so finish the job here
+            with self._lock:
+                self._pending -= 1
+            self._finish(job, CANCELLED)
+        return job
+
+    def _execute(self, job):
+        with self._lock:
+            self._pending -= 1
+        if job._cancelled.is_set():
+            self._finish(job, TIMEOUT if job._expired else CANCELLED, self._timeout_message(job))
+            return
+        # Synchronous queries wait (until their deadline) for a slot that streams may hold
+        if not job.keep and not self._slots.acquire(timeout=max(job.deadline - time.monotonic(), 0)):
+            self._finish(job, TIMEOUT, self._timeout_message(job))
+            return
+        with self._lock:
+            self._running += 1
+        try:
+            if time.monotonic() > job.deadline:
+                self._finish(job, TIMEOUT, self._timeout_message(job))
+            else:
+                self._run(job)
+        finally:
+            with self._lock:
+                self._running -= 1
+            if not job.keep:
+                self._slots.release()
+
+    def _timeout_message(self, job):
+        if job._cancelled.is_set() and not job._expired:
+            return None
+        return f'Zeitlimit von {job.timeout:g} s überschritten'
+
+    def _run(self, job):
+        job.status = RUNNING
+        job.started = time.time()
+        deadline = job.deadline
+        job.timer = QueryTimer('custom', 'job' if job.keep else 'custom_query', job.sql)
+        try:
+            with self.connect() as conn:
+                job.timer.attach(conn, deadline_handler(deadline, job._cancelled))
+                try:
+                    job.columns, job.rows, job.has_more = fetch_page(
+                        conn, job.sql, offset=job.offset, limit=job.limit, max_rows=job.max_rows,
+                        timer=job.timer)
+                finally:
+                    job.timer.detach(conn)
+        except sqlite3.OperationalError as e:
+            if job._cancelled.is_set() and not job._expired:
+                self._finish(job, CANCELLED)
+            elif job._expired or time.monotonic() > deadline:
+                self._finish(job, TIMEOUT, self._timeout_message(job))
+            else:
+                self._finish(job, FAILED, str(e))
+            return
+        except Exception as e:
+            self._finish(job, FAILED, str(e))
+            return
+        self._finish(job, DONE)
+
+    def _finish(self, job, status, error=None):
+        job.error = error
+        job.finished = time.time()
+        if status != DONE:
+            job.rows = None
+        # Jobs run for the synchronous endpoint are recorded there, after serialization
+        if job.timer is not None and self.metrics is not None and job.keep:
+            job.timer.error = error
+            self.metrics.record_query(job.timer)
+        job.status = status
+        with self._lock:
+            if status == DONE:
+                self.completed += 1
+            elif status == CANCELLED:
+                self.cancelled += 1
+            elif status == TIMEOUT:
+                self.timeouts += 1
+            else:
+                self.failed += 1
+
+    def _prune(self):
+        """Forget finished jobs beyond the history size or older than result_ttl."""
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.done]
+        excess = len(finished) - self.history
+        for job in finished:
+            if excess > 0 or now - job.finished > self.result_ttl:
+                del self._jobs[job.id]
+                excess -= 1
+
+    def shutdown(self):
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+        self._executor.shutdown(wait=False)
+        self._job_executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'job_workers': self.job_workers,
+                'queued': self._pending,
+                'max_queued': self.max_queued,
+                'running': self._running,
+                'streams': self._streams,
+                'jobs': len(self._jobs),
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'timeout_seconds': self.timeout,
+                'max_rows': self.max_rows,
+            }
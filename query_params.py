@@ -0,0 +1,185 @@
+import re
+from datetime import date
+from functools import lru_cache
+
+
+# Upper bound for list parameters; every list length is a separate statement
+MAX_LIST_ITEMS = 20
+
+ISIN_PATTERN = re.compile(r'^[A-Z]{2}[A-Z0-9]{9}[0-9]$')
+NAME_PATTERN = re.compile(r':([A-Za-z_]\w*)')
+
+
+class Param:
+    """
+    A typed parameter of a predefined query.
+
+    Parameters with a `filter` add that condition (with :name placeholders)
+    to the query's `{clause}` marker when a value is given; the others are
+    referenced as :name in the SQL text itself and always bound (so they
+    need a default). kind is one of int, float, date, isin, choice, list.
+    """
+
+    def __init__(self, kind, description, default=None, filter=None, clause='filters',
+                 minimum=None, maximum=None, choices=None, pattern=None):
+        self.kind = kind
+        self.description = description
+        self.default = default
+        self.filter = filter
+        self.clause = clause
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = choices
+        # list values are bound as pattern.format(item), e.g. '%{}%' for LIKE
+        self.pattern = pattern
+
+    def convert(self, name, raw):
+        """Convert a raw request value; raises ValueError with a German message."""
+        if self.kind == 'list':
+            items = raw.split(',') if isinstance(raw, str) else raw
+            if not isinstance(items, list):
+                raise ValueError(f'{name} muss eine Liste sein')
+            items = [str(item).strip() for item in items if str(item).strip()]
+            if not items:
+                raise ValueError(f'{name} darf nicht leer sein')
+            if len(items) > MAX_LIST_ITEMS:
+                raise ValueError(f'{name}: höchstens {MAX_LIST_ITEMS} Einträge')
+            return tuple(items)
+        if isinstance(raw, (list, dict)) or isinstance(raw, bool):
+            raise ValueError(f'{name}: ungültiger Wert {raw!r}')
+        if self.kind in ('int', 'float'):
+            try:
+                value = int(raw) if self.kind == 'int' else float(raw)
+            except (TypeError, ValueError):
+                raise ValueError(f'{name} muss eine Zahl sein')
+            if self.minimum is not None and value < self.minimum:
+                raise ValueError(f'{name} muss mindestens {self.minimum} sein')
+            if self.maximum is not None and value > self.maximum:
+                raise ValueError(f'{name} darf höchstens {self.maximum} sein')
+            return value
+        value = str(raw).strip()
+        if self.kind == 'date':
+            try:
+                return date.fromisoformat(value).isoformat()
+            except ValueError:
+                raise ValueError(f'{name}: ungültiges Datum {value!r} (erwartet JJJJ-MM-TT)')
+        if self.kind == 'isin':
+            value = value.upper()
+            if not ISIN_PATTERN.match(value):
+                raise ValueError(f'{name}: ungültige ISIN {value!r}')
+            return value
+        if self.kind == 'choice':
+            value = value.upper()
+            if value not in self.choices:
+                raise ValueError(f'{name} muss eines von {", ".join(self.choices)} sein')
+            return value
+        raise ValueError(f'{name}: unbekannter Parametertyp {self.kind}')
+
+    def describe(self):
+        info = {'type': self.kind, 'description': self.description, 'default': self.default}
+        if self.minimum is not None:
+            info['minimum'] = self.minimum
+        if self.maximum is not None:
+            info['maximum'] = self.maximum
+        if self.choices:
+            info['choices'] = list(self.choices)
+        return info
+
+
+def bind(spec, source):
+    """
+    Validate the parameters of a query from query args or a JSON body.
+
+    Returns {name: value} for every declared parameter (the default, or
+    None for an unused filter); raises ValueError for invalid values.
+    """
+    source = source or {}
+    values = {}
+    for name, param in spec.items():
+        raw = source.get(name)
+        if raw is None or raw == '':
+            values[name] = param.default
+        else:
+            values[name] = param.convert(name, raw)
+    if values.get('von') and values.get('bis') and values['von'] > values['bis']:
+        raise ValueError('von darf nicht nach bis liegen')
+    return values
+
+
+def cache_key(values):
+    """Hashable, order-independent form of bound values (part of the result cache key)."""
+    return tuple(sorted(values.items()))
+
+
+def render(sql, spec, values):
+    """
+    Return (sql, params) for a query template and bound values.
+
+    Every `{clause}` marker in the template is replaced by the conditions
+    of the filters that have a value (`{where}` as a WHERE clause, the
+    others as AND terms); values are bound as named parameters. The text
+    only depends on which filters are used, so SQLite's statement cache
+    keeps one prepared statement per combination.
+    """
+    active = tuple((name, len(values[name]) if spec[name].kind == 'list' else None)
+                   for name in spec if spec[name].filter and values[name] is not None)
+    text = _render(sql, tuple(spec.items()), active)
+    params = {}
+    for name, param in spec.items():
+        value = values[name]
+        if param.kind == 'list':
+            if value is not None:
+                for i, item in enumerate(value):
+                    params[f'{name}_{i}'] = param.pattern.format(item) if param.pattern else item
+        elif param.filter is None or value is not None:
+            params[name] = value
+    return text, params
+
+
+@lru_cache(maxsize=512)
+def _render(sql, spec_items, active):
+    spec = dict(spec_items)
+    clauses = {}
+    for name, length in active:
+        param = spec[name]
+        condition = param.filter
+        if length is not None:
+            # One OR term per list item: "col LIKE :name" -> "(col LIKE :name_0 OR ...)"
+            terms = [NAME_PATTERN.sub(lambda m, i=i: f':{m.group(1)}_{i}', condition)
+                     for i in range(length)]
+            condition = f"({' OR '.join(terms)})"
+        clauses.setdefault(param.clause, []).append(condition)
+    for clause in set(re.findall(r'\{(\w+)\}', sql)):
+        conditions = clauses.get(clause, [])
+        if not conditions:
+            replacement = ''
+        elif clause == 'where':
+            replacement = 'WHERE ' + ' AND '.join(conditions)
+        else:
+            replacement = ''.join(f' AND {condition}' for condition in conditions)
+        sql = sql.replace('{' + clause + '}', replacement)
+    return sql
+
+
+def investor_filter(column, clause='filters'):
+    return Param('int', 'Nur Depots dieses Investors (InvestorID)', minimum=1,
+                 filter=f'{column} = :investor', clause=clause)
+
+
+def depot_filter(column, clause='filters'):
+    return Param('int', 'Nur dieses Depot (DepotID)', minimum=1,
+                 filter=f'{column} = :depot', clause=clause)
+
+
+def isin_filter(column, clause='filters'):
+    return Param('isin', 'Nur diese Aktie (ISIN)', filter=f'{column} = :isin', clause=clause)
+
+
+def date_range(column, timestamp=False, clause='filters'):
+    """von/bis filters (inclusive days) on a DATE or, with timestamp=True, a DATETIME column."""
+    # Plain comparisons against constants, so an index on the column serves the range
+    upper = f"{column} < date(:bis, '+1 day')" if timestamp else f'{column} <= :bis'
+    return {
+        'von': Param('date', 'Erster Tag (JJJJ-MM-TT)', filter=f'{column} >= :von', clause=clause),
+        'bis': Param('date', 'Letzter Tag (JJJJ-MM-TT)', filter=upper, clause=clause),
+    }
@@ -0,0 +1,277 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from db_pool import STATEMENT_CACHE_SIZE, PooledConnection
+
+
+class MemoryReplica:
+    """
+    In-memory copies of the database for read-only reports.
+
+    Every replica connection is a private :memory: database loaded from
+    the file with the SQLite backup API, so reports neither wait for disk
+    I/O nor compete with writers for the file. The copies are
+    refreshed when the file changed (PRAGMA data_version of a dedicated
+    source connection), at the latest once they are max_staleness seconds
+    old; a background thread refreshes idle copies every poll_interval,
+    one copy at a time, so requests rarely pay for a reload. The file is
+    checked at most once per poll_interval (a change may be noticed that
+    much later), so acquire() usually does not touch the source
+    connection at all. The number of copies is limited by
+    max_connections and by max_bytes over all copies. If no copy is free
+    (or the database is larger than max_bytes) acquire() returns None and
+    the caller reads from the file instead.
+    """
+
+    def __init__(self, database, max_connections=2, max_staleness=1.0, max_bytes=512 * 1024 * 1024,
+                 poll_interval=0.5, cached_statements=STATEMENT_CACHE_SIZE, name='replica'):
+        self.database = database
+        self.max_connections = max_connections
+        self.max_staleness = max_staleness
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.cached_statements = cached_statements
+        self.name = name
+        self.on_connect = []
+
+        self._source = None
+        self._source_lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._loaded = {}           # id(conn) -> (data_version, loaded_at)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._refresher = None
+        self._wakeup = threading.Event()
+
+        self.size = 0
+        self.version = None         # data_version of the file at the last check
+        self.checked = None         # (monotonic time, version, allowed) of the last check
+        self.changed_at = None      # first time the file was seen ahead of a copy
+        self.open_connections = 0
+        self.in_use = 0
+        self.hits = 0
+        self.fallbacks = 0
+        self.refreshes = 0
+        self.refresh_time = 0.0
+        self.last_refresh_ms = None
+        self.disabled = None
+
+    def _source_connection(self):
+        if self._source is None:
+            self._source = sqlite3.connect(f'file:{self.database}?mode=ro', uri=True,
+                                           check_same_thread=False)
+        return self._source
+
+    def _check(self, force=False):
+        """Current data_version and size of the file; caps the number of copies to max_bytes.
+
+        The result of the last check is reused for poll_interval seconds
+        unless force is set.
+        """
+        checked = self.checked
+        if not force and checked is not None and time.monotonic() - checked[0] < self.poll_interval:
+            return checked[1], checked[2]
+        with self._source_lock:
+            source = self._source_connection()
+            version = source.execute("PRAGMA data_version").fetchone()[0]
+            page_size = source.execute("PRAGMA page_size").fetchone()[0]
+            size = source.execute("PRAGMA page_count").fetchone()[0] * page_size
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                if self.changed_at is None:
+                    self.changed_at = time.monotonic()
+            self.size = size
+            allowed = min(self.max_connections, self.max_bytes // size if size else self.max_connections)
+            self.disabled = None if allowed else 'Datenbank größer als die Speichergrenze'
+            self.checked = (time.monotonic(), version, allowed)
+        return version, allowed
+
+    def _load(self, conn):
+        """Copy the file into a replica connection (backup API, one consistent step)."""
+        started = time.perf_counter()
+        conn.execute("PRAGMA query_only = OFF")
+        with self._source_lock:
+            source = self._source_connection()
+            version = source.execute("PRAGMA data_version").fetchone()[0]
+            source.backup(conn)
+        conn.execute("PRAGMA query_only = ON")
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._loaded[id(conn)] = (version, time.monotonic())
+            self.version = version
+            self.refreshes += 1
+            self.refresh_time += elapsed
+            self.last_refresh_ms = round(elapsed * 1000, 2)
+            if all(loaded[0] == self.version for loaded in self._loaded.values()):
+                self.changed_at = None
+
+    def _connect(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA temp_store = MEMORY")
+        for hook in self.on_connect:
+            hook(conn)
+        return conn
+
+    def _stale(self, conn, version):
+        """True if a copy is behind the file and older than max_staleness."""
+        loaded_version, loaded_at = self._loaded.get(id(conn), (None, 0))
+        return loaded_version != version and time.monotonic() - loaded_at >= self.max_staleness
+
+    def acquire(self):
+        """PooledConnection to an up-to-date copy, or None if the file should be read instead."""
+        if self._closed:
+            return None
+        self._start_refresher()
+        version, allowed = self._check()
+        conn = None
+        with self._lock:
+            if self.open_connections - self.in_use > 0:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    pass
+            if conn is None and self.open_connections < allowed:
+                self.open_connections += 1
+                conn = False
+            if conn is None:
+                self.fallbacks += 1
+                return None
+            self.in_use += 1
+        try:
+            if conn is False:
+                conn = self._connect()
+                self._load(conn)
+            elif self._stale(conn, version):
+                self._load(conn)
+        except Exception:
+            with self._lock:
+                self.in_use -= 1
+                self.open_connections -= 1
+                self.fallbacks += 1
+            if conn:
+                self._discard(conn)
+            raise
+        with self._lock:
+            self.hits += 1
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        """Return a copy (called by PooledConnection.close); copies over the memory cap are dropped."""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self.in_use -= 1
+            over = self.size and (self.open_connections * self.size > self.max_bytes)
+            if self._closed or over:
+                self.open_connections -= 1
+            else:
+                self._idle.put(conn)
+                return
+        self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._loaded.pop(id(conn), None)
+        conn.close()
+
+    def _start_refresher(self):
+        if self._refresher is None and self.poll_interval:
+            with self._lock:
+                if self._refresher is None:
+                    self._refresher = threading.Thread(target=self._refresh_loop,
+                                                       name=f'{self.name}-refresh', daemon=True)
+                    self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.poll_interval)
+            if self._closed:
+                break
+            try:
+                self.refresh_idle()
+            except sqlite3.Error:
+                pass
+
+    def refresh_idle(self):
+        """Reload the idle copies that are behind the file (off the request path).
+
+        Only one copy at a time is taken out of the idle queue, so the
+        others stay available to requests while it reloads.
+        """
+        version, _ = self._check(force=True)
+        refreshed = set()
+        while True:
+            conn = self._take_behind(version, refreshed)
+            if conn is None:
+                return
+            refreshed.add(id(conn))
+            try:
+                self._load(conn)
+            finally:
+                self._idle.put(conn)
+
+    def _take_behind(self, version, skip):
+        """Remove and return one idle copy not loaded at version (None if all are current)."""
+        with self._lock:
+            idle = []
+            while True:
+                try:
+                    idle.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            behind = None
+            for conn in idle:
+                if (behind is None and id(conn) not in skip
+                        and self._loaded.get(id(conn), (None,))[0] != version):
+                    behind = conn
+            for conn in reversed(idle):
+                if conn is not behind:
+                    self._idle.put(conn)
+            return behind
+
+    def lag(self):
+        """Seconds since the file changed without all copies having caught up (0 if current)."""
+        with self._lock:
+            return time.monotonic() - self.changed_at if self.changed_at is not None else 0.0
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self.open_connections -= 1
+            self._discard(conn)
+        with self._source_lock:
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+
+    def stats(self):
+        lag = self.lag()
+        with self._lock:
+            return {
+                'name': self.name,
+                'open_connections': self.open_connections,
+                'max_connections': self.max_connections,
+                'in_use': self.in_use,
+                'hits': self.hits,
+                'fallbacks': self.fallbacks,
+                'database_bytes': self.size,
+                'memory_bytes': self.size * self.open_connections,
+                'max_bytes': self.max_bytes,
+                'max_staleness_s': self.max_staleness,
+                'lag_s': round(lag, 3),
+                'refreshes': self.refreshes,
+                'refresh_time_ms': round(self.refresh_time * 1000, 2),
+                'last_refresh_ms': self.last_refresh_ms,
+                'disabled': self.disabled,
+            }
@@ -0,0 +1,102 @@
+import gzip
+import json
+import zlib
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency, the standard json module is used without it
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency, only gzip is offered without it
+    brotli = None
+
+
+# Result layouts: columns once plus rows as arrays, or one object per row
+FORMATS = ('columns', 'records')
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html')
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps(value):
+    """Encode a value as compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def dumps_text(value):
+    return dumps(value).decode()
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson when it is installed.
+
+    Keys are sorted like with Flask's default provider; pretty-printing
+    (debug mode) and values orjson cannot encode fall back to the default.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default,
+                                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+
+def as_format(payload, fmt):
+    """
+    Convert a columnar result payload ('columns' + 'rows') into the requested layout.
+
+    'records' replaces the rows by a 'results' list with one object per row.
+    """
+    if fmt != 'records':
+        return payload
+    columns = payload['columns']
+    converted = {key: value for key, value in payload.items() if key != 'rows'}
+    converted['results'] = [dict(zip(columns, row)) for row in payload['rows']]
+    return converted
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """Pick the content coding for a request's Accept-Encoding (None = identity)."""
+    return accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compress a streamed body chunk by chunk.
+
+    Every chunk is flushed, so clients still receive rows as they are
+    produced (at a slightly lower compression ratio).
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk.encode() if isinstance(chunk, str) else chunk)
+            yield data + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            yield data + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
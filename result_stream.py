@@ -0,0 +1,341 @@
+import base64
+import json
+import sqlite3
+
+from response_encoding import dumps_text
+
+
+FETCH_BATCH_SIZE = 500
+
+
+def strip_sql(sql):
+    """Remove surrounding whitespace and trailing semicolons so a query can be wrapped."""
+    return sql.strip().rstrip(';').strip()
+
+
+def encode_cursor(position):
+    """
+    Encode a result position as an opaque pagination token.
+
+    position is an offset (custom queries and job results) or a keyset
+    cursor (key, sent) from keyset_cursor (predefined queries).
+    """
+    if isinstance(position, int):
+        raw = {'o': position}
+    else:
+        key, sent = position
+        raw = {'k': list(key), 'n': sent}
+    raw = json.dumps(raw, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Decode a pagination token into an offset or a (key, sent) keyset cursor.
+
+    Returns None without a token; raises ValueError for malformed tokens.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if 'k' in raw:
+            key, sent = raw['k'], raw['n']
+            if (isinstance(key, list) and isinstance(sent, int) and sent > 0
+                    and all(v is None or isinstance(v, (str, int, float)) for v in key)):
+                return tuple(key), sent
+        elif isinstance(raw['o'], int) and raw['o'] >= 0:
+            return raw['o']
+    except Exception:
+        pass
+    raise ValueError('Ungültiges Pagination-Token')
+
+
+def sort_keys(order, columns):
+    """
+    Keyset sort keys [(column, descending)] of a result.
+
+    order names the sort columns of the query ('-' prefix for descending);
+    all other columns follow as ascending tie-breakers, so only rows that
+    are equal in every column share a key. Columns named with a '~' prefix
+    are left out entirely: their value changes between requests (e.g. it
+    is computed from the current time), so a cursor could not hold it.
+    """
+    skipped = {name[1:] for name in order if name.startswith('~')}
+    keys = [(name.lstrip('-'), name.startswith('-')) for name in order if not name.startswith('~')]
+    named = {column for column, _ in keys} | skipped
+    return keys + [(column, False) for column in columns if column not in named]
+
+
+def _key(columns, keys):
+    positions = [columns.index(column) for column, _ in keys]
+    return lambda row: tuple(row[i] for i in positions)
+
+
+def keyset_cursor(columns, rows, keys, after=None):
+    """
+    Cursor (key, sent) after the last row of a page.
+
+    sent counts the rows with exactly that key sent so far (usually 1,
+    more for duplicate rows), so the next page skips exactly those.
+    """
+    key = _key(columns, keys)
+    last = key(rows[-1])
+    sent = 0
+    for row in reversed(rows):
+        if key(row) != last:
+            break
+        sent += 1
+    if sent == len(rows) and after is not None and tuple(after[0]) == last:
+        sent += after[1]
+    return last, sent
+
+
+def _not_before(keys, key):
+    """SQL condition for rows sorted at or after `key`; SQLite sorts NULL first (last if DESC)."""
+    terms = []
+    for i, (column, descending) in enumerate(keys):
+        prefix = [f'"{c}" IS NULL' if key[j] is None else f'"{c}" = :page_key_{j}'
+                  for j, (c, _) in enumerate(keys[:i])]
+        if key[i] is None:
+            later = None if descending else f'"{column}" IS NOT NULL'
+        elif descending:
+            later = f'("{column}" < :page_key_{i} OR "{column}" IS NULL)'
+        else:
+            later = f'"{column}" > :page_key_{i}'
+        if later is not None:
+            terms.append('(' + ' AND '.join(prefix + [later]) + ')')
+    terms.append('(' + ' AND '.join(f'"{c}" IS NULL' if key[j] is None else f'"{c}" = :page_key_{j}'
+                                     for j, (c, _) in enumerate(keys)) + ')')
+    return ' OR '.join(terms)
+
+
+def keyset_sql(sql, keys, after=None):
+    """
+    Wrap a SELECT so that it returns its rows in key order from a cursor on.
+
+    The page is bound with :page_limit, the cursor key with :page_key_<i>
+    (see keyset_params). Rows equal to the cursor key come first; the
+    caller drops the ones already sent (see fetch_keyset_page).
+    """
+    order = ', '.join(f'"{column}"' + (' DESC' if descending else '') for column, descending in keys)
+    where = f"WHERE {_not_before(keys, after[0])} " if after is not None else ''
+    return f"SELECT * FROM ({strip_sql(sql)}) {where}ORDER BY {order} LIMIT :page_limit"
+
+
+def keyset_params(params, limit, after=None):
+    """Named parameters for keyset_sql: the query's own, the page size and the cursor key."""
+    params = dict(params, page_limit=limit + 1 + (after[1] if after is not None else 0))
+    if after is not None:
+        params.update((f'page_key_{i}', value) for i, value in enumerate(after[0]) if value is not None)
+    return params
+
+
+def _skip_sent(rows, key, after):
+    """Drop the rows of the cursor key that earlier pages already contained."""
+    if after is None:
+        return rows
+    skip = 0
+    while skip < min(after[1], len(rows)) and key(rows[skip]) == tuple(after[0]):
+        skip += 1
+    return rows[skip:]
+
+
+_columns = {}
+
+
+def result_columns(conn, sql, params):
+    """Column names of a statement (run with LIMIT 0 once per statement text)."""
+    columns = _columns.get(sql)
+    if columns is None:
+        cursor = conn.execute(f"SELECT * FROM ({strip_sql(sql)}) LIMIT 0", params)
+        columns = _columns[sql] = [description[0] for description in cursor.description]
+    return columns
+
+
+def fetch_keyset_page(conn, sql, params, order, after=None, limit=None, timer=None):
+    """
+    Fetch one page of a query in keyset order (see sort_keys), after a cursor.
+
+    Unlike LIMIT/OFFSET the database does not produce and discard the rows
+    of earlier pages, and rows inserted or deleted before the cursor do not
+    shift the page. params must be a dict (named placeholders).
+    Returns (columns, rows, has_more) like fetch_page.
+    """
+    keys = sort_keys(order, result_columns(conn, sql, params))
+    cursor = conn.execute(keyset_sql(sql, keys, after), keyset_params(params, limit, after))
+    if timer is not None:
+        timer.mark('execute')
+    columns = [description[0] for description in cursor.description]
+    rows = _skip_sent(cursor.fetchall(), _key(columns, keys), after)
+    if timer is not None:
+        timer.mark('fetch')
+        timer.rows = min(len(rows), limit)
+    return columns, rows[:limit], len(rows) > limit
+
+
+def _sortable(value):
+    # SQLite order of storage classes: NULL, numbers, text, blobs
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, value) if isinstance(value, str) else (3, value)
+
+
+def keyset_page(columns, rows, order, after=None, limit=None):
+    """keyset order and paging of fetch_keyset_page for rows computed in Python."""
+    keys = sort_keys(order, columns)
+    key = _key(columns, keys)
+    rows = list(rows)
+    for i in reversed(range(len(keys))):
+        position = columns.index(keys[i][0])
+        rows.sort(key=lambda row: _sortable(row[position]), reverse=keys[i][1])
+    if after is not None:
+        cursor = [_sortable(value) for value in after[0]]
+
+        def not_before(row):
+            for value, bound, (_, descending) in zip(key(row), cursor, keys):
+                value = _sortable(value)
+                if value != bound:
+                    return (value < bound) if descending else (value > bound)
+            return True
+        rows = _skip_sent([row for row in rows if not_before(row)], key, after)
+    return columns, rows[:limit], len(rows) > limit
+
+
+def paginate_sql(sql, named=False):
+    """Wrap a SELECT so that a page can be fetched with (limit, offset) parameters.
+
+    With named=True they are :page_limit and :page_offset, for statements
+    that bind named parameters.
+    """
+    if named:
+        return f"SELECT * FROM ({strip_sql(sql)}) LIMIT :page_limit OFFSET :page_offset"
+    return f"SELECT * FROM ({strip_sql(sql)}) LIMIT ? OFFSET ?"
+
+
+def fetch_page(conn, sql, params=(), offset=0, limit=None, max_rows=None, timer=None):
+    """
+    Execute a query and fetch at most one page of rows.
+
+    Without a limit the whole result is fetched, capped at max_rows.
+    params may be a sequence or, for named placeholders, a dict.
+    An optional instrumentation.QueryTimer gets the execute/fetch times.
+    Returns (columns, rows, has_more).
+    """
+    if limit is not None and isinstance(params, dict):
+        cursor = conn.execute(paginate_sql(sql, named=True),
+                              {**params, 'page_limit': limit + 1, 'page_offset': offset})
+        cap = limit
+    elif limit is not None:
+        cursor = conn.execute(paginate_sql(sql), (*params, limit + 1, offset))
+        cap = limit
+    else:
+        cursor = conn.execute(sql, params)
+        cap = max_rows
+    if timer is not None:
+        timer.mark('execute')
+    columns = [description[0] for description in cursor.description]
+    if cap is None:
+        rows, has_more = cursor.fetchall(), False
+    else:
+        rows = cursor.fetchmany(cap + 1)
+        has_more = len(rows) > cap
+        rows = rows[:cap]
+    if timer is not None:
+        timer.mark('fetch')
+        timer.rows = len(rows)
+    return columns, rows, has_more
+
+
+def iter_rows(cursor, batch_size=FETCH_BATCH_SIZE, fetch=None):
+    """Yield rows from a cursor in fetchmany batches (fetch(cursor, size) replaces fetchmany)."""
+    while True:
+        rows = fetch(cursor, batch_size) if fetch is not None else cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def stream_error(error):
+    """Message for an error that ended a stream early."""
+    return 'Zeitlimit überschritten' if str(error) == 'interrupted' else str(error)
+
+
+def stream_ndjson(cursor, max_rows=None, max_bytes=None, fetch=None, done=None):
+    """
+    Yield one JSON object per row (newline-delimited), stopping at the row/byte caps.
+
+    A stream cut short by the caps or by an error ends with a
+    {"truncated": true, ...} line (with the error, if any). done() is
+    called as soon as no more rows are read, before the last line is sent.
+    """
+    columns = [description[0] for description in cursor.description]
+    sent_rows = sent_bytes = 0
+    trailer = None
+    try:
+        for row in iter_rows(cursor, fetch=fetch):
+            line = dumps_text(dict(zip(columns, row))) + '\n'
+            sent_bytes += len(line.encode())
+            if (max_rows is not None and sent_rows >= max_rows) or (
+                    max_bytes is not None and sent_bytes > max_bytes):
+                trailer = {'truncated': True, 'row_count': sent_rows}
+                break
+            sent_rows += 1
+            yield line
+    except sqlite3.Error as e:
+        trailer = {'truncated': True, 'row_count': sent_rows, 'error': stream_error(e)}
+    finally:
+        if done is not None:
+            done()
+    if trailer is not None:
+        yield json.dumps(trailer) + '\n'
+
+
+def stream_json(cursor, header=None, max_rows=None, max_bytes=None, fmt='columns', fetch=None, done=None):
+    """
+    Yield a JSON document of the same shape as the non-streaming responses,
+    writing the rows array (or the results array for fmt='records') chunk by chunk.
+
+    If an error (e.g. the time limit) ends the result early, the rows sent
+    so far are closed off and the document ends with "truncated": true and
+    the "error", so it stays valid JSON. done() is called as soon as no
+    more rows are read, before the trailer is sent.
+    """
+    columns = [description[0] for description in cursor.description]
+    head = dict(header or {})
+    head['columns'] = columns
+    key = 'results' if fmt == 'records' else 'rows'
+    yield dumps_text(head)[:-1] + f', "{key}": ['
+
+    sent_rows = sent_bytes = 0
+    truncated = False
+    error = None
+    chunk = []
+    try:
+        for row in iter_rows(cursor, fetch=fetch):
+            item = dumps_text(dict(zip(columns, row)) if fmt == 'records' else tuple(row))
+            sent_bytes += len(item.encode()) + 1
+            if (max_rows is not None and sent_rows >= max_rows) or (
+                    max_bytes is not None and sent_bytes > max_bytes):
+                truncated = True
+                break
+            chunk.append(item)
+            sent_rows += 1
+            if len(chunk) >= FETCH_BATCH_SIZE:
+                yield (',' if sent_rows > len(chunk) else '') + ','.join(chunk)
+                chunk = []
+    except sqlite3.Error as e:
+        truncated, error = True, stream_error(e)
+    finally:
+        if done is not None:
+            done()
+    if chunk:
+        yield (',' if sent_rows > len(chunk) else '') + ','.join(chunk)
+
+    trailer = f'], "row_count": {sent_rows}, "truncated": {json.dumps(truncated)}'
+    if error is not None:
+        trailer += f', "error": {json.dumps(error)}'
+    yield trailer + '}'
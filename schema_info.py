@@ -0,0 +1,121 @@
+import threading
+
+
+# All dashboard counters in one statement: every table is scanned at most once.
+STATISTICS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM Investor) AS total_investors,
+        d.total_depots,
+        d.active_depots,
+        (SELECT COUNT(*) FROM Aktie) AS total_stocks,
+        u.total_companies,
+        t.total_transactions,
+        t.total_volume,
+        u.countries,
+        u.industries
+    FROM (SELECT COUNT(*) AS total_depots,
+                 COUNT(CASE WHEN Status = 'Aktiv' THEN 1 END) AS active_depots
+          FROM Depot) d,
+         (SELECT COUNT(*) AS total_companies,
+                 COUNT(DISTINCT Land) AS countries,
+                 COUNT(DISTINCT Branche) AS industries
+          FROM Unternehmen) u,
+         (SELECT COUNT(*) AS total_transactions,
+                 COALESCE(ROUND(SUM(Gesamtwert), 2), 0) AS total_volume
+          FROM Transaktionen) t
+"""
+
+
+def database_statistics(conn):
+    """Return the dashboard counters as a dict."""
+    cursor = conn.execute(STATISTICS_SQL)
+    row = cursor.fetchone()
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def schema_version(conn):
+    """SQLite's schema cookie; it changes with every CREATE/ALTER/DROP."""
+    return conn.execute("PRAGMA schema_version").fetchone()[0]
+
+
+def user_tables(conn):
+    cursor = conn.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type='table' AND name NOT LIKE 'sqlite_%'
+        ORDER BY name
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_metadata(conn):
+    """Return {table: {'columns': [...], 'foreign_keys': [...]}} for all user tables."""
+    metadata = {}
+    for table in user_tables(conn):
+        columns = [{
+            'name': row[1],
+            'type': row[2],
+            'not_null': bool(row[3]),
+            'primary_key': bool(row[5]),
+        } for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+        foreign_keys = [{
+            'column': row[3],
+            'references_table': row[2],
+            'references_column': row[4],
+        } for row in conn.execute(f"PRAGMA foreign_key_list({table})").fetchall()]
+        metadata[table] = {'columns': columns, 'foreign_keys': foreign_keys}
+    return metadata
+
+
+def row_count_sql(tables):
+    """One statement returning (table, exact row count) for every table."""
+    return ' UNION ALL '.join(
+        f"SELECT '{table}', COUNT(*) FROM \"{table}\"" for table in tables)
+
+
+def exact_row_counts(conn, tables):
+    if not tables:
+        return {}
+    return dict(conn.execute(row_count_sql(tables)).fetchall())
+
+
+def approximate_row_counts(conn, tables):
+    """
+    Row counts from the statistics gathered by ANALYZE.
+
+    The first number of every sqlite_stat1 entry is the row count of the
+    table at the time ANALYZE ran. Tables without statistics (never
+    analyzed, or empty when ANALYZE ran) are reported as None.
+    """
+    counts = dict.fromkeys(tables)
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'").fetchone()
+    if exists is None:
+        return counts
+    for table, stat in conn.execute("SELECT tbl, MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 "
+                                    "GROUP BY tbl").fetchall():
+        if table in counts:
+            counts[table] = stat
+    return counts
+
+
+class SchemaCache:
+    """Table metadata cached until PRAGMA schema_version changes."""
+
+    def __init__(self):
+        self.version = None
+        self.metadata = None
+        self._lock = threading.Lock()
+
+    def get(self, conn):
+        """Return (schema_version, metadata), reading the PRAGMAs only after a schema change."""
+        version = schema_version(conn)
+        with self._lock:
+            if self.metadata is None or self.version != version:
+                self.metadata = table_metadata(conn)
+                self.version = version
+            return self.version, self.metadata
+
+    def clear(self):
+        with self._lock:
+            self.version = None
+            self.metadata = None
@@ -0,0 +1,345 @@
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from db_pool import ConnectionPool
+
+
+MANIFEST = 'shards.json'
+REFERENCE_FILE = 'reference.db'
+REFERENCE_SCHEMA = 'ref'
+
+# Shared reference data, kept once in reference.db; all other tables are
+# split by InvestorID (directly or through their DepotID)
+REFERENCE_TABLES = ('Unternehmen', 'Aktie', 'Kursverlauf')
+# Present in every file (change counters for the result cache)
+COMMON_TABLES = ('Tabellenversion',)
+
+# Partial results of all shards are combined in an in-memory table of this name
+PARTIAL_TABLE = 'Teilergebnis'
+
+# Table-level foreign key clause (with a comment line before it, if any)
+_FOREIGN_KEY = re.compile(r',(?:\s|--[^\n]*)*FOREIGN\s+KEY\s*\((\w+)\)\s*REFERENCES\s+(\w+)\s*\((\w+)\)', re.I)
+
+
+def shard_path(directory, index):
+    return os.path.join(directory, f'shard_{index:02d}.db')
+
+
+def shard_of(investor_id, count):
+    """Shard number of an investor; depots, transactions etc. follow their investor."""
+    return int(investor_id) % count
+
+
+def _remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _shard_filter(conn, table, index, count):
+    """WHERE clause selecting the rows of one shard from the source table."""
+    columns = {row[1] for row in conn.execute(f"PRAGMA src.table_info({table})")}
+    if 'InvestorID' in columns:
+        return f"WHERE InvestorID % {count} = {index}"
+    if 'DepotID' in columns:
+        return (f"WHERE DepotID IN (SELECT DepotID FROM src.Depot "
+                f"WHERE InvestorID % {count} = {index})")
+    return ''
+
+
+def _split_reference_keys(sql):
+    """
+    Remove the foreign keys into reference tables from a CREATE TABLE statement.
+
+    A shard file has no Aktie table, and SQLite resolves foreign keys in
+    the child's own file, so these keys would make every write to the
+    table fail. Returns (sql, [[column, table, column], ...]) with the
+    removed keys; they are checked by _attach_reference instead.
+    """
+    keys = []
+
+    def strip(match):
+        if match.group(2) in REFERENCE_TABLES:
+            keys.append(list(match.groups()))
+            return ''
+        return match.group(0)
+    return _FOREIGN_KEY.sub(strip, sql), keys
+
+
+def build_shards(source, directory, count):
+    """
+    Split a database into reference.db plus `count` shard files.
+
+    Unternehmen, Aktie and Kursverlauf go to reference.db; Investor,
+    Telefonnummer and every table keyed by DepotID (Depot, Transaktionen,
+    Position, HistorischerDepotwert, realized gains, snapshots) are split
+    by InvestorID % count. Remaining tables (e.g. status rows) are copied
+    to every shard. Rows are copied before indexes and triggers are
+    created, so the Position triggers do not fire for existing data.
+    Foreign keys of shard tables into the reference tables are recorded in
+    the manifest (reference_keys) instead of the table definition.
+    Existing files in the directory are replaced. Returns the manifest.
+    """
+    if count < 1:
+        raise ValueError('Die Anzahl der Shards muss mindestens 1 sein')
+    os.makedirs(directory, exist_ok=True)
+    src = sqlite3.connect(source)
+    objects = src.execute(
+        "SELECT type, name, tbl_name, sql FROM sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' ORDER BY rowid").fetchall()
+    version = src.execute("PRAGMA user_version").fetchone()[0]
+    src.close()
+    tables = [name for kind, name, _, _ in objects if kind == 'table']
+
+    reference_keys = {}
+    targets = [(os.path.join(directory, REFERENCE_FILE), None)]
+    targets += [(shard_path(directory, i), i) for i in range(count)]
+    for path, index in targets:
+        if index is None:
+            wanted = [t for t in tables if t in REFERENCE_TABLES or t in COMMON_TABLES]
+        else:
+            wanted = [t for t in tables if t not in REFERENCE_TABLES]
+        _remove_database(path)
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("ATTACH DATABASE ? AS src", (source,))
+            conn.execute("BEGIN")
+            for kind, name, _, sql in objects:
+                if kind == 'table' and name in wanted:
+                    if index is not None:
+                        sql, keys = _split_reference_keys(sql)
+                        if keys:
+                            reference_keys[name] = keys
+                    conn.execute(sql)
+            for table in wanted:
+                where = _shard_filter(conn, table, index, count) if index is not None else ''
+                conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table} {where}")
+            for kind, _, table, sql in objects:
+                if kind in ('index', 'trigger') and table in wanted:
+                    conn.execute(sql)
+            conn.commit()
+            conn.execute("DETACH DATABASE src")
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+
+    manifest = {
+        'count': count,
+        'reference': REFERENCE_FILE,
+        'shards': [os.path.basename(shard_path(directory, i)) for i in range(count)],
+        'reference_keys': reference_keys,
+        'source': os.path.abspath(source),
+        'created': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _attach_reference(reference, readonly, reference_keys=None):
+    """
+    on_connect hook: make the reference tables visible under their plain names.
+
+    Foreign keys stay on for the keys within the shard. The keys into the
+    reference tables (see _split_reference_keys) are checked by TEMP
+    triggers on write connections, the only triggers allowed to read an
+    attached database. Deleting a referenced stock is not checked; the
+    reference tables are not written in a sharded deployment.
+    """
+    target = f'file:{reference}?mode=ro' if readonly else reference
+
+    def hook(conn):
+        conn.execute(f"ATTACH DATABASE ? AS {REFERENCE_SCHEMA}", (target,))
+        if readonly:
+            return
+        for table, keys in (reference_keys or {}).items():
+            for column, parent, parent_column in keys:
+                for name, event in (('insert', 'INSERT'), ('update', f'UPDATE OF {column}')):
+                    conn.execute(f"""
+                        CREATE TEMP TRIGGER IF NOT EXISTS trg_fk_{table}_{column}_{name}
+                        BEFORE {event} ON main.{table}
+                        WHEN NEW.{column} IS NOT NULL AND NOT EXISTS
+                            (SELECT 1 FROM {REFERENCE_SCHEMA}.{parent} WHERE {parent_column} = NEW.{column})
+                        BEGIN
+                            SELECT RAISE(ABORT, 'FOREIGN KEY constraint failed');
+                        END
+                    """)
+    return hook
+
+
+# Connections of a scatter worker process, one per shard file
+_worker_connections = {}
+
+
+def _query_shard(path, reference, sql, params):
+    """Run one statement on a shard (in a worker process); returns (columns, rows)."""
+    conn = _worker_connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"ATTACH DATABASE ? AS {REFERENCE_SCHEMA}", (f'file:{reference}?mode=ro',))
+        _worker_connections[path] = conn
+    cursor = conn.execute(sql, params)
+    return [description[0] for description in cursor.description], cursor.fetchall()
+
+
+def merge_partials(columns, parts, merge_sql):
+    """
+    Combine the partial results of all shards with merge_sql.
+
+    The rows are loaded into an in-memory table named Teilergebnis (with
+    the partial result's column names); merge_sql re-aggregates and orders
+    them. Returns (columns, rows).
+    """
+    conn = sqlite3.connect(':memory:')
+    try:
+        quoted = ', '.join(f'"{column}"' for column in columns)
+        conn.execute(f"CREATE TABLE {PARTIAL_TABLE} ({quoted})")
+        insert = f"INSERT INTO {PARTIAL_TABLE} VALUES ({', '.join('?' * len(columns))})"
+        for rows in parts:
+            conn.executemany(insert, rows)
+        cursor = conn.execute(merge_sql)
+        return [description[0] for description in cursor.description], cursor.fetchall()
+    finally:
+        conn.close()
+
+
+class ShardSet:
+    """
+    The files of a sharded deployment (see build_shards).
+
+    Every shard has a read-only and a write connection pool; each
+    connection has reference.db attached, so the unchanged query text runs
+    on any shard. Queries for one investor or depot are routed to its
+    shard; everything else is scattered to all shards on a process pool
+    and the partial results are merged (see merge_partials).
+    """
+
+    def __init__(self, directory, workers=None, pool_size=4, pragmas=None):
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.directory = directory
+        self.count = manifest['count']
+        self.reference = os.path.join(directory, manifest['reference'])
+        self.paths = [os.path.join(directory, name) for name in manifest['shards']]
+        self.reference_keys = manifest.get('reference_keys', {})
+        self.workers = workers or min(self.count, os.cpu_count() or 1)
+        self.pool_size = pool_size
+        self.pragmas = pragmas
+        self._pools = {}
+        self._depots = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+        self.routed = 0
+        self.scatters = 0
+
+    def _pool(self, index, readonly):
+        key = (index, readonly)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = ConnectionPool(self.paths[index], max_connections=self.pool_size,
+                                          readonly=readonly, pragmas=self.pragmas,
+                                          name=f"shard{index}-{'read' if readonly else 'write'}")
+                    pool.on_connect.append(
+                        _attach_reference(self.reference, readonly, self.reference_keys))
+                    self._pools[key] = pool
+        return pool
+
+    def connect(self, index, readonly=True):
+        """Pooled connection to one shard (reference tables attached)."""
+        return self._pool(index, readonly).acquire()
+
+    def shard_for_investor(self, investor_id):
+        return shard_of(investor_id, self.count)
+
+    def route(self, investor_id=None, depot_id=None):
+        """Shard of an investor (or else of a depot) for a routed query; None for an unknown depot."""
+        index = (self.shard_for_investor(investor_id) if investor_id is not None
+                 else self.shard_for_depot(depot_id))
+        with self._lock:
+            self.routed += 1
+        return index
+
+    def shard_for_depot(self, depot_id):
+        """Shard holding a depot (looked up once, then cached); None if unknown."""
+        index = self._depots.get(depot_id)
+        if index is None:
+            for i in range(self.count):
+                with self.connect(i) as conn:
+                    row = conn.execute("SELECT InvestorID FROM Depot WHERE DepotID = ?",
+                                       (depot_id,)).fetchone()
+                if row is not None:
+                    index = self._depots[depot_id] = i
+                    break
+        return index
+
+    def table_versions(self):
+        """
+        {table: (version, changed_at)} over all files, like query_cache.table_versions.
+
+        The version of a split table is the tuple of its per-shard versions,
+        so a change in any shard invalidates results that read it. The
+        counters are read through the pooled read connections (reference.db
+        through its attachment on shard 0).
+        """
+        per_table = {}
+        for index in range(self.count):
+            sources = [('main', False)] + ([(REFERENCE_SCHEMA, True)] if index == 0 else [])
+            with self.connect(index) as conn:
+                for schema, is_reference in sources:
+                    rows = conn.execute(
+                        f"SELECT Tabelle, Version, GeaendertAm FROM {schema}.Tabellenversion").fetchall()
+                    for table, version, changed in rows:
+                        if (table in REFERENCE_TABLES) == is_reference:
+                            per_table.setdefault(table, []).append((version, changed))
+        return {table: (tuple(v for v, _ in values),
+                        max((c for _, c in values if c), default=None))
+                for table, values in per_table.items()}
+
+    def scatter(self, sql, params=()):
+        """Run a statement on every shard in parallel; returns (columns, [rows per shard])."""
+        with self._lock:
+            if self._executor is None:
+                # spawn: the web server runs threads, which fork() does not copy safely
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            self.scatters += 1
+            executor = self._executor
+        futures = [executor.submit(_query_shard, path, self.reference, sql, params)
+                   for path in self.paths]
+        results = [future.result() for future in futures]
+        return results[0][0], [rows for _, rows in results]
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def stats(self):
+        with self._lock:
+            routed, scatters = self.routed, self.scatters
+        return {
+            'directory': self.directory,
+            'shards': self.count,
+            'workers': self.workers,
+            'routed_queries': routed,
+            'scatter_queries': scatters,
+            'known_depots': len(self._depots),
+        }
@@ -0,0 +1,344 @@
+import os
+import re
+from datetime import date, timedelta
+
+
+# All archived years share one attached file: SQLite allows only 10
+# attached databases per connection (and sharded connections use one)
+ARCHIVE_FILE = 'historischer_depotwert_archiv.db'
+ARCHIVE_SCHEMA = 'hdw_archiv'
+
+# One file per year, written by earlier versions; merged by merge_partitions
+_PARTITION = re.compile(r'^historischer_depotwert_(\d{4})\.db$')
+
+HISTORY_COLUMNS = 'Datum, DepotID, Gesamtwert, DailyPnL, KumulierterPnL'
+
+# Holdings change by the net quantity traded in [von, bis)
+APPLY_TRANSACTIONS_SQL = """
+    INSERT INTO SnapshotBestand (DepotID, ISIN, Menge)
+    SELECT DepotID, ISIN, SUM(CASE WHEN Typ = 'Kauf' THEN Menge ELSE -Menge END)
+    FROM Transaktionen
+    WHERE Datum >= :von AND Datum < :bis
+    GROUP BY DepotID, ISIN
+    ON CONFLICT (DepotID, ISIN) DO UPDATE SET Menge = Menge + excluded.Menge
+"""
+
+APPLY_CLOSES_SQL = """
+    INSERT INTO SnapshotKurs (ISIN, Datum, Endkurs)
+    SELECT ISIN, Datum, Endkurs FROM Kursverlauf WHERE Datum = :tag
+    ON CONFLICT (ISIN) DO UPDATE SET Datum = excluded.Datum, Endkurs = excluded.Endkurs
+"""
+
+# One row per depot that holds stocks, traded that day or was worth
+# something the day before. DailyPnL is the change in value minus the net
+# amount invested that day (buys - sells).
+VALUATION_SQL = """
+    WITH vorher AS MATERIALIZED (SELECT DepotID, LetzterWert, SummePnL FROM DepotwertUebersicht),
+    wert AS (
+        SELECT b.DepotID, SUM(b.Menge * k.Endkurs) AS Wert
+        FROM SnapshotBestand b
+        JOIN SnapshotKurs k ON k.ISIN = b.ISIN
+        GROUP BY b.DepotID
+    ),
+    zufluss AS (
+        SELECT DepotID, SUM(CASE WHEN Typ = 'Kauf' THEN Gesamtwert ELSE -Gesamtwert END) AS Netto
+        FROM Transaktionen
+        WHERE Datum >= :von AND Datum < :bis
+        GROUP BY DepotID
+    )
+    INSERT INTO HistorischerDepotwert (Datum, DepotID, Gesamtwert, DailyPnL, KumulierterPnL)
+    SELECT :tag, d.DepotID,
+           ROUND(COALESCE(w.Wert, 0), 2),
+           ROUND(COALESCE(w.Wert, 0) - COALESCE(v.LetzterWert, 0) - COALESCE(z.Netto, 0), 2),
+           ROUND(COALESCE(v.SummePnL, 0)
+                 + ROUND(COALESCE(w.Wert, 0) - COALESCE(v.LetzterWert, 0) - COALESCE(z.Netto, 0), 2), 2)
+    FROM Depot d
+    LEFT JOIN wert w ON w.DepotID = d.DepotID
+    LEFT JOIN zufluss z ON z.DepotID = d.DepotID
+    LEFT JOIN vorher v ON v.DepotID = d.DepotID
+    WHERE w.DepotID IS NOT NULL OR z.DepotID IS NOT NULL OR v.LetzterWert <> 0
+"""
+
+
+def _next_day(day):
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def archive_path(directory):
+    return os.path.join(directory, ARCHIVE_FILE)
+
+
+def archive_partitions(directory):
+    """Return [(year, path)] for all per-year partition files of earlier versions, oldest first."""
+    partitions = []
+    if directory and os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            match = _PARTITION.match(filename)
+            if match:
+                partitions.append((int(match.group(1)), os.path.join(directory, filename)))
+    return sorted(partitions)
+
+
+def attach_archives(conn, directory):
+    """
+    ATTACH the archive file as hdw_archiv if it exists and is not attached yet.
+
+    Cheap enough to call before each use, so an archive created after the
+    connection was opened shows up. Returns the schema names holding
+    HistorischerDepotwert, newest first.
+    """
+    attached = {row[1] for row in conn.execute("PRAGMA database_list").fetchall()}
+    if ARCHIVE_SCHEMA not in attached and directory and os.path.exists(archive_path(directory)):
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_path(directory),))
+        attached.add(ARCHIVE_SCHEMA)
+    return ['main'] + ([ARCHIVE_SCHEMA] if ARCHIVE_SCHEMA in attached else [])
+
+
+def history_sql(schemas):
+    """All valuations across the main table and the attached partitions."""
+    return ' UNION ALL '.join(f"SELECT {HISTORY_COLUMNS} FROM {schema}.HistorischerDepotwert"
+                              for schema in schemas)
+
+
+def _status(conn):
+    row = conn.execute("SELECT LetztesDatum, NeuBerechnen FROM SnapshotStatus WHERE ID = 1").fetchone()
+    return row if row is not None else (None, 1)
+
+
+def _rebuild_summary(conn, schemas):
+    history = history_sql(schemas)
+    conn.execute(f"""
+        UPDATE main.HistorischerDepotwert AS h
+        SET KumulierterPnL = c.Kumuliert
+        FROM (SELECT DepotID, Datum,
+                     ROUND(SUM(DailyPnL) OVER (PARTITION BY DepotID ORDER BY Datum), 2) AS Kumuliert
+              FROM ({history})) AS c
+        WHERE h.DepotID = c.DepotID AND h.Datum = c.Datum AND h.KumulierterPnL IS NOT c.Kumuliert
+    """)
+    conn.execute("DELETE FROM DepotwertUebersicht")
+    conn.execute(f"""
+        WITH h AS ({history})
+        INSERT INTO DepotwertUebersicht
+            (DepotID, ErsterTag, ErsterWert, LetzterTag, LetzterWert, SummePnL, AnzahlBewertungen)
+        SELECT f.DepotID, f.Datum, f.Gesamtwert, l.Datum, l.Gesamtwert, l.Summe, l.Anzahl
+        FROM (SELECT DepotID, MIN(Datum) AS Datum, Gesamtwert FROM h GROUP BY DepotID) f
+        JOIN (SELECT DepotID, MAX(Datum) AS Datum, Gesamtwert, ROUND(SUM(DailyPnL), 2) AS Summe,
+                     COUNT(*) AS Anzahl
+              FROM h GROUP BY DepotID) l ON l.DepotID = f.DepotID
+    """)
+    conn.execute("UPDATE SnapshotStatus SET NeuBerechnen = 0")
+
+
+def refresh_summary(conn, directory=None):
+    """
+    Rebuild DepotwertUebersicht and the running PnL sums if valuations were
+    changed, deleted or inserted out of order. Returns True if it rebuilt.
+    """
+    schemas = attach_archives(conn, directory)
+    if not _status(conn)[1]:
+        return False
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _rebuild_summary(conn, schemas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+
+def rebuild_summary(conn, directory=None):
+    """Recompute the summary from all valuations, regardless of the status flag."""
+    conn.execute("UPDATE SnapshotStatus SET NeuBerechnen = 1")
+    conn.commit()
+    return refresh_summary(conn, directory)
+
+
+def _start_state(conn, last_day):
+    """Holdings and closing prices at the end of last_day (None: before all data)."""
+    conn.execute("DELETE FROM SnapshotBestand")
+    conn.execute("DELETE FROM SnapshotKurs")
+    if last_day is None:
+        return
+    conn.execute(APPLY_TRANSACTIONS_SQL, {'von': '', 'bis': _next_day(last_day)})
+    conn.execute("DELETE FROM SnapshotBestand WHERE Menge = 0")
+    conn.execute("""
+        INSERT INTO SnapshotKurs (ISIN, Datum, Endkurs)
+        SELECT ISIN, MAX(Datum), Endkurs FROM Kursverlauf WHERE Datum <= ? GROUP BY ISIN
+    """, (last_day,))
+
+
+def take_snapshots(conn, until=None, directory=None):
+    """
+    Value every depot for each trading day after the last snapshot.
+
+    The engine keeps the holdings and the last closing price per stock as
+    of the last valued day, so each new day costs three set-based
+    statements: apply that day's transactions, apply that day's closing
+    prices and insert one valuation per depot. On the first run it starts
+    after the newest existing valuation (or at the first price if there is
+    none). Valuations are append-only: transactions booked later for days
+    already valued do not change them. Returns the number of days valued.
+    """
+    until = until or date.today().isoformat()
+    schemas = attach_archives(conn, directory)
+    last_day, rebuild = _status(conn)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if rebuild:
+            _rebuild_summary(conn, schemas)
+        if last_day is None:
+            last_day = conn.execute(
+                f"SELECT MAX(Datum) FROM ({history_sql(schemas)})").fetchone()[0]
+            _start_state(conn, last_day)
+
+        days = [row[0] for row in conn.execute(
+            "SELECT DISTINCT Datum FROM Kursverlauf WHERE Datum > ? AND Datum <= ? ORDER BY Datum",
+            (last_day or '', until)).fetchall()]
+        start = _next_day(last_day) if last_day else ''
+        for day in days:
+            window = {'von': start, 'bis': _next_day(day), 'tag': day}
+            conn.execute(APPLY_TRANSACTIONS_SQL, window)
+            conn.execute("DELETE FROM SnapshotBestand WHERE Menge = 0")
+            conn.execute(APPLY_CLOSES_SQL, window)
+            conn.execute(VALUATION_SQL, window)
+            start = window['bis']
+        if days:
+            conn.execute("UPDATE SnapshotStatus SET LetztesDatum = ?", (days[-1],))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(days)
+
+
+def _valuation_before(conn, schemas, depot_id, day):
+    """Last valuation of a depot on or before day (newest partition first)."""
+    for schema in schemas:
+        row = conn.execute(f"""
+            SELECT Datum, Gesamtwert, KumulierterPnL FROM {schema}.HistorischerDepotwert
+            WHERE DepotID = ? AND Datum <= ? ORDER BY Datum DESC LIMIT 1
+        """, (depot_id, day)).fetchone()
+        if row is not None:
+            return row
+    return None
+
+
+def depot_performance(conn, depot_id, start=None, end=None, directory=None):
+    """
+    Performance of one depot between two dates.
+
+    Uses the last valuation on or before each date and the running PnL
+    sums, i.e. at most one index lookup per partition and date. Without a
+    valuation before start the first valuation is the baseline. Returns
+    None if the depot has no valuations.
+    """
+    schemas = attach_archives(conn, directory)
+    summary = conn.execute(
+        "SELECT ErsterTag, ErsterWert, LetzterTag FROM DepotwertUebersicht WHERE DepotID = ?",
+        (depot_id,)).fetchone()
+    if summary is None:
+        return None
+    last = _valuation_before(conn, schemas, depot_id, end or summary[2])
+    if last is None:
+        return None
+    first = _valuation_before(conn, schemas, depot_id, start) if start else None
+    if first is None:
+        first = (summary[0], summary[1], 0)
+    absolute = last[1] - first[1]
+    return {
+        'DepotID': depot_id,
+        'StartDatum': first[0],
+        'StartWert': first[1],
+        'EndDatum': last[0],
+        'EndWert': last[1],
+        'AbsolutePerformance': round(absolute, 2),
+        'RelativePerformance': round(absolute / first[1] * 100, 2) if first[1] else None,
+        'PnL': round((last[2] or 0) - (first[2] or 0), 2),
+    }
+
+
+def _create_archive(conn, directory):
+    """Attach the archive file (created if missing) as hdw_archiv with its table."""
+    os.makedirs(directory, exist_ok=True)
+    if ARCHIVE_SCHEMA not in {row[1] for row in conn.execute("PRAGMA database_list").fetchall()}:
+        conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive_path(directory),))
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.HistorischerDepotwert (
+            Datum DATE NOT NULL,
+            DepotID INTEGER NOT NULL,
+            Gesamtwert DECIMAL(12, 2) NOT NULL,
+            DailyPnL DECIMAL(12, 2) NOT NULL DEFAULT 0,
+            KumulierterPnL DECIMAL(14, 2),
+            PRIMARY KEY (DepotID, Datum)
+        )
+    """)
+
+
+def merge_partitions(conn, directory):
+    """
+    Move per-year partition files of earlier versions into the archive file.
+
+    Each file is attached on its own, copied and removed, so any number of
+    years fits within the attach limit. Returns the years merged.
+    """
+    partitions = archive_partitions(directory)
+    if not partitions:
+        return []
+    _create_archive(conn, directory)
+    for year, path in partitions:
+        alias = f'hdw_{year}'
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"""
+                INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.HistorischerDepotwert ({HISTORY_COLUMNS})
+                SELECT {HISTORY_COLUMNS} FROM {alias}.HistorischerDepotwert
+            """)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute(f"DETACH DATABASE {alias}")
+        os.remove(path)
+    return [year for year, _ in partitions]
+
+
+def archive_year(conn, year, directory):
+    """
+    Move the valuations of one year into the archive file.
+
+    The archive is a separate SQLite file (historischer_depotwert_archiv.db)
+    holding every archived year, which attach_archives makes visible to
+    every connection. Archived rows keep their running sums and still
+    count in the summary. Returns the number of rows moved.
+    """
+    if _status(conn)[1]:
+        refresh_summary(conn, directory)
+    _create_archive(conn, directory)
+    bounds = (f'{year}-01-01', f'{year + 1}-01-01')
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"""
+            INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.HistorischerDepotwert ({HISTORY_COLUMNS})
+            SELECT {HISTORY_COLUMNS} FROM main.HistorischerDepotwert WHERE Datum >= ? AND Datum < ?
+        """, bounds)
+        moved = conn.execute(
+            "DELETE FROM main.HistorischerDepotwert WHERE Datum >= ? AND Datum < ?", bounds).rowcount
+        # Moving rows does not change any valuation
+        conn.execute("UPDATE SnapshotStatus SET NeuBerechnen = 0")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return moved
+
+
+def archive_before(conn, year, directory):
+    """Archive every year before `year`; returns {year: rows moved}."""
+    merge_partitions(conn, directory)
+    years = [int(row[0]) for row in conn.execute(
+        "SELECT DISTINCT substr(Datum, 1, 4) FROM HistorischerDepotwert WHERE Datum < ? ORDER BY 1",
+        (f'{year}-01-01',)).fetchall()]
+    return {y: archive_year(conn, y, directory) for y in years}